@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from app.core.security import require_admin
+
+# Mọi API quản trị (số liệu nội bộ, token/chi phí theo phiên, nạp lại Knowledge Base) yêu cầu ADMIN_TOKEN
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+# Giữ tham chiếu tới các task nền để không bị thu gom giữa chừng
+_background_tasks = set()
+
+@router.get("/admin/metrics")
+async def get_metrics():
+    """Thống kê nội bộ của pipeline chat (định tuyến, speculative execution, RAG)."""
+    from app.services.chat.orchestrator import chat_orchestrator
+    from app.services.chat.speculation import speculation_stats
+    from app.services.rag.engine import rag_service
+    from app.services.rag.batching import batchers
+    from app.services.llm.governor import llm_governor
+    from app.services.llm.client import llm_client
+    from app.core.database import db_stats
+    from app.services.llm.usage import llm_usage
+    from app.services.chat.turns import turn_registry
+
+    return {
+        "router": chat_orchestrator.intent_router.snapshot(),
+        "speculation": speculation_stats.snapshot(),
+        "rag": dict(rag_service.stats),
+        "retriever": dict(rag_service.retriever.stats) if rag_service.retriever else {},
+        "inference_batching": {name: batcher.snapshot() for name, batcher in batchers.items()},
+        "llm_governor": llm_governor.snapshot(),
+        "llm_client": llm_client.snapshot(),
+        "database": dict(db_stats),
+        "turns": turn_registry.snapshot(),
+        "llm_usage": {k: v for k, v in llm_usage.snapshot().items() if k not in ("by_site", "top_sessions")},
+        "knowledge_base": rag_service.status(),
+    }
+
+@router.get("/admin/llm-usage")
+async def get_llm_usage(session_id: str = None):
+    """Token và chi phí LLM theo vị trí gọi/tool/model và các phiên dùng nhiều nhất; truyền `session_id` để xem một phiên (từ DB)."""
+    from app.services.llm.usage import llm_usage
+    if session_id:
+        return await llm_usage.session_report(session_id)
+    return llm_usage.snapshot()
+
+@router.get("/admin/knowledge-base")
+async def get_knowledge_base_status():
+    """Phiên bản chỉ mục hiện tại và thông tin lần nạp lại gần nhất."""
+    from app.services.rag.engine import rag_service
+    return rag_service.status()
+
+@router.post("/admin/knowledge-base/reload", status_code=202)
+async def reload_knowledge_base(force: bool = False):
+    """Nạp lại Knowledge Base ở nền; chỉ mục mới được hoán đổi khi dựng xong."""
+    from app.services.rag.engine import rag_service
+
+    status = rag_service.status()
+    if status["reloading"]:
+        return JSONResponse(status_code=409, content={"message": "Đang nạp lại Knowledge Base.", **status})
+
+    async def run_reload():
+        try:
+            await rag_service.reload(force=force)
+        except Exception as e:
+            logging.error(f"Lỗi nạp lại Knowledge Base: {e}")
+
+    task = asyncio.create_task(run_reload())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return {"message": "Đã bắt đầu nạp lại Knowledge Base.", **status}
@@ -0,0 +1,67 @@
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.core.security import require_admin
+
+# Công cụ đánh giá nội bộ (mỗi lần gọi tới BATCH_MAX_ITEMS câu hỏi qua LLM): chỉ cho phép với ADMIN_TOKEN
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.post("/batch")
+async def batch_evaluate(request: Request, concurrency: int = None):
+    """
+    Đánh giá hàng loạt: body là JSONL, mỗi dòng {"id"?, "question", "context"?, "history"?, "expected_contains"?}.
+    Trả về NDJSON theo thứ tự hoàn thành (mỗi dòng một kết quả kèm latency_ms), dòng cuối là {"summary": ...}.
+    Các phiên chỉ nằm trong bộ nhớ, không ghi xuống DB (kể cả llm_usage).
+    """
+    from app.services.chat.batch import run_batch
+
+    items = []
+    for number, line in enumerate((await request.body()).decode("utf-8").splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Dòng {number} không phải JSON hợp lệ.")
+        item = item if isinstance(item, dict) else {"question": item}
+        if not isinstance(item.get("question"), str) or not item["question"].strip():
+            raise HTTPException(status_code=400, detail=f"Dòng {number}: \"question\" phải là chuỗi không rỗng.")
+        if not isinstance(item.get("context") or {}, dict):
+            raise HTTPException(status_code=400, detail=f"Dòng {number}: \"context\" phải là object.")
+        if not isinstance(item.get("history") or [], list):
+            raise HTTPException(status_code=400, detail=f"Dòng {number}: \"history\" phải là mảng.")
+        items.append(item)
+    if not items:
+        raise HTTPException(status_code=400, detail="Không có câu hỏi nào.")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {settings.BATCH_MAX_ITEMS} câu hỏi mỗi lần.")
+    # Không chạy quá số suất LLM dành cho đánh giá hàng loạt (để chừa suất cho người dùng thật)
+    concurrency = max(1, min(concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY, settings.BATCH_LLM_MAX_IN_FLIGHT))
+
+    async def ndjson():
+        started = time.perf_counter()
+        latencies, errors, passed, checked = [], 0, 0, 0
+        async for result in run_batch(items, concurrency):
+            latencies.append(result.get("latency_ms", 0.0))
+            errors += "error" in result
+            if "passed" in result:
+                checked += 1
+                passed += result["passed"]
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+        latencies.sort()
+        summary = {
+            "items": len(items),
+            "errors": errors,
+            "concurrency": concurrency,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "latency_p50_ms": latencies[len(latencies) // 2],
+            "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
+        if checked:
+            summary["pass_rate"] = round(passed / checked, 3)
+        yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
@@ -1,27 +1,205 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse, JSONResponse
 from app.schemas.chat import ChatInput
+from app.core.tracing import start_trace, observe_turn
+import asyncio
+import json
 import logging
 
 router = APIRouter()
 
+def _resume_response(turn, start: int):
+    """Phát lại lượt từ bộ đệm (không chạy lại pipeline)."""
+    from app.services.chat.turns import turn_registry
+    headers = {"X-Turn-Id": turn.turn_id, "X-Turn-Resumed": "true"}
+    return StreamingResponse(turn_registry.sse(turn, start), media_type="text/event-stream", headers=headers)
+
+@router.get("/stream/{turn_id}")
+async def resume_stream(turn_id: str, last_event_id: str = None, session_id: str = None, user_id: str = None,
+                        last_event_header: str = Header(None, alias="Last-Event-ID")):
+    """
+    Nối lại stream của một lượt chat sau khi mất kết nối, tiếp từ sau Last-Event-ID (header hoặc query).
+    Lượt thuộc một phiên/người dùng chỉ được đọc khi truyền đúng session_id (hoặc user_id) đã gửi câu hỏi.
+    """
+    from app.services.chat.turns import turn_registry
+
+    turn = await turn_registry.resume(turn_id)
+    if turn is not None and turn.scope and turn.scope != (session_id or user_id):
+        turn = None
+    if turn is None:
+        raise HTTPException(status_code=404, detail="Lượt chat không còn trong bộ đệm, vui lòng gửi lại câu hỏi.")
+    resume = turn_registry.parse_event_id(last_event_header or last_event_id)
+    start = resume[1] + 1 if resume and resume[0] == turn.turn_id else 0
+    return _resume_response(turn, start)
+
 @router.post("/stream")
-async def chat_stream(input_data: ChatInput):
+async def chat_stream(input_data: ChatInput, last_event_id: str = Header(None, alias="Last-Event-ID")):
     """API endpoint để chat với bot (Streaming - ChatGPT style)."""
     if not input_data.question:
         raise HTTPException(status_code=400, detail="Câu hỏi không được để trống.")
         
     from app.services.chat.orchestrator import chat_orchestrator
+    from app.services.llm.governor import llm_governor, AdmissionRejected
+    from app.services.chat.turns import turn_registry
+
+    # Client gửi lại sau khi rớt kết nối kèm Last-Event-ID: tiếp tục từ bộ đệm của lượt cũ thay vì hỏi lại LLM,
+    # chỉ khi lượt đó đúng là câu hỏi này của cùng phiên/người dùng (id lạ hoặc của phiên khác: xử lý bình thường)
+    fingerprint = turn_registry.fingerprint(input_data.question, input_data.session_id, input_data.user_id)
+    resume = turn_registry.parse_event_id(last_event_id)
+    if resume:
+        turn = await turn_registry.resume(resume[0])
+        if turn is not None and turn.fingerprint == fingerprint:
+            return _resume_response(turn, resume[1] + 1)
+        logging.info(f"Không nối lại được lượt {resume[0]} (không còn trong bộ đệm hoặc không khớp câu hỏi), xử lý lại câu hỏi")
+
+    # Kiểm soát tải: từ chối nhanh (429) thay vì để request chờ LLM tới timeout
+    try:
+        llm_governor.check_admission(input_data.user_id or input_data.session_id)
+    except AdmissionRejected as e:
+        return JSONResponse(status_code=429, content={"detail": e.reason, "retry_after": e.retry_after}, headers={"Retry-After": str(e.retry_after)})
     
     logging.info(f"DEBUG: Yêu cầu streaming cho user_id='{input_data.user_id}' session_id='{input_data.session_id}'")
+    # Đo thời gian từng bước của lượt chat (histogram /metrics, sự kiện timing cuối stream)
+    trace = start_trace()
     
     async def event_generator():
+        outcome = "ok"
         try:
              async for chunk in chat_orchestrator.process_message_stream(input_data.question, input_data.session_id, input_data.user_id):
+                 trace.mark_first_byte()
                  yield chunk
+        except AdmissionRejected as e:
+             # Quá tải giữa chừng (chờ suất gọi LLM quá hạn)
+             outcome = "rejected"
+             yield f"data: {json.dumps({'error': e.reason, 'retry_after': e.retry_after})}\n\n"
         except Exception as e:
+             outcome = "error"
              logging.error(f"Stream error: {e}")
-             import json
              yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        observe_turn(trace, "stream", outcome)
+        if input_data.include_timing:
+             yield f"data: {json.dumps({'timing': trace.as_dict()})}\n\n"
+
+    # Gửi trùng (bấm lại, retry mạng, idempotency key giống nhau): gắn vào lượt đang chạy hoặc phát lại kết quả,
+    # không chạy lại pipeline (tránh gọi LLM và ghi tin nhắn hai lần)
+    key = turn_registry.turn_key(input_data.question, input_data.session_id, input_data.user_id, input_data.idempotency_key)
+    turn, coalesced = await turn_registry.submit(
+        key, event_generator, scope=input_data.session_id or input_data.user_id, fingerprint=fingerprint
+    )
+    # Trả header ngay (client có X-Turn-Id để nối lại kể cả khi rớt trước sự kiện đầu tiên);
+    # thời gian từng bước (trích xuất, lịch sử, chọn tool...) nằm trong sự kiện `timing` cuối stream
+    headers = {"X-Turn-Id": turn.turn_id}
+    if coalesced:
+        headers["X-Turn-Coalesced"] = "true"
+    return StreamingResponse(turn_registry.sse(turn), media_type="text/event-stream", headers=headers)
+
+
+def _ws_frame(event: str):
+    """Chuyển sự kiện SSE của orchestrator thành frame WebSocket có kiểu (token/options/courses/error)."""
+    if not event.startswith("data: "):
+        return None
+    payload = json.loads(event[len("data: "):])
+    if "text_chunk" in payload:
+        return {"type": "token", "text": payload["text_chunk"]}
+    if "options" in payload:
+        return {"type": "options", "options": payload["options"]}
+    if "courses" in payload:
+        return {"type": "courses", "courses": payload["courses"]}
+    if "error" in payload:
+        frame = {"type": "error", "message": payload["error"]}
+        if "retry_after" in payload:
+            frame["retry_after"] = payload["retry_after"]
+        return frame
+    return None
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket, session_id: str = None, user_id: str = None):
+    """
+    Chat qua WebSocket: gắn với một phiên suốt kết nối, ngữ cảnh slot và lịch sử gần đây giữ trong bộ nhớ.
+    Client gửi {"question": "..."} (hoặc text thuần), {"type": "cancel"} để dừng câu trả lời đang chạy.
+    Server gửi các frame {"type": "session" | "token" | "options" | "courses" | "error" | "cancelled" | "done", "turn": n, ...}.
+    Câu hỏi mới gửi khi câu trả lời trước chưa xong sẽ hủy câu trả lời đó.
+    """
+    from app.services.chat.orchestrator import chat_orchestrator
+    from app.services.chat.memory import InMemorySession
+    from app.services.llm.governor import llm_governor, AdmissionRejected
+
+    await websocket.accept()
+    memory = await InMemorySession.load(session_id, user_id)
+    await websocket.send_json({"type": "session", "session_id": memory.session_id, "context": memory.context})
+
+    async def run_turn(turn_no: int, question: str, include_timing: bool):
+        trace = start_trace()
+        outcome = "ok"
+        try:
+            async for event in chat_orchestrator.process_message_stream(question, memory.session_id, user_id, memory=memory):
+                frame = _ws_frame(event)
+                if frame:
+                    trace.mark_first_byte()
+                    await websocket.send_json({**frame, "turn": turn_no})
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except AdmissionRejected as e:
+            outcome = "rejected"
+            await websocket.send_json({"type": "error", "message": e.reason, "retry_after": e.retry_after, "turn": turn_no})
+        except Exception as e:
+            outcome = "error"
+            logging.error(f"WebSocket turn error: {e}")
+            await websocket.send_json({"type": "error", "message": str(e), "turn": turn_no})
+        finally:
+            observe_turn(trace, "ws", outcome)
+        done = {"type": "done", "turn": turn_no}
+        if include_timing:
+            done["timing"] = trace.as_dict()
+        await websocket.send_json(done)
+
+    async def cancel(task) -> bool:
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        return True
+
+    task = None
+    turn_no = 0
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                message = {"question": raw}
+            if not isinstance(message, dict):
+                message = {"question": str(message)}
+
+            if message.get("type") == "cancel":
+                if await cancel(task):
+                    await websocket.send_json({"type": "cancelled", "turn": turn_no})
+                continue
+
+            question = (message.get("question") or "").strip()
+            if not question:
+                await websocket.send_json({"type": "error", "message": "Câu hỏi không được để trống."})
+                continue
+
+            # Câu hỏi mới thay thế câu trả lời đang chạy
+            if await cancel(task):
+                await websocket.send_json({"type": "cancelled", "turn": turn_no})
+            try:
+                llm_governor.check_admission(user_id or memory.session_id)
+            except AdmissionRejected as e:
+                await websocket.send_json({"type": "error", "message": e.reason, "retry_after": e.retry_after})
+                continue
+
+            turn_no += 1
+            task = asyncio.create_task(run_turn(turn_no, question, bool(message.get("include_timing"))))
+    except WebSocketDisconnect:
+        logging.info(f"WebSocket đóng (session_id='{memory.session_id}')")
+    finally:
+        await cancel(task)
+        await memory.close()
@@ -0,0 +1,17 @@
+import time
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from app.core.readiness import readiness, PROCESS_STARTED_AT
+
+router = APIRouter()
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: tiến trình còn sống và event loop còn phản hồi (không phụ thuộc warm-up)."""
+    return {"status": "ok", "uptime_seconds": round(time.time() - PROCESS_STARTED_AT, 3)}
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: 200 khi mọi thành phần bắt buộc đã warm-up xong, ngược lại 503 kèm trạng thái từng thành phần."""
+    snapshot = readiness.snapshot()
+    return JSONResponse(status_code=200 if snapshot["ready"] else 503, content=snapshot)
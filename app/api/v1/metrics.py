@@ -0,0 +1,20 @@
+import os
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse, Response
+
+router = APIRouter()
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus: histogram thời gian từng bước, trọn lượt và TTFB của lượt chat."""
+    try:
+        from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+    except ImportError:
+        return PlainTextResponse("Chưa cài prometheus_client.", status_code=503)
+
+    registry = REGISTRY
+    # Chạy nhiều worker (gunicorn): gộp số liệu của các worker qua PROMETHEUS_MULTIPROC_DIR
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -10,13 +10,99 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 class Settings:
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    # Token cho các API quản trị (/api/v1/admin/*, /api/v1/batch), gửi qua header X-Admin-Token
+    # hoặc Authorization: Bearer. Không đặt = khóa các API này
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
     KNOWLEDGE_BASE_PATH = "data/knowledge_base.txt"
     MODEL_NAME = "gemini-2.0-flash"
+    # Nhà cung cấp LLM: "gemini" hoặc "fake" (model giả có kịch bản, chạy offline cho load test/phát triển)
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+    # Độ trễ của model giả (ms): trung bình/trung vị, jitter, phân phối ("uniform"/"lognormal"), độ trễ giữa các token
+    FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+    FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "100"))
+    FAKE_LLM_LATENCY_DISTRIBUTION = os.getenv("FAKE_LLM_LATENCY_DISTRIBUTION", "uniform")
+    FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", "0.5"))
+    FAKE_LLM_TOKEN_DELAY_MS = float(os.getenv("FAKE_LLM_TOKEN_DELAY_MS", "15"))
+    # Đuôi chậm và lỗi tạm thời giả lập của model giả
+    FAKE_LLM_SLOW_RATE = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+    FAKE_LLM_SLOW_LATENCY_MS = float(os.getenv("FAKE_LLM_SLOW_LATENCY_MS", "3000"))
+    FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
 
     EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+    # Backend vector store: "numpy" (ma trận trong tiến trình, lưu .npy) hoặc "chroma"
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy")
+    INDEX_DIR = os.getenv("INDEX_DIR", ".cache/index")
+    # Hybrid retrieval: số ứng viên mỗi nhánh, số tài liệu giữ lại, hằng số RRF
+    RETRIEVER_K = int(os.getenv("RETRIEVER_K", "5"))
+    RETRIEVER_TOP_N = int(os.getenv("RETRIEVER_TOP_N", "3"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Bỏ qua rerank khi top-1 sau fusion cách biệt tương đối >= ngưỡng này so với top-2
+    RERANK_SKIP_MARGIN = float(os.getenv("RERANK_SKIP_MARGIN", "0.3"))
+    RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "2048"))
+    # Micro-batching suy luận (embed câu hỏi, rerank) giữa các request đồng thời
+    INFERENCE_BATCHING = os.getenv("INFERENCE_BATCHING", "true").lower() == "true"
+    INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "32"))
+    INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "5"))
+    # Chu kỳ (giây) kiểm tra thay đổi Knowledge Base để tự nạp lại; 0 = tắt
+    KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "30"))
+    # Ngưỡng cosine để trả lời thẳng câu trả lời FAQ có sẵn (không gọi LLM)
+    FAQ_DIRECT_ANSWER_THRESHOLD = float(os.getenv("FAQ_DIRECT_ANSWER_THRESHOLD", "0.9"))
     SCHOOL_API_URL = os.getenv("SCHOOL_API_URL", "http://localhost:8080/api/common-data")
 
+    # Bộ định tuyến ý định cục bộ (bỏ qua bước LLM chọn tool khi đủ tự tin)
+    ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "true").lower() == "true"
+    ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.6"))
+    ROUTER_MIN_MARGIN = float(os.getenv("ROUTER_MIN_MARGIN", "0.08"))
+
+    # Chạy trước (speculative) tool dự đoán song song với LLM chọn tool
+    SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "true").lower() == "true"
+
+    # Giới hạn lời gọi LLM đồng thời (toàn cục / theo người dùng), hàng đợi chờ và thời gian chờ tối đa (giây)
+    LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+    LLM_MAX_IN_FLIGHT_PER_USER = int(os.getenv("LLM_MAX_IN_FLIGHT_PER_USER", "2"))
+    LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+    LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+    # Deadline (giây) theo loại lời gọi LLM, gồm cả các lần thử lại
+    LLM_DEADLINE_EXTRACTION = float(os.getenv("LLM_DEADLINE_EXTRACTION", "8"))
+    LLM_DEADLINE_TOOL_SELECTION = float(os.getenv("LLM_DEADLINE_TOOL_SELECTION", "12"))
+    LLM_DEADLINE_RESPONSE = float(os.getenv("LLM_DEADLINE_RESPONSE", "30"))
+    # Thử lại lỗi tạm thời (backoff lũy thừa, full jitter); SDK Gemini đã tự thử lại thêm một lần bên trong
+    LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+    LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+    # Hedging: gửi thêm một yêu cầu khi yêu cầu đầu chậm hơn p95 (cần đủ mẫu độ trễ)
+    LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+    # Circuit breaker: số lỗi liên tiếp để mở mạch, thời gian (giây) trước khi thử lại
+    LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+    LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+    # Giá LLM (USD / 1 triệu token) để ước tính chi phí; mặc định theo bảng giá gemini-2.0-flash
+    LLM_PRICE_INPUT_PER_1M = float(os.getenv("LLM_PRICE_INPUT_PER_1M", "0.10"))
+    LLM_PRICE_OUTPUT_PER_1M = float(os.getenv("LLM_PRICE_OUTPUT_PER_1M", "0.40"))
+    # Ghi thống kê token xuống DB theo lô: chu kỳ (giây) và số bản ghi tối đa mỗi lô
+    LLM_USAGE_FLUSH_INTERVAL = float(os.getenv("LLM_USAGE_FLUSH_INTERVAL", "10"))
+    LLM_USAGE_FLUSH_BATCH = int(os.getenv("LLM_USAGE_FLUSH_BATCH", "200"))
+    # Ngân sách token mỗi phiên chat; vượt ngưỡng thì rút gọn lịch sử và trả lời không qua LLM khi có thể. 0 = tắt
+    LLM_SESSION_TOKEN_BUDGET = int(os.getenv("LLM_SESSION_TOKEN_BUDGET", "0"))
+
+    # Cửa sổ (giây) gộp lượt chat trùng: cùng idempotency key, hoặc cùng (phiên, câu hỏi) gửi lại
+    # trong khoảng này sau khi lượt trước xong thì được phát lại kết quả thay vì chạy lại
+    TURN_COALESCE_SECONDS = float(os.getenv("TURN_COALESCE_SECONDS", "15"))
+    # Bộ đệm sự kiện SSE mỗi lượt để client nối lại bằng Last-Event-ID: giữ bao lâu sau khi xong (giây) và tối đa bao nhiêu sự kiện
+    TURN_BUFFER_SECONDS = float(os.getenv("TURN_BUFFER_SECONDS", "300"))
+    TURN_BUFFER_MAX_EVENTS = int(os.getenv("TURN_BUFFER_MAX_EVENTS", "2000"))
+    # Gửi comment giữ kết nối SSE sau mỗi khoảng im lặng này (giây) để proxy không cắt stream
+    SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+    # Đánh giá hàng loạt (/api/v1/batch): số câu chạy đồng thời mặc định/tối đa và số câu tối đa mỗi lần
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+    BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+    # Số suất gọi LLM đồng thời tối đa của cả lượt đánh giá hàng loạt (phải nhỏ hơn LLM_MAX_IN_FLIGHT để
+    # chừa suất cho người dùng thật); số câu chạy đồng thời không vượt quá giá trị này
+    BATCH_LLM_MAX_IN_FLIGHT = int(os.getenv("BATCH_LLM_MAX_IN_FLIGHT", str(max(1, LLM_MAX_IN_FLIGHT // 2))))
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+
 settings = Settings()
 
-if not settings.GOOGLE_API_KEY:
+if not settings.GOOGLE_API_KEY and settings.LLM_PROVIDER == "gemini":
     logging.warning("Thiếu GOOGLE_API_KEY")
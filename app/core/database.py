@@ -1,4 +1,5 @@
 import os
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
 
@@ -9,8 +10,15 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql+asyncpg://admin:admin123@lo
 if DATABASE_URL and DATABASE_URL.startswith("postgresql://"):
     DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
 
-# Khởi tạo Async Engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Khởi tạo Async Engine (DATABASE_ECHO=false để tắt log SQL, ví dụ khi chạy load test)
+engine = create_async_engine(DATABASE_URL, echo=os.getenv("DATABASE_ECHO", "true").lower() == "true")
+
+# Đếm số câu lệnh SQL đã chạy (load test tính số lần gọi DB mỗi lượt chat qua /admin/metrics)
+db_stats = {"statements": 0}
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    db_stats["statements"] += 1
 
 # Tạo Session Factory
 AsyncSessionLocal = sessionmaker(
@@ -0,0 +1,42 @@
+import asyncio
+import gc
+import logging
+import os
+import time
+
+
+async def _load_shared_state():
+    from app.services.rag.engine import rag_service
+    from app.services.external.school_api import external_api_service
+    from app.services.chat.orchestrator import chat_orchestrator
+
+    # Mô hình embeddings/reranker + chỉ mục RAG (chỉ đọc sau khi dựng)
+    await rag_service.initialize()
+    # Snapshot dữ liệu tuyển sinh
+    await external_api_service.fetch_all_data()
+    # Centroid của bộ định tuyến ý định (client LLM vẫn tạo lười trong từng worker)
+    await chat_orchestrator.intent_router._ensure_fitted()
+
+
+def preload_shared_state():
+    """
+    Nạp trước trong tiến trình master (gunicorn preload) các thành phần chỉ đọc: mô hình, chỉ mục,
+    snapshot dữ liệu tuyển sinh. Worker được fork sau đó dùng chung các trang bộ nhớ này (copy-on-write).
+    Không mở kết nối Database/Redis/LLM ở đây: trạng thái có thể thay đổi luôn được tạo riêng trong worker.
+    """
+    # Tokenizers (Rust) không an toàn khi fork sau khi đã chạy song song
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    started = time.perf_counter()
+    asyncio.run(_load_shared_state())
+
+    # Đưa toàn bộ object hiện có vào thế hệ "permanent": GC trong worker không duyệt (và không ghi)
+    # lên các trang này, tránh phá vỡ chia sẻ copy-on-write
+    gc.collect()
+    gc.freeze()
+    logging.info(f"Preload hoàn tất sau {time.perf_counter() - started:.2f}s ({gc.get_freeze_count()} object được freeze)")
+
+
+def after_fork():
+    """Gọi trong worker ngay sau khi fork: tạo lại các tài nguyên không dùng chung được."""
+    from app.services.rag.engine import rag_service
+    rag_service.after_fork()
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Thời điểm tiến trình bắt đầu (để đo cold start)
+PROCESS_STARTED_AT = time.time()
+
+
+class ComponentStatus:
+    """Trạng thái khởi động của một thành phần: pending -> warming -> ready | failed."""
+
+    def __init__(self, name: str, required: bool = True):
+        self.name = name
+        self.required = required
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        duration = None
+        if self.started_at is not None:
+            duration = round((self.finished_at or time.time()) - self.started_at, 3)
+        return {
+            "state": self.state,
+            "required": self.required,
+            "duration_seconds": duration,
+            "error": self.error,
+        }
+
+
+class ReadinessRegistry:
+    """Theo dõi warm-up của các thành phần nặng; phục vụ /readyz."""
+
+    def __init__(self):
+        self.components: Dict[str, ComponentStatus] = {}
+        self.ready_at: Optional[float] = None
+
+    def register(self, name: str, required: bool = True) -> ComponentStatus:
+        if name not in self.components:
+            self.components[name] = ComponentStatus(name, required)
+        return self.components[name]
+
+    async def warm(self, name: str, fn: Callable[[], Awaitable[Any]], required: bool = True):
+        """Chạy hàm warm-up của một thành phần và ghi nhận kết quả. `fn` ném exception nếu thất bại."""
+        component = self.register(name, required)
+        component.state = "warming"
+        component.started_at = time.time()
+        try:
+            await fn()
+            component.state = "ready"
+            logging.info(f"Warm-up '{name}' hoàn tất sau {time.time() - component.started_at:.2f}s")
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e)
+            logging.error(f"Warm-up '{name}' thất bại: {e}")
+        finally:
+            component.finished_at = time.time()
+            if self.ready_at is None and self.is_ready():
+                self.ready_at = time.time()
+
+    async def warm_all(self, tasks: Dict[str, Callable[[], Awaitable[Any]]], optional: tuple = ()):
+        """Warm-up đồng thời nhiều thành phần."""
+        for name in tasks:
+            self.register(name, required=name not in optional)
+        await asyncio.gather(*(self.warm(name, fn, required=name not in optional) for name, fn in tasks.items()))
+
+    def is_ready(self) -> bool:
+        required = [c for c in self.components.values() if c.required]
+        return bool(required) and all(c.state == "ready" for c in required)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "ready": self.is_ready(),
+            "cold_start_seconds": round(self.ready_at - PROCESS_STARTED_AT, 3) if self.ready_at else None,
+            "components": {name: c.snapshot() for name, c in self.components.items()},
+        }
+
+
+readiness = ReadinessRegistry()
@@ -0,0 +1,17 @@
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from app.core.config import settings
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None), authorization: Optional[str] = Header(None)):
+    """Dependency cho API quản trị: yêu cầu ADMIN_TOKEN (header X-Admin-Token hoặc Authorization: Bearer)."""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="API quản trị chưa được bật (chưa cấu hình ADMIN_TOKEN).")
+    token = x_admin_token
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):].strip()
+    if not token or not secrets.compare_digest(token.encode("utf-8"), settings.ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Thiếu hoặc sai token quản trị.", headers={"WWW-Authenticate": "Bearer"})
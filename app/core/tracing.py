@@ -0,0 +1,102 @@
+import contextvars
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    from prometheus_client import Histogram
+except ImportError:  # prometheus_client là tùy chọn: thiếu thì chỉ đo theo lượt (sự kiện timing)
+    Histogram = None
+
+# Bucket (giây): từ tra cứu bộ nhớ vài ms tới lời gọi LLM hàng chục giây
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+if Histogram is not None:
+    STAGE_SECONDS = Histogram("chat_stage_duration_seconds", "Thời gian từng bước xử lý lượt chat", ["stage"], buckets=LATENCY_BUCKETS)
+    TURN_SECONDS = Histogram("chat_turn_duration_seconds", "Thời gian trọn một lượt chat", ["endpoint", "outcome"], buckets=LATENCY_BUCKETS)
+    TTFB_SECONDS = Histogram("chat_turn_ttfb_seconds", "Thời gian tới sự kiện SSE đầu tiên", ["endpoint"], buckets=LATENCY_BUCKETS)
+else:
+    STAGE_SECONDS = TURN_SECONDS = TTFB_SECONDS = None
+
+
+class TurnTrace:
+    """Thời gian (ms) cộng dồn theo bước của một lượt chat; các task con (speculation, to_thread) ghi chung."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.ttfb_ms: Optional[float] = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds * 1000
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def mark_first_byte(self):
+        if self.ttfb_ms is None:
+            self.ttfb_ms = self.elapsed_ms()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "stages_ms": {stage: round(ms, 1) for stage, ms in self.stages.items()},
+            "ttfb_ms": round(self.ttfb_ms, 1) if self.ttfb_ms is not None else None,
+            "total_ms": round(self.elapsed_ms(), 1),
+        }
+
+
+# Trace của lượt chat hiện tại (được kế thừa bởi các task con tạo trong lượt)
+current_trace: contextvars.ContextVar[Optional[TurnTrace]] = contextvars.ContextVar("turn_trace", default=None)
+
+
+def start_trace() -> TurnTrace:
+    trace = TurnTrace()
+    current_trace.set(trace)
+    return trace
+
+
+def record(stage: str, seconds: float):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+    if STAGE_SECONDS is not None:
+        STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+@contextmanager
+def span(stage: str):
+    """Đo thời gian một khối lệnh (dùng được trong cả code async, miễn là không `yield` bên trong khối)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def traced(stage: str):
+    """Decorator đo thời gian hàm (sync hoặc async) như một bước `stage`."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_turn(trace: TurnTrace, endpoint: str, outcome: str):
+    """Ghi histogram trọn lượt và TTFB khi lượt chat kết thúc."""
+    if TURN_SECONDS is None:
+        return
+    TURN_SECONDS.labels(endpoint=endpoint, outcome=outcome).observe(trace.elapsed_ms() / 1000)
+    if trace.ttfb_ms is not None:
+        TTFB_SECONDS.labels(endpoint=endpoint).observe(trace.ttfb_ms / 1000)
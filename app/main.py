@@ -2,7 +2,14 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.v1.chat import router as chat_router
 from app.api.v1.history import router as history_router
+from app.api.v1.admin import router as admin_router
+from app.api.v1.health import router as health_router
+from app.api.v1.metrics import router as metrics_router
+from app.api.v1.batch import router as batch_router
 from app.services.rag.engine import rag_service
+from app.core.config import settings
+from app.core.readiness import readiness
+import asyncio
 import logging
 
 # Cấu hình logging hệ thống
@@ -17,22 +24,84 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cho phép dashboard phía client đọc thời gian từng bước của server
+    expose_headers=["X-Turn-Id", "X-Turn-Coalesced", "X-Turn-Resumed"],
 )
 
 # Đăng ký router
 app.include_router(chat_router, prefix="/api/v1")
 app.include_router(history_router, prefix="/api/v1")
+app.include_router(admin_router, prefix="/api/v1")
+app.include_router(batch_router, prefix="/api/v1")
+app.include_router(health_router)
+app.include_router(metrics_router)
 
 from app.core.database import init_db
 # Import models để đăng ký bảng
 from app.models import chat as chat_models
+from app.models import usage as usage_models
 
-@app.on_event("startup")
-async def startup_event():
-    """Khởi tạo dịch vụ khi ứng dụng bắt đầu."""
+async def _warm_database():
     logging.info("Khởi tạo Database...")
     await init_db()
+
+    # Ghi thống kê token LLM xuống DB theo lô
+    from app.services.llm.usage import llm_usage
+    app.state.usage_flusher = asyncio.create_task(llm_usage.run_flusher(settings.LLM_USAGE_FLUSH_INTERVAL))
+
+async def _warm_rag():
     await rag_service.initialize()
+    if not rag_service.ready:
+        raise RuntimeError("Hệ thống RAG chưa sẵn sàng")
+
+    # Theo dõi thay đổi Knowledge Base để nạp lại nóng (không cần khởi động lại).
+    # Worker preload (gunicorn) không tự nạp lại: mỗi worker dựng chỉ mục riêng sẽ phá vỡ chia sẻ
+    # copy-on-write với master; thay đổi Knowledge Base có hiệu lực khi khởi động lại dịch vụ
+    if rag_service.preloaded:
+        logging.info("Chỉ mục RAG dùng chung từ master (preload): tắt theo dõi Knowledge Base trong worker")
+    elif settings.KB_WATCH_INTERVAL > 0:
+        app.state.kb_watcher = asyncio.create_task(rag_service.watch_knowledge_base(settings.KB_WATCH_INTERVAL))
+
+async def _warm_school_data():
+    from app.services.external.school_api import external_api_service
+    if not await external_api_service.fetch_all_data():
+        raise RuntimeError("Không lấy được dữ liệu tuyển sinh")
+
+async def _warm_cache():
+    from app.services.cache import redis_cache
+    if not await asyncio.to_thread(redis_cache.connect):
+        raise RuntimeError("Redis không khả dụng")
+
+async def _warm_orchestrator():
+    from app.services.chat.orchestrator import chat_orchestrator
+    # Khởi tạo client LLM trước để request đầu tiên không phải chịu chi phí này
+    await asyncio.to_thread(lambda: chat_orchestrator.llm_with_tools)
+
+async def warm_up():
+    """Warm-up đồng thời các thành phần nặng; /readyz phản ánh tiến độ."""
+    await readiness.warm_all(
+        {
+            "database": _warm_database,
+            "rag": _warm_rag,
+            "school_data": _warm_school_data,
+            "cache": _warm_cache,
+            "orchestrator": _warm_orchestrator,
+        },
+        # Thiếu các thành phần này app vẫn phục vụ được (tự lấy lại khi cần)
+        optional=("school_data", "cache"),
+    )
+    logging.info(f"Warm-up hoàn tất: {readiness.snapshot()}")
+
+@app.on_event("startup")
+async def startup_event():
+    """Khởi tạo dịch vụ khi ứng dụng bắt đầu: mở cổng ngay, warm-up chạy nền."""
+    app.state.warm_up = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Ghi nốt thống kê token LLM còn trong bộ nhớ trước khi tắt."""
+    from app.services.llm.usage import llm_usage
+    await llm_usage.flush()
 
 @app.get("/")
 async def root():
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class LLMUsage(Base):
+    """Một lời gọi LLM: số token, độ trễ và chi phí ước tính (ghi theo lô từ LLMUsageTracker)."""
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, nullable=True, index=True)
+    call_type = Column(String)  # Vị trí gọi: extraction, tool_selection, data_response, rag_answer, stream...
+    tool = Column(String, nullable=True)
+    model = Column(String)
+    input_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    latency_ms = Column(Float)
+    cost_usd = Column(Float)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -5,6 +5,10 @@ class ChatInput(BaseModel):
     question: str
     session_id: str = None
     user_id: str = None
+    # Gửi thêm sự kiện `timing` (thời gian từng bước) ở cuối stream
+    include_timing: bool = False
+    # Khóa chống gửi trùng do client sinh cho mỗi câu hỏi: gửi lại cùng khóa sẽ nhận lại đúng câu trả lời đó
+    idempotency_key: str = None
 
 from typing import List, Optional
 
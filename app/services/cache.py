@@ -14,6 +14,16 @@ REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 
 class RedisCache:
     def __init__(self):
+        # Kết nối lười (lazy): không chặn lúc import, kết nối khi dùng lần đầu hoặc lúc warm-up
+        self.client = None
+        self.enabled = False
+        self._connected = False
+
+    def connect(self) -> bool:
+        """Kết nối Redis (chỉ thử một lần). Trả về True nếu Redis khả dụng."""
+        if self._connected:
+            return self.enabled
+        self._connected = True
         try:
             if REDIS_URL:
                 self.client = redis.from_url(REDIS_URL, decode_responses=True)
@@ -24,15 +34,13 @@ class RedisCache:
             
             self.client.ping()
             self.enabled = True
-        except Exception as e:
-            logging.error(f"Failed to connect to Redis: {e}")
-            self.enabled = False
         except Exception as e:
             logging.error(f"Lỗi kết nối Redis: {e}")
             self.enabled = False
+        return self.enabled
 
     def get(self, key: str):
-        if not self.enabled: return None
+        if not self.connect(): return None
         try:
             val = self.client.get(key)
             if val:
@@ -42,7 +50,7 @@ class RedisCache:
         return None
 
     def set(self, key: str, value, ttl: int = 3600):
-        if not self.enabled: return
+        if not self.connect(): return
         try:
             self.client.setex(key, ttl, json.dumps(value))
         except Exception as e:
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import uuid
+from typing import AsyncIterator, Dict, List
+
+from app.core.tracing import start_trace
+from app.services.chat.memory import InMemorySession
+from app.services.llm.governor import current_user, BATCH_USER
+from app.services.llm.usage import persist_usage
+
+
+def _passed(answer: str, expected) -> bool:
+    """Câu trả lời chứa đủ các cụm mong đợi (không phân biệt hoa thường)."""
+    expected = [expected] if isinstance(expected, str) else expected
+    lower = (answer or "").lower()
+    return all(phrase.lower() in lower for phrase in expected)
+
+
+async def evaluate_item(index: int, item: Dict) -> Dict:
+    """
+    Chạy một câu hỏi qua ChatOrchestrator trong phiên dùng một lần (không ghi DB).
+    item: {"id"?, "question", "context"?: {branch, grade, subject}, "history"?: [{role, content}], "expected_contains"?}
+    Mọi lỗi (kể cả dữ liệu sai kiểu) được trả về trong trường "error", không ném ra ngoài.
+    """
+    from app.services.chat.orchestrator import chat_orchestrator
+
+    result = {"index": index, "id": item.get("id"), "question": item.get("question")}
+    trace = start_trace()
+    try:
+        question = item.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError("Câu hỏi phải là chuỗi không rỗng.")
+        context = {"branch": None, "grade": None, "subject": None, **(item.get("context") or {})}
+        memory = InMemorySession(f"batch-{uuid.uuid4()}", context=context, history=item.get("history"), persist=False)
+        # Cả lượt đánh giá dùng chung một danh tính với giới hạn suất LLM riêng (BATCH_LLM_MAX_IN_FLIGHT)
+        answer, _, options, courses = await chat_orchestrator.process_message(
+            question.strip(), memory.session_id, user_id=BATCH_USER, memory=memory
+        )
+        result.update({"answer": answer, "options": options, "courses": courses})
+        if item.get("expected_contains"):
+            result["passed"] = _passed(answer, item["expected_contains"])
+    except Exception as e:
+        logging.error(f"Lỗi đánh giá câu hỏi #{index}: {e}")
+        result["error"] = str(e)
+    result["latency_ms"] = round(trace.elapsed_ms(), 1)
+    result["stages_ms"] = trace.as_dict()["stages_ms"]
+    return result
+
+
+async def run_batch(items: List[Dict], concurrency: int) -> AsyncIterator[Dict]:
+    """
+    Đánh giá hàng loạt với tối đa `concurrency` câu hỏi chạy đồng thời; trả kết quả theo thứ tự hoàn thành
+    (mỗi kết quả có `index` trong danh sách đầu vào). Dừng vòng lặp giữa chừng sẽ hủy các câu đang chạy.
+    """
+    pending: asyncio.Queue = asyncio.Queue()
+    results: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        pending.put_nowait((index, item))
+
+    async def worker():
+        # Phiên đánh giá là phiên tạm: không ghi token vào llm_usage; governor tính theo BATCH_USER
+        persist_usage.set(False)
+        current_user.set(BATCH_USER)
+        while not pending.empty():
+            index, item = pending.get_nowait()
+            try:
+                result = await evaluate_item(index, item)
+            except Exception as e:
+                # Luôn trả một kết quả cho mỗi câu để run_batch không chờ mãi
+                logging.error(f"Lỗi đánh giá câu hỏi #{index}: {e}")
+                result = {"index": index, "id": item.get("id") if isinstance(item, dict) else None, "error": str(e)}
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(items))))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        for task in workers:
+            task.cancel()
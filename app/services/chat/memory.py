@@ -1,11 +1,15 @@
+import asyncio
+import contextvars
 import uuid
 import logging
 from typing import Dict, Optional, List
 from sqlalchemy import select, update
 from app.core.database import AsyncSessionLocal
+from app.core.tracing import traced
 from app.models.chat import ChatSession, ChatMessage
 
 class SessionManager:
+    @traced("db.create_session")
     async def create_session(self, user_id: str = None) -> str:
         """Tạo phiên mới trong DB và trả về session_id."""
         session_id = str(uuid.uuid4())
@@ -20,6 +24,7 @@ class SessionManager:
             result = await db.execute(select(ChatSession).where(ChatSession.id == session_id))
             return result.scalar_one_or_none()
 
+    @traced("db.get_context")
     async def get_context(self, session_id: str) -> Dict[str, Optional[str]]:
         async with AsyncSessionLocal() as db:
             result = await db.execute(select(ChatSession).where(ChatSession.id == session_id))
@@ -32,6 +37,7 @@ class SessionManager:
                 }
         return {"branch": None, "grade": None, "subject": None}
 
+    @traced("db.update_context")
     async def update_context(self, session_id: str, branch: Optional[str] = None, grade: Optional[str] = None, subject: Optional[str] = None):
         async with AsyncSessionLocal() as db:
             # Kiểm tra tồn tại trước cho an toàn, hoặc update trực tiếp
@@ -45,6 +51,7 @@ class SessionManager:
                 await db.execute(query.values(**values))
                 await db.commit()
 
+    @traced("db.add_message")
     async def add_message(self, session_id: str, role: str, content: str, options: list = None, courses: list = None):
         import json
         async with AsyncSessionLocal() as db:
@@ -72,6 +79,7 @@ class SessionManager:
             
             await db.commit()
 
+    @traced("db.get_history")
     async def get_history(self, session_id: str) -> List[Dict]:
         import json
         async with AsyncSessionLocal() as db:
@@ -115,3 +123,84 @@ class SessionManager:
             await db.commit()
 
 session_manager = SessionManager()
+
+
+class InMemorySession:
+    """
+    Trạng thái một phiên giữ trong bộ nhớ (ngữ cảnh slot + lịch sử gần đây), cùng giao diện với SessionManager
+    để ChatOrchestrator dùng thay thế (tham số `memory`): mỗi lượt không phải đọc lại DB.
+    persist=True: các thay đổi vẫn được ghi xuống DB ở nền, đúng thứ tự (gọi close() để ghi nốt);
+    persist=False: phiên dùng một lần, không ghi gì xuống DB.
+    """
+    HISTORY_LIMIT = 10
+
+    def __init__(self, session_id: str, context: Dict[str, Optional[str]] = None, history: List[Dict] = None, persist: bool = True):
+        self.session_id = session_id
+        self.context = context or {"branch": None, "grade": None, "subject": None}
+        self.history = list(history or [])[-self.HISTORY_LIMIT:]
+        self.persist = persist
+        self._writes: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    @classmethod
+    async def load(cls, session_id: str = None, user_id: str = None, persist: bool = True) -> "InMemorySession":
+        """Nạp phiên có sẵn từ DB (một lần), hoặc tạo phiên mới."""
+        if not persist:
+            return cls(session_id or str(uuid.uuid4()), persist=False)
+        if session_id and await session_manager.get_session(session_id):
+            context, history = await asyncio.gather(session_manager.get_context(session_id), session_manager.get_history(session_id))
+            return cls(session_id, context, history)
+        return cls(await session_manager.create_session(user_id=user_id))
+
+    async def create_session(self, user_id: str = None) -> str:
+        return self.session_id
+
+    async def get_context(self, session_id: str) -> Dict[str, Optional[str]]:
+        return dict(self.context)
+
+    async def get_history(self, session_id: str) -> List[Dict]:
+        return list(self.history)
+
+    async def update_context(self, session_id: str, branch: Optional[str] = None, grade: Optional[str] = None, subject: Optional[str] = None):
+        values = {k: v for k, v in (("branch", branch), ("grade", grade), ("subject", subject)) if v}
+        self.context.update(values)
+        if values:
+            self._write(session_manager.update_context(session_id, **values))
+
+    async def add_message(self, session_id: str, role: str, content: str, options: list = None, courses: list = None):
+        msg = {"role": role, "content": content}
+        if options:
+            msg["options"] = options
+        if courses:
+            msg["courses"] = courses
+        self.history = (self.history + [msg])[-self.HISTORY_LIMIT:]
+        self._write(session_manager.add_message(session_id, role, content, options=options, courses=courses))
+
+    def _write(self, coro):
+        """Xếp lệnh ghi DB vào hàng đợi; một task nền ghi lần lượt (ngoài đường trả lời của lượt chat)."""
+        if not self.persist:
+            coro.close()
+            return
+        if self._writer is None:
+            self._writes = asyncio.Queue()
+            # Ngữ cảnh trống: task ghi nền sống qua nhiều lượt, không ghi thời gian vào trace của lượt tạo ra nó
+            self._writer = contextvars.Context().run(asyncio.create_task, self._run_writes())
+        self._writes.put_nowait(coro)
+
+    async def _run_writes(self):
+        while True:
+            coro = await self._writes.get()
+            try:
+                await coro
+            except Exception as e:
+                logging.error(f"Lỗi ghi phiên {self.session_id} xuống DB: {e}")
+            finally:
+                self._writes.task_done()
+
+    async def close(self):
+        """Ghi nốt các thay đổi đang chờ rồi dừng task ghi nền."""
+        if self._writer is None:
+            return
+        await self._writes.join()
+        self._writer.cancel()
+        self._writer = None
@@ -1,23 +1,38 @@
 import logging
 import json
 import asyncio
-from typing import Tuple, List, Any
+import uuid
+from typing import Tuple, List, Any, Optional
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.language_models import BaseChatModel
 
 from app.core.config import settings
+from app.core.tracing import span, traced
+from app.services.llm.factory import create_chat_model
+from app.services.llm.governor import current_user, AdmissionRejected
+from app.services.llm.client import llm_client, LLMUnavailable
+from app.services.llm.usage import llm_usage, current_session, current_tool
 from app.services.chat.memory import session_manager
 from app.services.chat.tools import search_classes, search_general_info, ask_for_branch, ask_for_grade, ask_for_subject
+from app.services.chat.router import IntentRouter
+from app.services.chat.speculation import Speculator, Speculation
+from app.services.rag.engine import rag_service
 from app.services.external.school_api import external_api_service
 
 class ChatOrchestrator:
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model=settings.MODEL_NAME, google_api_key=settings.GOOGLE_API_KEY, temperature=0.3)
+        # LLM được khởi tạo lười (lần dùng đầu tiên hoặc lúc warm-up), không tốn chi phí lúc import
+        self._llm = None
+        self._llm_with_tools = None
         
-        # Liên kết các công cụ (tools) với LLM
+        # Các công cụ (tools) liên kết với LLM
         self.tools = [search_classes, search_general_info, ask_for_branch, ask_for_grade, ask_for_subject]
-        self.llm_with_tools = self.llm.bind_tools(self.tools)
+
+        # Bộ định tuyến cục bộ: bỏ qua LLM chọn tool với các lượt hiển nhiên
+        self.intent_router = IntentRouter()
+        # Chạy trước tool dự đoán song song với LLM chọn tool
+        self.speculator = Speculator()
 
         # Prompt format response (keep existing logic for consistent UI)
         data_response_template = """
@@ -78,6 +93,38 @@ class ChatOrchestrator:
         """
         self.extraction_prompt = PromptTemplate.from_template(extraction_template)
 
+    @property
+    def llm(self) -> BaseChatModel:
+        if self._llm is None:
+            self._llm = create_chat_model(temperature=0.3)
+        return self._llm
+
+    @property
+    def llm_with_tools(self):
+        # Liên kết các công cụ (tools) với LLM
+        if self._llm_with_tools is None:
+            self._llm_with_tools = self.llm.bind_tools(self.tools)
+        return self._llm_with_tools
+
+    def _history_messages(self, raw_history: List[dict], economy: bool = False) -> list:
+        """
+        Chuyển lịch sử chat thành message cho prompt. Phiên vượt ngân sách token chỉ giữ 2 tin gần nhất,
+        các câu hỏi trước đó được tóm tắt thành một dòng (không tốn thêm lời gọi LLM).
+        """
+        messages = []
+        if economy and len(raw_history) > 2:
+            earlier = "; ".join(m["content"] for m in raw_history[:-2] if m["role"] == "user")
+            if earlier:
+                messages.append(SystemMessage(content=f"Tóm tắt các câu hỏi trước: {earlier[:300]}"))
+            raw_history = raw_history[-2:]
+        for msg in raw_history:
+            if msg["role"] == "user":
+                messages.append(HumanMessage(content=msg["content"]))
+            else:
+                messages.append(AIMessage(content=msg["content"]))
+        return messages
+
+    @traced("extract_entities")
     async def _extract_entities(self, text: str) -> Tuple[str, str, str]:
         """Trích xuất Branch, Grade và Subject từ text."""
         try:
@@ -93,12 +140,12 @@ class ChatOrchestrator:
                 valid_grades = ["10", "11", "12"]
 
             chain = self.extraction_prompt | self.llm
-            result = await chain.ainvoke({
+            result = await llm_client.ainvoke(chain, {
                 "valid_branches": str(valid_branches),
                 "valid_grades": str(valid_grades),
                 "valid_subjects": str(valid_subjects),
                 "text": text
-            })
+            }, call_type="extraction")
             
             content = result.content.strip()
             if "|" in content:
@@ -115,15 +162,79 @@ class ChatOrchestrator:
                      return branch, grade, None
 
             return None, None, None
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logging.error(f"Lỗi extract entities: {e}")
             return None, None, None
 
-    async def _generate_data_response(self, question: str, data: dict) -> Tuple[str, List[dict]]:
+    @traced("tool_selection")
+    async def _select_tool(self, messages: list, question: str, context: dict) -> Tuple[AIMessage, Optional[Speculation]]:
+        """
+        Chọn tool: thử bộ định tuyến cục bộ trước, chỉ gọi LLM khi không đủ tự tin.
+        Trong lúc chờ LLM, chạy trước tool có khả năng được chọn; trả về kèm tác vụ khớp (nếu có).
+        """
+        if settings.ROUTER_ENABLED:
+            decision = await self.intent_router.route(question, context)
+            if decision:
+                logging.info(f"Router chose tool: {decision['name']} ({decision['source']}, confidence={decision['confidence']:.2f})")
+                return AIMessage(content="", tool_calls=[{
+                    "name": decision["name"],
+                    "args": decision["args"],
+                    "id": f"router-{uuid.uuid4().hex}"
+                }]), None
+
+        speculations = self.speculator.start(question, context) if settings.SPECULATION_ENABLED else []
+        try:
+            response = await llm_client.ainvoke(self.llm_with_tools, messages, call_type="tool_selection")
+        except LLMUnavailable as e:
+            # LLM sự cố: chuyển sang tra cứu tài liệu (FAQ/câu trả lời đã cache không cần LLM)
+            logging.warning(f"LLM chọn tool không khả dụng, dùng search_general_info: {e}")
+            response = AIMessage(content="", tool_calls=[{
+                "name": "search_general_info",
+                "args": {"query": question},
+                "id": f"fallback-{uuid.uuid4().hex}"
+            }])
+        except BaseException:
+            self.speculator.cancel_all(speculations)
+            raise
+
+        tool_call = response.tool_calls[0] if response.tool_calls else {}
+        speculation = self.speculator.claim(speculations, tool_call.get("name"), tool_call.get("args", {}))
+        return response, speculation
+
+    @traced("search_classes")
+    async def _run_search_classes(self, tool_args: dict, speculation: Optional[Speculation]) -> dict:
+        """Lấy dữ liệu lớp học, ưu tiên kết quả đã chạy trước."""
+        if speculation:
+            try:
+                return await speculation.result()
+            except Exception as e:
+                logging.error(f"Speculative search_classes lỗi, chạy lại: {e}")
+        return await search_classes.ainvoke(tool_args)
+
+    @traced("general_info")
+    async def _run_search_general_info(self, tool_args: dict, speculation: Optional[Speculation], economy: bool = False) -> str:
+        """Tra cứu thông tin chung, tái sử dụng tài liệu đã truy xuất trước (nếu có)."""
+        if speculation:
+            try:
+                docs = await speculation.result()
+                return await rag_service.aget_answer(tool_args["query"], docs=docs, economy=economy)
+            except Exception as e:
+                logging.error(f"Speculative retrieval lỗi, chạy lại: {e}")
+        if economy:
+            return await rag_service.aget_answer(tool_args["query"], economy=True)
+        return await search_general_info.ainvoke(tool_args)
+
+    @traced("data_response")
+    async def _generate_data_response(self, question: str, data: dict, economy: bool = False) -> Tuple[str, List[dict]]:
         """Sinh câu trả lời từ dữ liệu API dưới dạng text và courses list."""
+        if economy:
+            # Vượt ngân sách token: dựng câu trả lời trực tiếp từ dữ liệu, không gọi LLM
+            return self._fallback_data_response(data)
         chain = self.data_response_prompt | self.llm
         try:
-            result = await chain.ainvoke({"data": str(data), "question": question})
+            result = await llm_client.ainvoke(chain, {"data": str(data), "question": question}, call_type="data_response")
             content = result.content.strip()
             
             if content.startswith("```json"):
@@ -135,21 +246,57 @@ class ChatOrchestrator:
                 
             parsed_json = json.loads(content.strip())
             return parsed_json.get("answer", ""), parsed_json.get("courses", [])
+        except AdmissionRejected:
+            raise
+        except LLMUnavailable as e:
+            logging.warning(f"LLM không khả dụng, trả dữ liệu lớp học không qua LLM: {e}")
+            return self._fallback_data_response(data)
         except Exception as e:
             logging.error(f"Error generating data response: {e}")
             return "Có lỗi khi xử lý dữ liệu.", []
 
-    async def process_message(self, question: str, session_id: str = None, user_id: str = None) -> Tuple[str, str, list, list]:
+    def _fallback_data_response(self, data: Any) -> Tuple[str, List[dict]]:
+        """Câu trả lời dựng trực tiếp từ dữ liệu lớp học khi LLM không khả dụng."""
+        if not isinstance(data, dict):
+            return str(data), []
+        classes = data.get("classes_found") or []
+        if not classes:
+            return data.get("message", "Hiện tại chưa có lớp học nào phù hợp."), []
+
+        query_context = data.get("query_context", {})
+        courses = []
+        for c in classes:
+            fee = c.get("fee")
+            courses.append({
+                "id": str(c.get("id")),
+                "name": c.get("name"),
+                "schedule": "; ".join(c.get("schedules", [])),
+                "location": query_context.get("address") or query_context.get("branch"),
+                "price": f"{fee:,}".replace(",", ".") if isinstance(fee, (int, float)) else str(fee),
+                "status": c.get("status"),
+                "endDate": c.get("endDate"),
+            })
+        answer = f"Mình tìm thấy {len(courses)} lớp phù hợp tại {query_context.get('branch')} cho {query_context.get('grade')}:"
+        return answer, courses
+
+    async def process_message(self, question: str, session_id: str = None, user_id: str = None, memory=None) -> Tuple[str, str, list, list]:
         """
         Xử lý tin nhắn sử dụng Agentic Workflow (Tool Calling).
+        `memory`: nơi đọc/ghi ngữ cảnh và lịch sử phiên (mặc định session_manager - DB; InMemorySession cho WebSocket/đánh giá).
         """
+        memory = memory or session_manager
         if not session_id:
-            session_id = await session_manager.create_session(user_id=user_id)
+            session_id = await memory.create_session(user_id=user_id)
+        # Giới hạn lời gọi LLM theo người dùng (ngữ cảnh được kế thừa bởi các task con)
+        current_user.set(user_id or session_id)
+        # Gắn nhãn số token theo phiên; phiên vượt ngân sách token đi đường rẻ hơn
+        current_session.set(session_id)
+        economy = await llm_usage.over_budget(session_id)
         
         # 0. Cập nhật trạng thái tiền xử lý (Giữ nguyên logic hiện tại)
         extracted_branch, extracted_grade, extracted_subject = await self._extract_entities(question)
         if extracted_branch or extracted_grade or extracted_subject:
-            await session_manager.update_context(session_id, branch=extracted_branch, grade=extracted_grade, subject=extracted_subject)
+            await memory.update_context(session_id, branch=extracted_branch, grade=extracted_grade, subject=extracted_subject)
         
         # 1. Chuẩn bị ngữ cảnh và System Prompt
         valid_branches = await external_api_service.get_all_branches()
@@ -186,25 +333,21 @@ Lịch sử chat:
         messages = [SystemMessage(content=system_prompt)]
         
         # Tiêm lịch sử chat vào prompt
-        raw_history = await session_manager.get_history(session_id)
-        for msg in raw_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        raw_history = await memory.get_history(session_id)
+        messages.extend(self._history_messages(raw_history, economy))
 
         # Tiêm ngữ cảnh hiện tại vào prompt
-        context = await session_manager.get_context(session_id)
+        context = await memory.get_context(session_id)
         current_slots_info = f"SYSTEM_NOTE involved entities so far: Branch={context.get('branch')}, Grade={context.get('grade')}, Subject={context.get('subject')}"
         messages.append(SystemMessage(content=current_slots_info))
 
         # Thêm tin nhắn hiện tại của người dùng
         messages.append(HumanMessage(content=question))
         # Lưu tin nhắn người dùng vào lịch sử
-        await session_manager.add_message(session_id, "user", question)
+        await memory.add_message(session_id, "user", question)
 
         # 2. Gọi LLM kèm theo Tools
-        response = await self.llm_with_tools.ainvoke(messages)
+        response, speculation = await self._select_tool(messages, question, context)
 
         # 3. Xử lý phản hồi từ LLM
         final_answer_text = ""
@@ -213,45 +356,46 @@ Lịch sử chat:
             tool_call = response.tool_calls[0]
             tool_name = tool_call["name"]
             tool_args = tool_call["args"]
+            current_tool.set(tool_name)
             
             logging.info(f"Agent chose tool: {tool_name} with args: {tool_args}")
             
             if tool_name == "search_classes":
-                data = await search_classes.ainvoke(tool_args)
-                answer, courses = await self._generate_data_response(question, data)
-                await session_manager.update_context(session_id, **tool_args)
+                data = await self._run_search_classes(tool_args, speculation)
+                answer, courses = await self._generate_data_response(question, data, economy)
+                await memory.update_context(session_id, **tool_args)
                 
                 final_answer_text = answer
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return final_answer_text, session_id, [], courses
                 
             elif tool_name == "ask_for_branch":
                 options = await external_api_service.get_all_branches()
                 final_answer_text = "Bạn vui lòng chọn chi nhánh để mình tư vấn chính xác nhé:"
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return final_answer_text, session_id, options, []
                 
             elif tool_name == "ask_for_grade":
                 options = await external_api_service.get_all_grades()
                 final_answer_text = "Bạn vui lòng chọn khối lớp:"
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return final_answer_text, session_id, options, []
                 
             elif tool_name == "ask_for_subject":
                 options = await external_api_service.get_all_subjects()
                 final_answer_text = "Bạn muốn tìm lớp môn gì ạ?"
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return final_answer_text, session_id, options, []
                 
             elif tool_name == "search_general_info":
-                answer_text = search_general_info.invoke(tool_args)
+                answer_text = await self._run_search_general_info(tool_args, speculation, economy)
                 final_answer_text = answer_text
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return final_answer_text, session_id, [], []
 
         # Trường hợp B: Không gọi Tool
         final_answer_text = response.content
-        await session_manager.add_message(session_id, "assistant", final_answer_text)
+        await memory.add_message(session_id, "assistant", final_answer_text)
         
         # HEURISTIC GUARDRAILS (Phòng vệ trường hợp Agent quên gọi tool)
         # Nếu câu trả lời chứa từ khóa hỏi thông tin, tự động đính kèm options tương ứng.
@@ -277,18 +421,24 @@ Lịch sử chat:
 
         return final_answer_text, session_id, [], []
 
-    async def process_message_stream(self, question: str, session_id: str = None, user_id: str = None):
+    async def process_message_stream(self, question: str, session_id: str = None, user_id: str = None, memory=None):
         """
         Phiên bản Streaming của process_message.
         Trả về các đoạn text (chunks) cho câu trả lời cuối cùng.
         """
+        memory = memory or session_manager
         if not session_id:
-            session_id = await session_manager.create_session(user_id=user_id)
+            session_id = await memory.create_session(user_id=user_id)
+        # Giới hạn lời gọi LLM theo người dùng (ngữ cảnh được kế thừa bởi các task con)
+        current_user.set(user_id or session_id)
+        # Gắn nhãn số token theo phiên; phiên vượt ngân sách token đi đường rẻ hơn
+        current_session.set(session_id)
+        economy = await llm_usage.over_budget(session_id)
         
         # 1. Cập nhật trạng thái và trích xuất (Không streaming bước này)
         extracted_branch, extracted_grade, extracted_subject = await self._extract_entities(question)
         if extracted_branch or extracted_grade or extracted_subject:
-            await session_manager.update_context(session_id, branch=extracted_branch, grade=extracted_grade, subject=extracted_subject)
+            await memory.update_context(session_id, branch=extracted_branch, grade=extracted_grade, subject=extracted_subject)
         
         # 2. Ngữ cảnh và Tin nhắn
         valid_branches = await external_api_service.get_all_branches()
@@ -323,24 +473,20 @@ Lịch sử chat:
         messages = [SystemMessage(content=system_prompt)]
         
         # Tiêm lịch sử chat
-        raw_history = await session_manager.get_history(session_id)
-        for msg in raw_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        raw_history = await memory.get_history(session_id)
+        messages.extend(self._history_messages(raw_history, economy))
 
         # Tiêm ngữ cảnh hiện tại
-        context = await session_manager.get_context(session_id)
+        context = await memory.get_context(session_id)
         current_slots_info = f"SYSTEM_NOTE involved entities so far: Branch={context.get('branch')}, Grade={context.get('grade')}, Subject={context.get('subject')}"
         messages.append(SystemMessage(content=current_slots_info))
 
         # Thêm tin nhắn hiện tại của người dùng
         messages.append(HumanMessage(content=question))
-        await session_manager.add_message(session_id, "user", question)
+        await memory.add_message(session_id, "user", question)
 
         # 3. Gọi LLM (Kiểm tra tools trước - Bước này không streaming)
-        response = await self.llm_with_tools.ainvoke(messages)
+        response, speculation = await self._select_tool(messages, question, context)
         
         final_answer_text = ""
         final_answer_chunk = ""
@@ -350,25 +496,32 @@ Lịch sử chat:
             tool_call = response.tool_calls[0]
             tool_name = tool_call["name"]
             tool_args = tool_call["args"]
+            current_tool.set(tool_name)
             
             logging.info(f"Agent chose tool: {tool_name} with args: {tool_args}")
             
             if tool_name == "search_classes":
-                data = await search_classes.ainvoke(tool_args)
-                await session_manager.update_context(session_id, **tool_args)
+                data = await self._run_search_classes(tool_args, speculation)
+                await memory.update_context(session_id, **tool_args)
                 
                 # Streaming quá trình sinh dữ liệu trả về
                 # Cần tự xây dựng chain thủ công để stream nó
                 chain = self.data_response_prompt | self.llm
-                async for chunk in chain.astream({"data": str(data), "question": question}):
-                     text_chunk = chunk.content
-                     final_answer_text += text_chunk
-                     # Logic đơn giản: tránh stream raw JSON nếu có thể
-                     # Đợi JSON hoàn chỉnh để đảm bảo UI không bị vỡ
-                     pass 
+                # Phiên vượt ngân sách token: bỏ qua lần gọi stream này (kết quả không được dùng)
+                if not economy:
+                    try:
+                        with span("data_response_stream"):
+                            async for chunk in llm_client.astream(chain, {"data": str(data), "question": question}):
+                                 text_chunk = chunk.content
+                                 final_answer_text += text_chunk
+                                 # Logic đơn giản: tránh stream raw JSON nếu có thể
+                                 # Đợi JSON hoàn chỉnh để đảm bảo UI không bị vỡ
+                                 pass 
+                    except LLMUnavailable as e:
+                        logging.warning(f"Stream dữ liệu lớp học lỗi: {e}")
                 
                 # Fallback: đợi tool JSON hoàn thành để đảm bảo cấu trúc UI hợp lệ
-                answer, courses = await self._generate_data_response(question, data)
+                answer, courses = await self._generate_data_response(question, data, economy)
                 final_answer_text = answer
                 
                 # Stream câu trả lời text trước
@@ -380,7 +533,7 @@ Lịch sử chat:
                 # Trả về dữ liệu phức tạp (courses)
                 yield f"data: {json.dumps({'courses': courses})}\n\n"
                 
-                await session_manager.add_message(session_id, "assistant", final_answer_text, courses=courses)
+                await memory.add_message(session_id, "assistant", final_answer_text, courses=courses)
                 return
 
             elif tool_name in ["ask_for_branch", "ask_for_grade", "ask_for_subject"]:
@@ -405,13 +558,13 @@ Lịch sử chat:
                 if options:
                     yield f"data: {json.dumps({'options': options})}\n\n"
 
-                await session_manager.add_message(session_id, "assistant", final_answer_text, options=options)
+                await memory.add_message(session_id, "assistant", final_answer_text, options=options)
                 return
                 
             elif tool_name == "search_general_info":
                 # Thông tin chung thường là text, chúng ta có thể stream nó!
                 # Mô phỏng streaming kết quả trả về.
-                answer_text = search_general_info.invoke(tool_args)
+                answer_text = await self._run_search_general_info(tool_args, speculation, economy)
                 final_answer_text = answer_text
                 
                 # Mô phỏng stream
@@ -421,7 +574,7 @@ Lịch sử chat:
                     yield f"data: {json.dumps({'text_chunk': chunk, 'session_id': session_id})}\n\n"
                     await asyncio.sleep(0.01)
                     
-                await session_manager.add_message(session_id, "assistant", final_answer_text)
+                await memory.add_message(session_id, "assistant", final_answer_text)
                 return
 
         # Trường hợp B: Không gọi Tool -> Chat hội thoại thuần túy (Streaming thật)
@@ -449,6 +602,6 @@ Lịch sử chat:
         if options:
             yield f"data: {json.dumps({'options': options})}\n\n"
 
-        await session_manager.add_message(session_id, "assistant", final_answer_text, options=options)
+        await memory.add_message(session_id, "assistant", final_answer_text, options=options)
 
 chat_orchestrator = ChatOrchestrator()
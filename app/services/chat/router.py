@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+
+# Câu mẫu cho từng ý định, dùng để tính centroid trên không gian embeddings
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    "class_lookup": [
+        "Học phí bao nhiêu?",
+        "Học phí lớp này là bao nhiêu tiền?",
+        "Lịch học như thế nào?",
+        "Có những lớp nào đang mở?",
+        "Cho mình xem danh sách lớp học",
+        "Khi nào khai giảng lớp mới?",
+        "Lớp học vào thứ mấy, mấy giờ?",
+        "Em muốn đăng ký khóa học",
+        "Còn lớp nào trống không?",
+        "Lớp Toán học ở phòng nào?",
+    ],
+    "general_info": [
+        "Xin chào",
+        "Trung tâm ở đâu?",
+        "Giới thiệu về trung tâm",
+        "Trung tâm được thành lập năm nào?",
+        "Phương châm của trung tâm là gì?",
+        "Đội ngũ giáo viên như thế nào?",
+        "Số hotline của trung tâm là gì?",
+        "Nội quy của trung tâm ra sao?",
+        "Trung tâm chuyên luyện thi những gì?",
+        "Ai là người quản lý trung tâm?",
+    ],
+}
+
+GREETING_KEYWORDS = ["xin chào", "chào bạn", "chào ad", "chào trung tâm", "hello", "hi", "alo"]
+SUBJECT_LIST_KEYWORDS = ["môn gì", "môn nào", "những môn", "các môn", "danh sách môn"]
+CLASS_KEYWORDS = [
+    "học phí", "lịch học", "lớp học", "khóa học", "khoá học", "đăng ký lớp", "danh sách lớp",
+    "lớp nào", "giờ học", "bao nhiêu tiền", "khai giảng", "lịch khai giảng",
+]
+GENERAL_KEYWORDS = [
+    "thành lập", "phương châm", "giới thiệu", "hotline", "nội quy", "quy định", "chính sách",
+    "giảng viên", "liên hệ", "quản lý", "đại diện",
+]
+
+
+class IntentRouter:
+    """
+    Định tuyến ý định cục bộ: luật từ khóa + phân loại nearest-centroid
+    trên embeddings của RAGService. Trả về None khi không đủ tự tin để LLM quyết định.
+    """
+
+    def __init__(
+        self,
+        embeddings_provider: Optional[Callable[[], Any]] = None,
+        threshold: float = settings.ROUTER_CONFIDENCE_THRESHOLD,
+        min_margin: float = settings.ROUTER_MIN_MARGIN,
+    ):
+        self.embeddings_provider = embeddings_provider or self._default_embeddings
+        self.threshold = threshold
+        self.min_margin = min_margin
+        self.labels: List[str] = []
+        self.centroids: Optional[np.ndarray] = None
+        self.stats = {"total": 0, "rule": 0, "centroid": 0, "fallback": 0}
+
+    @staticmethod
+    def _default_embeddings():
+        from app.services.rag.engine import rag_service
+        return rag_service.embeddings
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.clip(norms, 1e-12, None)
+
+    def fit(self, embeddings) -> None:
+        """Tính centroid (đã chuẩn hóa L2) cho từng ý định từ các câu mẫu."""
+        labels, centroids = [], []
+        for label, examples in INTENT_EXAMPLES.items():
+            vectors = self._normalize(np.asarray(embeddings.embed_documents(examples), dtype=np.float32))
+            centroids.append(vectors.mean(axis=0))
+            labels.append(label)
+        self.labels = labels
+        self.centroids = self._normalize(np.vstack(centroids))
+
+    async def _ensure_fitted(self) -> bool:
+        if self.centroids is not None:
+            return True
+        embeddings = self.embeddings_provider()
+        if embeddings is None:
+            return False
+        try:
+            await asyncio.to_thread(self.fit, embeddings)
+            return True
+        except Exception as e:
+            logging.error(f"Lỗi khởi tạo centroid cho router: {e}")
+            return False
+
+    def _match_rules(self, text: str) -> Optional[str]:
+        """Luật từ khóa. Trả về nhãn ý định hoặc None."""
+        if any(kw in text for kw in SUBJECT_LIST_KEYWORDS):
+            return "subject_list"
+        if any(kw in text for kw in CLASS_KEYWORDS):
+            return "class_lookup"
+        words = text.split()
+        if len(words) <= 5 and any(text == kw or text.startswith(kw + " ") or text.startswith(kw + ",") for kw in GREETING_KEYWORDS):
+            return "general_info"
+        if any(kw in text for kw in GENERAL_KEYWORDS):
+            return "general_info"
+        return None
+
+    async def _classify(self, text: str) -> Optional[Dict[str, Any]]:
+        """Phân loại nearest-centroid. Trả về nhãn và độ tin cậy (cosine similarity)."""
+        if not await self._ensure_fitted():
+            return None
+        embeddings = self.embeddings_provider()
+        vector = np.asarray(await asyncio.to_thread(embeddings.embed_query, text), dtype=np.float32)
+        scores = self.centroids @ self._normalize(vector)
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        margin = best - float(scores[order[1]]) if len(order) > 1 else best
+        return {"label": self.labels[order[0]], "confidence": best, "margin": margin}
+
+    def _to_tool_call(self, label: str, question: str, context: Dict[str, Optional[str]]) -> Dict[str, Any]:
+        """Ánh xạ ý định sang tool (và tham số) dựa trên ngữ cảnh phiên."""
+        if label == "general_info":
+            return {"name": "search_general_info", "args": {"query": question}}
+        if label == "subject_list":
+            return {"name": "ask_for_subject", "args": {}}
+        if not context.get("branch"):
+            return {"name": "ask_for_branch", "args": {}}
+        if not context.get("grade"):
+            return {"name": "ask_for_grade", "args": {}}
+        args = {"branch": context["branch"], "grade": context["grade"]}
+        if context.get("subject"):
+            args["subject"] = context["subject"]
+        return {"name": "search_classes", "args": args}
+
+    async def route(self, question: str, context: Dict[str, Optional[str]]) -> Optional[Dict[str, Any]]:
+        """
+        Quyết định tool cho câu hỏi.
+        Trả về {"name", "args", "confidence", "source"} hoặc None nếu cần fallback về LLM.
+        """
+        self.stats["total"] += 1
+        text = " ".join(question.lower().split())
+
+        label = self._match_rules(text)
+        if label:
+            self.stats["rule"] += 1
+            return {**self._to_tool_call(label, question, context), "confidence": 1.0, "source": "rule"}
+
+        try:
+            result = await self._classify(text)
+        except Exception as e:
+            logging.error(f"Lỗi phân loại ý định: {e}")
+            result = None
+
+        if result and result["confidence"] >= self.threshold and result["margin"] >= self.min_margin:
+            self.stats["centroid"] += 1
+            return {**self._to_tool_call(result["label"], question, context), "confidence": result["confidence"], "source": "centroid"}
+
+        self.stats["fallback"] += 1
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Thống kê định tuyến: số lượt theo nguồn và số lần gọi LLM tiết kiệm được mỗi lượt."""
+        total = self.stats["total"]
+        routed = self.stats["rule"] + self.stats["centroid"]
+        return {**self.stats, "llm_calls_saved_per_turn": routed / total if total else 0.0}
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from app.services.external.school_api import external_api_service
+from app.services.rag.engine import rag_service
+
+# Dấu hiệu câu hỏi (để đoán trước việc tra cứu tài liệu)
+QUESTION_MARKERS = ["?", " gì", " nào", " đâu", " ai", "bao nhiêu", "bao lâu", "như thế nào", "thế nào", " sao", " không"]
+
+
+def _normalize_text(value: Any) -> str:
+    return " ".join(str(value).lower().split()) if value else ""
+
+
+class SpeculationStats:
+    """Thống kê speculative execution (tỉ lệ trúng và thời gian tiết kiệm)."""
+
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.saved_ms_total = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        resolved = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / resolved if resolved else 0.0,
+            "saved_ms_total": round(self.saved_ms_total, 2),
+            "saved_ms_avg_per_hit": round(self.saved_ms_total / self.hits, 2) if self.hits else 0.0,
+        }
+
+
+speculation_stats = SpeculationStats()
+
+
+class Speculation:
+    """Một tác vụ tool chạy trước trong lúc LLM đang chọn tool."""
+
+    def __init__(self, tool_name: str, args: Dict[str, Any], coro):
+        self.tool_name = tool_name
+        self.args = args
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.claimed_at: Optional[float] = None
+        self.task = asyncio.create_task(self._run(coro))
+        # Tránh cảnh báo "Task exception was never retrieved" khi tác vụ bị bỏ
+        self.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _run(self, coro):
+        try:
+            return await coro
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def matches(self, tool_name: str, tool_args: Dict[str, Any]) -> bool:
+        if tool_name != self.tool_name:
+            return False
+        keys = set(self.args) | set(tool_args)
+        return all(_normalize_text(self.args.get(k)) == _normalize_text(tool_args.get(k)) for k in keys)
+
+    def cancel(self):
+        # Lưu ý: phần việc đã đẩy sang luồng (to_thread) vẫn chạy nốt, kết quả bị bỏ qua
+        self.task.cancel()
+
+    async def result(self) -> Any:
+        """Chờ kết quả. Ném lại exception nếu tác vụ lỗi."""
+        try:
+            value = await self.task
+        except Exception:
+            speculation_stats.errors += 1
+            raise
+        duration = self.finished_at - self.started_at
+        overlap = (self.claimed_at or self.finished_at) - self.started_at
+        speculation_stats.saved_ms_total += min(duration, overlap) * 1000
+        return value
+
+
+class Speculator:
+    """Đoán trước tool có khả năng được chọn dựa trên ngữ cảnh phiên và câu hỏi."""
+
+    @staticmethod
+    def _is_question_like(question: str) -> bool:
+        text = f" {_normalize_text(question)}"
+        return any(marker in text for marker in QUESTION_MARKERS)
+
+    def start(self, question: str, context: Dict[str, Optional[str]]) -> List[Speculation]:
+        speculations = []
+        if context.get("branch") and context.get("grade"):
+            args = {"branch": context["branch"], "grade": context["grade"], "subject": context.get("subject")}
+            speculations.append(Speculation("search_classes", args, external_api_service.get_filtered_data(**args)))
+        if rag_service.ready and self._is_question_like(question):
+            speculations.append(Speculation("search_general_info", {"query": question}, rag_service.aretrieve(question)))
+        speculation_stats.started += len(speculations)
+        return speculations
+
+    def claim(self, speculations: List[Speculation], tool_name: Optional[str], tool_args: Dict[str, Any]) -> Optional[Speculation]:
+        """Giữ lại tác vụ khớp với lựa chọn của LLM, hủy các tác vụ còn lại."""
+        claimed = None
+        now = time.perf_counter()
+        for spec in speculations:
+            if claimed is None and tool_name and spec.matches(tool_name, tool_args):
+                spec.claimed_at = now
+                claimed = spec
+                speculation_stats.hits += 1
+            else:
+                spec.cancel()
+                speculation_stats.misses += 1
+        if claimed:
+            logging.info(f"Speculation hit: {tool_name}")
+        return claimed
+
+    def cancel_all(self, speculations: List[Speculation]):
+        for spec in speculations:
+            spec.cancel()
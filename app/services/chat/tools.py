@@ -49,7 +49,7 @@ def ask_for_subject() -> str:
     return "DISPLAY_SUBJECT_OPTIONS"
 
 @tool
-def search_general_info(query: str) -> str:
+async def search_general_info(query: str) -> str:
     """
     Tra cứu thông tin chung về trung tâm, quy định, chính sách, hoặc chào hỏi xã giao.
     Sử dụng công cụ này cho các câu hỏi không liên quan đến tìm kiếm lớp học cụ thể (như "Trung tâm ở đâu?", "Giới thiệu", "Xin chào").
@@ -60,4 +60,4 @@ def search_general_info(query: str) -> str:
     Returns:
         Câu trả lời dưới dạng văn bản.
     """
-    return rag_service.get_answer(query)
+    return await rag_service.aget_answer(query)
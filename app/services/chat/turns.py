@@ -0,0 +1,363 @@
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.services.cache import redis_cache
+
+# Số lượt giữ tối đa trong bộ nhớ mỗi worker
+MAX_LOCAL_TURNS = 1000
+# Chu kỳ đẩy sự kiện lên Redis (gom nhiều chunk một lần) và chu kỳ worker khác đọc về
+REDIS_MIRROR_INTERVAL = 0.05
+REDIS_POLL_INTERVAL = 0.1
+# Số sự kiện tối đa đọc từ Redis mỗi lần
+REDIS_READ_BATCH = 200
+# Thời gian tối đa theo dõi một lượt đang chạy ở worker khác (worker đó chết giữa chừng)
+REMOTE_FOLLOW_TIMEOUT = 180
+
+KEY_PREFIX = "chat:turn:key:"
+EVENTS_PREFIX = "chat:turn:events:"
+
+
+class TurnExpired(Exception):
+    """Vị trí cần phát lại đã bị đẩy ra khỏi bộ đệm (lượt quá dài hoặc client tụt lại quá xa)."""
+
+
+class Turn:
+    """
+    Một lượt chat đang chạy hoặc vừa xong: bộ đệm có giới hạn các sự kiện SSE đã phát, cho nhiều client cùng theo dõi.
+    Sự kiện được đánh số tăng dần từ 0 (dùng làm id SSE); bộ đệm chỉ giữ `max_events` sự kiện gần nhất.
+    """
+
+    def __init__(self, turn_id: str, key: Optional[str], max_events: int,
+                 scope: Optional[str] = None, fingerprint: Optional[str] = None):
+        self.turn_id = turn_id
+        self.key = key
+        # Phiên/người dùng sở hữu lượt và dấu vân tay câu hỏi: chỉ request khớp mới được nối lại lượt này
+        self.scope = scope
+        self.fingerprint = fingerprint
+        self.events: deque = deque(maxlen=max_events)
+        self.count = 0  # Số sự kiện đã phát (= số thứ tự của sự kiện tiếp theo)
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self._signal = asyncio.Event()
+
+    @property
+    def base(self) -> int:
+        """Số thứ tự của sự kiện cũ nhất còn trong bộ đệm."""
+        return self.count - len(self.events)
+
+    def _notify(self):
+        signal, self._signal = self._signal, asyncio.Event()
+        signal.set()
+
+    def append(self, event: str, index: Optional[int] = None):
+        # Bản sao đọc từ Redis có thể bắt đầu giữa chừng hoặc nhảy cóc (phần đầu đã bị cắt)
+        if index is not None and index != self.count:
+            self.events.clear()
+            self.count = index
+        self.events.append(event)
+        self.count += 1
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def since(self, start: int) -> List[str]:
+        if start < self.base:
+            raise TurnExpired(f"turn {self.turn_id}: sự kiện {start} đã bị xóa khỏi bộ đệm")
+        return list(itertools.islice(self.events, start - self.base, None))
+
+    async def follow(self, start: int = 0, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[Tuple[int, str]]]:
+        """
+        Phát lại (số thứ tự, sự kiện) từ vị trí `start`, sau đó chờ sự kiện mới tới khi lượt kết thúc.
+        Nếu `heartbeat` được đặt, trả về None sau mỗi `heartbeat` giây không có sự kiện mới.
+        """
+        index = start
+        while True:
+            signal = self._signal
+            for event in self.since(index):
+                yield index, event
+                index += 1
+            if self.done:
+                return
+            try:
+                await asyncio.wait_for(signal.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+
+class TurnRegistry:
+    """
+    Bộ đệm các lượt chat theo turn_id (để client nối lại bằng Last-Event-ID) và gộp các lượt trùng nhau:
+    cùng (phiên/người dùng, idempotency key), hoặc cùng (phiên, câu hỏi) trong `window` giây, thì gắn vào lượt đang chạy
+    (nhận cùng sự kiện SSE) hoặc phát lại kết quả đã lưu thay vì chạy lại pipeline.
+    Pipeline chạy trong task riêng, không phụ thuộc kết nối của client đầu tiên.
+    Giữa các worker: khóa Redis (SET NX) chọn worker chạy, sự kiện được đẩy lên hash Redis cho worker khác đọc.
+    """
+
+    def __init__(self, window: float, retention: float, max_events: int):
+        self.window = window
+        self.retention = max(window, retention)
+        self.max_events = max_events
+        self._turns: "OrderedDict[str, Turn]" = OrderedDict()
+        self._keys: Dict[str, str] = {}
+        self._tasks = set()
+        self.stats = {"started": 0, "coalesced": 0, "replayed": 0, "remote": 0, "resumed": 0, "expired": 0}
+
+    @staticmethod
+    def turn_key(question: str, session_id: Optional[str] = None, user_id: Optional[str] = None,
+                 idempotency_key: Optional[str] = None) -> Optional[str]:
+        if idempotency_key:
+            # Khóa do client tự đặt: chỉ có nghĩa trong phạm vi phiên/người dùng của client đó
+            raw = f"idem:{session_id or user_id or ''}:{idempotency_key}"
+        elif session_id or user_id:
+            raw = f"question:{session_id or user_id}:{' '.join(question.lower().split())}"
+        else:
+            return None
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def fingerprint(question: str, session_id: Optional[str] = None, user_id: Optional[str] = None) -> str:
+        """Dấu vân tay (phiên/người dùng, câu hỏi đã chuẩn hóa) để kiểm tra request nối lại có đúng là lượt cũ."""
+        raw = f"{session_id or user_id or ''}:{' '.join(question.lower().split())}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def event_id(turn_id: str, index: int) -> str:
+        return f"{turn_id}:{index}"
+
+    @staticmethod
+    def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[str, int]]:
+        """Tách Last-Event-ID thành (turn_id, số thứ tự); None nếu không hợp lệ."""
+        turn_id, _, index = (event_id or "").strip().rpartition(":")
+        if not turn_id or not index.isdigit():
+            return None
+        return turn_id, int(index)
+
+    def _prune(self):
+        now = time.monotonic()
+        for turn_id, turn in list(self._turns.items()):
+            if not turn.done:
+                continue
+            age = now - turn.finished_at
+            if turn.key and age > self.window and self._keys.get(turn.key) == turn_id:
+                del self._keys[turn.key]
+            if age > self.retention or len(self._turns) > MAX_LOCAL_TURNS:
+                del self._turns[turn_id]
+                if turn.key and self._keys.get(turn.key) == turn_id:
+                    del self._keys[turn.key]
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _register(self, turn_id: str, key: Optional[str], scope: Optional[str] = None,
+                  fingerprint: Optional[str] = None) -> Turn:
+        turn = Turn(turn_id, key, self.max_events, scope, fingerprint)
+        self._turns[turn_id] = turn
+        if key:
+            self._keys[key] = turn_id
+        return turn
+
+    async def submit(self, key: Optional[str], producer: Callable[[], AsyncIterator[str]],
+                     scope: Optional[str] = None, fingerprint: Optional[str] = None) -> Tuple[Turn, bool]:
+        """
+        Trả về (lượt, True nếu gắn vào lượt đã có). `producer()` tạo luồng sự kiện của pipeline,
+        chỉ được gọi khi không có lượt trùng. `scope`/`fingerprint` của lượt mới dùng để kiểm tra khi nối lại.
+        """
+        self._prune()
+        if key and key in self._keys:
+            turn = self._turns[self._keys[key]]
+            self.stats["replayed" if turn.done else "coalesced"] += 1
+            logging.info(f"Gộp lượt chat trùng vào turn {turn.turn_id} ({'phát lại' if turn.done else 'đang chạy'})")
+            return turn, True
+
+        # Đăng ký ngay (trước khi chờ Redis) để request trùng tới sau trong cùng worker gắn vào lượt này
+        turn = self._register(uuid.uuid4().hex, key, scope, fingerprint)
+        owner = await self._claim(key, turn.turn_id) if key else turn.turn_id
+        if owner != turn.turn_id:
+            # Worker khác đang chạy lượt này: đọc sự kiện của nó từ Redis, dưới đúng turn_id của nó
+            self.stats["remote"] += 1
+            logging.info(f"Lượt chat trùng đang chạy ở worker khác (turn {owner}), theo dõi qua Redis")
+            # (request trùng trong worker có thể đã gắn vào `turn`, nên đổi tên thay vì tạo lượt mới)
+            del self._turns[turn.turn_id]
+            turn.turn_id = owner
+            self._turns[owner] = turn
+            self._keys[key] = owner
+            self._pull_remote(turn)
+            return turn, True
+
+        self.stats["started"] += 1
+        self._spawn(self._run(turn, producer))
+        if redis_cache.enabled:
+            self._spawn(self._mirror(turn))
+        return turn, False
+
+    async def resume(self, turn_id: str) -> Optional[Turn]:
+        """Tìm lượt theo turn_id để client nối lại: trong bộ nhớ worker này, hoặc trong Redis (lượt của worker khác)."""
+        self._prune()
+        turn = self._turns.get(turn_id)
+        if turn is None:
+            meta = await asyncio.to_thread(self._remote_meta, turn_id)
+            if meta is not None:
+                turn = self._register(turn_id, None, *meta)
+                self._pull_remote(turn)
+        if turn is not None:
+            self.stats["resumed"] += 1
+        return turn
+
+    async def sse(self, turn: Turn, start: int = 0) -> AsyncIterator[str]:
+        """Sự kiện SSE của lượt từ vị trí `start`, kèm id (`turn_id:số thứ tự`) và comment heartbeat khi im lặng."""
+        try:
+            async for item in turn.follow(start, heartbeat=settings.SSE_HEARTBEAT_SECONDS or None):
+                if item is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                index, event = item
+                yield f"id: {self.event_id(turn.turn_id, index)}\n{event}"
+        except TurnExpired as e:
+            self.stats["expired"] += 1
+            logging.warning(f"Không thể nối lại lượt chat: {e}")
+            yield f"data: {json.dumps({'error': 'Không thể nối lại câu trả lời (đã quá cũ), vui lòng gửi lại câu hỏi.', 'resume_expired': True})}\n\n"
+
+    async def _run(self, turn: Turn, producer: Callable[[], AsyncIterator[str]]):
+        try:
+            async for event in producer():
+                turn.append(event)
+        except Exception as e:
+            logging.error(f"Lỗi khi chạy lượt chat {turn.turn_id}: {e}")
+            turn.append(f"data: {json.dumps({'error': str(e)})}\n\n")
+        finally:
+            turn.finish()
+
+    # --- Redis (dùng chung giữa các worker) ---
+
+    async def _claim(self, key: str, turn_id: str) -> str:
+        """Giành quyền chạy lượt `key`; trả về turn_id của worker đang giữ quyền (của mình nếu giành được)."""
+        def claim() -> str:
+            if not redis_cache.connect():
+                return turn_id
+            try:
+                if redis_cache.client.set(KEY_PREFIX + key, turn_id, nx=True, ex=REMOTE_FOLLOW_TIMEOUT):
+                    return turn_id
+                return redis_cache.client.get(KEY_PREFIX + key) or turn_id
+            except Exception as e:
+                logging.error(f"Redis claim turn error: {e}")
+                return turn_id
+        return await asyncio.to_thread(claim)
+
+    async def _mirror(self, turn: Turn):
+        """
+        Đẩy sự kiện của lượt lên Redis theo lô. Mỗi lượt là một hash: field số thứ tự -> sự kiện,
+        "n" = số sự kiện đã phát, "done" khi xong; các field cũ hơn `max_events` bị xóa.
+        """
+        name = EVENTS_PREFIX + turn.turn_id
+        ttl = int(max(self.retention, REMOTE_FOLLOW_TIMEOUT))
+
+        def push(start: int, batch: List[str], done: bool):
+            mapping = {str(start + i): event for i, event in enumerate(batch)}
+            mapping["n"] = start + len(batch)
+            mapping["scope"] = turn.scope or ""
+            mapping["fp"] = turn.fingerprint or ""
+            if done:
+                mapping["done"] = 1
+            trimmed = [str(i) for i in range(max(0, start - self.max_events), start + len(batch) - self.max_events)]
+            pipe = redis_cache.client.pipeline()
+            pipe.hset(name, mapping=mapping)
+            if trimmed:
+                pipe.hdel(name, *trimmed)
+            pipe.expire(name, ttl)
+            if done and turn.key:
+                # Sau khi xong, request trùng chỉ còn được phát lại trong `window` giây
+                pipe.expire(KEY_PREFIX + turn.key, max(1, int(self.window)))
+            pipe.execute()
+
+        sent = 0
+        try:
+            while True:
+                done = turn.done
+                sent = max(sent, turn.base)
+                batch = turn.since(sent)
+                if batch or done:
+                    await asyncio.to_thread(push, sent, batch, done)
+                    sent += len(batch)
+                if done:
+                    return
+                await asyncio.sleep(REDIS_MIRROR_INTERVAL)
+        except Exception as e:
+            logging.error(f"Redis mirror turn error: {e}")
+
+    def _remote_meta(self, turn_id: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """(scope, fingerprint) của lượt do worker khác chạy, None nếu Redis không có lượt này."""
+        if not redis_cache.connect():
+            return None
+        try:
+            count, scope, fingerprint = redis_cache.client.hmget(EVENTS_PREFIX + turn_id, ["n", "scope", "fp"])
+        except Exception as e:
+            logging.error(f"Redis turn lookup error: {e}")
+            return None
+        if count is None:
+            return None
+        return scope or None, fingerprint or None
+
+    def _pull_remote(self, turn: Turn):
+        """Nạp dần vào `turn` (bản sao cục bộ) các sự kiện của lượt đang chạy/đã xong ở worker khác từ Redis."""
+        name = EVENTS_PREFIX + turn.turn_id
+
+        def read(start: int):
+            fields = ["n", "done"] + [str(i) for i in range(start, start + REDIS_READ_BATCH)]
+            return redis_cache.client.hmget(name, fields)
+
+        async def pull():
+            index = None
+            deadline = time.monotonic() + REMOTE_FOLLOW_TIMEOUT
+            try:
+                while True:
+                    values = await asyncio.to_thread(read, index or 0)
+                    count, done, events = int(values[0] or 0), values[1], values[2:]
+                    if index is None or (index < count and events[0] is None):
+                        # Lần đọc đầu hoặc phần cần đọc đã bị cắt: bắt đầu từ sự kiện cũ nhất còn giữ
+                        start = max(index or 0, count - self.max_events, 0)
+                        moved = start != (index or 0)
+                        index = start
+                        if moved:
+                            continue
+                    for event in events:
+                        if event is None:
+                            break
+                        turn.append(event, index)
+                        index += 1
+                    if done and index >= count:
+                        return
+                    if time.monotonic() > deadline:
+                        turn.append(f"data: {json.dumps({'error': 'Quá thời gian chờ câu trả lời, vui lòng gửi lại câu hỏi.'})}\n\n")
+                        return
+                    if index >= count:
+                        await asyncio.sleep(REDIS_POLL_INTERVAL)
+            except Exception as e:
+                logging.error(f"Redis follow turn error: {e}")
+                turn.append(f"data: {json.dumps({'error': str(e)})}\n\n")
+            finally:
+                turn.finish()
+
+        self._spawn(pull())
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.stats, "active": sum(1 for t in self._turns.values() if not t.done), "buffered": len(self._turns)}
+
+
+turn_registry = TurnRegistry(
+    window=settings.TURN_COALESCE_SECONDS,
+    retention=settings.TURN_BUFFER_SECONDS,
+    max_events=settings.TURN_BUFFER_MAX_EVENTS,
+)
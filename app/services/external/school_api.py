@@ -6,221 +6,121 @@ from typing import Dict, List, Optional, Any
 
 from app.core.config import settings
 from app.services.cache import cache_result
+from app.core.tracing import traced
+from app.services.external.snapshot import SchoolSnapshot
 
 class ExternalAPIService:
     def __init__(self):
         self.api_url = settings.SCHOOL_API_URL
-        self.cached_data = None
-    
-    def _format_day(self, day_code: Any) -> str:
-        try:
-            val = int(day_code)
-            # Quy tắc: dayOfWeek = 1 -> Thứ 2, 2 -> Thứ 3... (val + 1)
-            display_val = val + 1
-            if display_val == 8:
-                return "Chủ Nhật"
-            return f"Thứ {display_val}"
-        except (ValueError, TypeError):
-            # Fallback cho các mã không phải số nguyên
-            return f"Thứ {day_code}"
-
-    def _sync_fetch(self):
-        try:
-            with urllib.request.urlopen(self.api_url) as url:
-                return json.loads(url.read().decode())
-        except Exception as e:
-            raise e
+        # Snapshot gọn (chỉ đọc) của dữ liệu tuyển sinh, không giữ JSON gốc
+        self.snapshot: Optional[SchoolSnapshot] = None
 
-    async def fetch_all_data(self) -> Dict[str, Any]:
+    @traced("school_api.fetch")
+    def _sync_fetch(self) -> SchoolSnapshot:
+        with urllib.request.urlopen(self.api_url) as url:
+            payload = json.loads(url.read().decode())
+        # Chuyển đổi ngay trong luồng tải: JSON gốc được giải phóng sau khi hàm kết thúc
+        return SchoolSnapshot.from_payload(payload)
+
+    async def fetch_all_data(self) -> Optional[SchoolSnapshot]:
         """Lấy toàn bộ dữ liệu từ API thật."""
-        if self.cached_data:
-            return self.cached_data
+        if self.snapshot:
+            return self.snapshot
 
         try:
             logging.info(f"Đang lấy dữ liệu từ {self.api_url}...")
             # Chạy blocking call trong luồng riêng biệt
-            self.cached_data = await asyncio.to_thread(self._sync_fetch)
+            self.snapshot = await asyncio.to_thread(self._sync_fetch)
             logging.info("Lấy dữ liệu thành công.")
-            return self.cached_data
+            return self.snapshot
         except Exception as e:
             logging.error(f"Lỗi khi gọi API tuyển sinh: {e}")
-            return {}
+            return None
 
     async def _ensure_data(self):
-        if not self.cached_data:
+        if not self.snapshot:
             await self.fetch_all_data()
 
     async def check_valid_branch(self, branch_name: str) -> bool:
         """Kiểm tra tên chi nhánh có hợp lệ không."""
         await self._ensure_data()
-        if not self.cached_data or "branches" not in self.cached_data:
+        if not self.snapshot:
             return False
-        
-        b_name_lower = branch_name.lower()
-        for b in self.cached_data["branches"]:
-            # Kiểm tra theo tên hoặc địa chỉ
-            if (b_name_lower in b["name"].lower()) or \
-               (b["name"].lower() in b_name_lower) or \
-               (b_name_lower in b["address"].lower()) or \
-               (b["address"].lower() in b_name_lower):
-                return True
-        return False
+        return self.snapshot.find_branch(branch_name) is not None
 
     async def check_valid_grade(self, grade_name: str) -> bool:
         """Kiểm tra khối học có hợp lệ không."""
         await self._ensure_data()
-        if not self.cached_data or "grades" not in self.cached_data:
+        if not self.snapshot:
             return False
-
-        # grade_name có thể là "10", "Lớp 10"...
-        # Cấu trúc API grades: "code": 10, "name": "Lớp 10"
-        for g in self.cached_data["grades"]:
-            val_code = str(g["code"])
-            if val_code in grade_name or grade_name in val_code or grade_name in g["name"]:
-                return True
-        return False
+        return self.snapshot.find_grade(grade_name) is not None
 
     @cache_result(ttl=3600)
     async def get_all_branches(self) -> List[str]:
         """Lấy danh sách tên tất cả chi nhánh."""
         await self._ensure_data()
-        if not self.cached_data or "branches" not in self.cached_data:
+        if not self.snapshot:
             return []
         # Trả về địa chỉ theo yêu cầu người dùng
-        return [b["address"] for b in self.cached_data["branches"]]
+        return list(self.snapshot.branch_options)
 
     @cache_result(ttl=3600)
     async def get_all_grades(self) -> List[str]:
         """Lấy danh sách mã khối."""
         await self._ensure_data()
-        if not self.cached_data or "grades" not in self.cached_data:
+        if not self.snapshot:
             return []
         # Trả về mã code để prompt dễ hiểu
         # API trả về "10", "11", "12" là hợp lệ.
-        return [str(g["code"]) for g in self.cached_data["grades"]]
+        return list(self.snapshot.grade_options)
 
     @cache_result(ttl=3600)
     async def get_all_subjects(self) -> List[str]:
         """Lấy danh sách các môn học có trong hệ thống."""
         await self._ensure_data()
-        if not self.cached_data:
+        if not self.snapshot:
             return []
-        
-        subjects = set()
-        # Thu thập danh sách môn học từ các lớp học
-        for c in self.cached_data.get("classes", []):
-            subj = c.get("subject")
-            if subj:
-                subj_name = subj.get("name")
-                if subj_name:
-                    subjects.add(subj_name)
-        
-        return list(subjects)
+        return list(self.snapshot.subject_options)
 
+    @traced("school_api.filter")
     async def get_filtered_data(self, branch: str, grade: str, subject: str = None) -> Dict[str, Any]:
         """Lấy dữ liệu đã lọc theo chi nhánh, khối và môn học (option)."""
         await self._ensure_data()
-        if not self.cached_data:
+        snapshot = self.snapshot
+        if not snapshot:
             return {"message": "Không thể kết nối đến hệ thống."}
 
         logging.info(f"Đang lọc dữ liệu cho Chi nhánh: {branch}, Khối: {grade}")
 
-        # 1. Xác định ID Chi nhánh (Resolve Branch ID)
-        branch_id = None
-        branch_info = None
-        for b in self.cached_data.get("branches", []):
-            # Kiểm tra theo tên hoặc địa chỉ
-            if (branch.lower() in b["name"].lower()) or \
-               (b["name"].lower() in branch.lower()) or \
-               (branch.lower() in b["address"].lower()) or \
-               (b["address"].lower() in branch.lower()):
-                branch_id = b["branchId"]
-                
-                # Cập nhật tên chi nhánh nếu người dùng sử dụng địa chỉ,
-                # nhưng vẫn giữ tên chính thức trong context nếu cần.
-                branch_info = b
-                break
-        
-        # 2. Xác định ID Khối lớp (Resolve Grade ID)
-        grade_id = None
-        grade_info = None
-        for g in self.cached_data.get("grades", []):
-            val_code = str(g["code"])
-            if val_code in grade or grade in val_code or grade in g["name"]:
-                grade_id = g["gradeId"]
-                grade_info = g
-                break
-
-        if branch_id is None:
+        # 1-2. Xác định Chi nhánh (theo tên hoặc địa chỉ) và Khối lớp
+        branch_info = snapshot.find_branch(branch)
+        grade_info = snapshot.find_grade(grade)
+
+        if branch_info is None:
             return {"message": f"Không tìm thấy chi nhánh nào khớp với '{branch}'."}
-        if grade_id is None:
+        if grade_info is None:
             return {"message": f"Không tìm thấy khối nào khớp với '{grade}'."}
 
-        # 3. Lọc danh sách lớp học (Filter Classes)
-        filtered_classes = []
-        relevant_class_ids = set()
-        
-        for c in self.cached_data.get("classes", []):
-            # Kiểm tra an toàn null (Null Safety)
-            if c.get("branchId") == branch_id and c.get("gradeId") == grade_id:
-                # Lọc theo Trạng thái (RUNNING hoặc PLANNED)
-                if c.get("status") not in ["RUNNING", "PLANNED"]:
-                    continue
-
-                # Lọc theo môn học nếu có
-                if subject:
-                    c_subject = (c.get("subject") or {}).get("name", "")
-                    # So khớp tương đối cho tên môn học
-                    if subject.lower() not in c_subject.lower() and c_subject.lower() not in subject.lower():
-                        continue
-
-                # Định dạng thông tin lịch học
-                schedules = []
-                for s in c.get("classSchedules", []):
-                    slot = s.get("lessonSlot") or {}
-                    room = s.get("room") or {}
-                    schedules.append(f"{self._format_day(s.get('dayOfWeek'))} - {slot.get('name')} ({slot.get('startTime')}-{slot.get('endTime')}) tại {room.get('name')}")
-
-                class_info = {
-                    "id": c["classId"],
-                    "name": c["name"],
-                    "subject": (c.get("subject") or {}).get("name"),
-                    "fee": c["fee"],
-                    "schedules": schedules,
-                    "startDate": c["startDate"],
-                    "endDate": c["endDate"],
-                    "status": c["status"]
-                }
-                filtered_classes.append(class_info)
-                relevant_class_ids.add(c["classId"])
+        # 3. Lọc danh sách lớp học đang mở (RUNNING hoặc PLANNED), chỉ mục theo (chi nhánh, khối)
+        classes = snapshot.find_classes(branch_info.branch_id, grade_info.grade_id, subject)
 
         # 4. Tìm giáo viên cho các lớp này
-        relevant_teachers = []
-        for t in self.cached_data.get("teachers", []):
-            teach_assignments = t.get("teachingAssignments", [])
-            matches = [assign for assign in teach_assignments if assign.get("classId") in relevant_class_ids]
-            if matches:
-                 relevant_teachers.append({
-                     "name": t.get("user", {}).get("fullName"),
-                     "qualification": t.get("qualification"),
-                     "experience": t.get("experienceYears"),
-                     "subjects": [(ts.get("subject") or {}).get("name") for ts in t.get("teacherSubjects", [])]
-                 })
+        teachers = snapshot.find_teachers(c.class_id for c in classes)
 
         # 5. Xây dựng kết quả trả về
         result = {
             "query_context": {
-                "branch": branch_info["name"],
-                "address": branch_info["address"],
-                "grade": grade_info["name"]
+                "branch": branch_info.name,
+                "address": branch_info.address,
+                "grade": grade_info.name
             },
-            "classes_found": filtered_classes,
-            "teachers": relevant_teachers,
-            "holidays": [h["name"] + f" ({h['description']})" for h in self.cached_data.get("holidays", [])], # Global holidays
-            "semesters": [s["name"] for s in self.cached_data.get("semesters", [])]
+            "classes_found": [c.to_dict() for c in classes],
+            "teachers": [t.to_dict() for t in teachers],
+            "holidays": list(snapshot.holidays), # Global holidays
+            "semesters": list(snapshot.semesters)
         }
         
-        if not filtered_classes:
+        if not classes:
              result["message"] = "Hiện tại chưa có lớp học nào mở cho Khối và Chi nhánh này."
 
         return result
@@ -0,0 +1,204 @@
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+# Trạng thái lớp học được trả về cho người dùng
+ACTIVE_STATUSES = ("RUNNING", "PLANNED")
+
+
+def _intern(value: Any) -> Any:
+    """Intern chuỗi lặp lại (tên môn, trạng thái, phòng, ca học...) để các lớp dùng chung một object."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def format_day(day_code: Any) -> str:
+    try:
+        val = int(day_code)
+        # Quy tắc: dayOfWeek = 1 -> Thứ 2, 2 -> Thứ 3... (val + 1)
+        display_val = val + 1
+        if display_val == 8:
+            return "Chủ Nhật"
+        return f"Thứ {display_val}"
+    except (ValueError, TypeError):
+        # Fallback cho các mã không phải số nguyên
+        return f"Thứ {day_code}"
+
+
+@dataclass(frozen=True, slots=True)
+class Branch:
+    branch_id: Any
+    name: str
+    address: str
+    name_lower: str
+    address_lower: str
+
+    def matches(self, text_lower: str) -> bool:
+        # Kiểm tra theo tên hoặc địa chỉ (khớp chuỗi con hai chiều)
+        return (text_lower in self.name_lower) or (self.name_lower in text_lower) or \
+               (text_lower in self.address_lower) or (self.address_lower in text_lower)
+
+
+@dataclass(frozen=True, slots=True)
+class Grade:
+    grade_id: Any
+    code: str
+    name: str
+
+    def matches(self, text: str) -> bool:
+        # text có thể là "10", "Lớp 10"...
+        return self.code in text or text in self.code or text in self.name
+
+
+@dataclass(frozen=True, slots=True)
+class SchoolClass:
+    class_id: Any
+    name: str
+    subject: Optional[str]
+    subject_lower: str
+    fee: Any
+    schedules: Tuple[str, ...]
+    start_date: Any
+    end_date: Any
+    status: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.class_id,
+            "name": self.name,
+            "subject": self.subject,
+            "fee": self.fee,
+            "schedules": list(self.schedules),
+            "startDate": self.start_date,
+            "endDate": self.end_date,
+            "status": self.status,
+        }
+
+
+@dataclass(frozen=True, slots=True)
+class Teacher:
+    name: Optional[str]
+    qualification: Any
+    experience: Any
+    subjects: Tuple[Optional[str], ...]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "qualification": self.qualification,
+            "experience": self.experience,
+            "subjects": list(self.subjects),
+        }
+
+
+class SchoolSnapshot:
+    """
+    Snapshot gọn của dữ liệu tuyển sinh (common-data), dựng một lần khi tải từ API.
+    Chỉ giữ các trường dùng cho tra cứu lớp học, danh sách lựa chọn và khớp thực thể;
+    lớp học đang mở được đánh chỉ mục theo (branch_id, grade_id), lịch học định dạng sẵn.
+    Chỉ đọc sau khi tạo -> dùng chung an toàn giữa các request và giữa các worker (preload).
+    """
+    __slots__ = ("branches", "grades", "classes_by_key", "teachers", "teachers_by_class",
+                 "holidays", "semesters", "branch_options", "grade_options", "subject_options")
+
+    def __init__(self, branches, grades, classes_by_key, teachers, teachers_by_class, holidays, semesters, subject_options):
+        self.branches: Tuple[Branch, ...] = branches
+        self.grades: Tuple[Grade, ...] = grades
+        self.classes_by_key: Dict[Tuple[Any, Any], Tuple[SchoolClass, ...]] = classes_by_key
+        self.teachers: Tuple[Teacher, ...] = teachers
+        self.teachers_by_class: Dict[Any, Tuple[int, ...]] = teachers_by_class
+        self.holidays: Tuple[str, ...] = holidays
+        self.semesters: Tuple[str, ...] = semesters
+        # Danh sách lựa chọn hiển thị cho người dùng / prompt trích xuất thực thể
+        self.branch_options: Tuple[str, ...] = tuple(b.address for b in branches)
+        self.grade_options: Tuple[str, ...] = tuple(g.code for g in grades)
+        self.subject_options: Tuple[str, ...] = subject_options
+
+    @classmethod
+    def from_payload(cls, data: Dict[str, Any]) -> "SchoolSnapshot":
+        branches = tuple(
+            Branch(b["branchId"], _intern(b["name"]), _intern(b["address"]), b["name"].lower(), b["address"].lower())
+            for b in data.get("branches", [])
+        )
+        grades = tuple(Grade(g["gradeId"], _intern(str(g["code"])), _intern(g["name"])) for g in data.get("grades", []))
+
+        subjects = {}
+        classes_by_key: Dict[Tuple[Any, Any], List[SchoolClass]] = {}
+        for c in data.get("classes", []):
+            subject = (c.get("subject") or {}).get("name")
+            if subject:
+                subjects.setdefault(_intern(subject), None)
+            if c.get("status") not in ACTIVE_STATUSES:
+                continue
+
+            schedules = []
+            for s in c.get("classSchedules", []):
+                slot = s.get("lessonSlot") or {}
+                room = s.get("room") or {}
+                schedules.append(_intern(f"{format_day(s.get('dayOfWeek'))} - {slot.get('name')} ({slot.get('startTime')}-{slot.get('endTime')}) tại {room.get('name')}"))
+
+            school_class = SchoolClass(
+                class_id=c["classId"],
+                name=c["name"],
+                subject=_intern(subject),
+                subject_lower=_intern((subject or "").lower()),
+                fee=c["fee"],
+                schedules=tuple(schedules),
+                start_date=_intern(c["startDate"]),
+                end_date=_intern(c["endDate"]),
+                status=_intern(c["status"]),
+            )
+            classes_by_key.setdefault((c.get("branchId"), c.get("gradeId")), []).append(school_class)
+
+        teachers = []
+        teachers_by_class: Dict[Any, List[int]] = {}
+        for t in data.get("teachers", []):
+            index = len(teachers)
+            teachers.append(Teacher(
+                name=(t.get("user") or {}).get("fullName"),
+                qualification=_intern(t.get("qualification")),
+                experience=t.get("experienceYears"),
+                subjects=tuple(_intern((ts.get("subject") or {}).get("name")) for ts in t.get("teacherSubjects", [])),
+            ))
+            for assign in t.get("teachingAssignments", []):
+                assigned = teachers_by_class.setdefault(assign.get("classId"), [])
+                if not assigned or assigned[-1] != index:
+                    assigned.append(index)
+
+        return cls(
+            branches=branches,
+            grades=grades,
+            classes_by_key={key: tuple(value) for key, value in classes_by_key.items()},
+            teachers=tuple(teachers),
+            teachers_by_class={key: tuple(value) for key, value in teachers_by_class.items()},
+            holidays=tuple(h["name"] + f" ({h['description']})" for h in data.get("holidays", [])),
+            semesters=tuple(_intern(s["name"]) for s in data.get("semesters", [])),
+            subject_options=tuple(subjects),
+        )
+
+    def find_branch(self, text: str) -> Optional[Branch]:
+        text_lower = text.lower()
+        for b in self.branches:
+            if b.matches(text_lower):
+                return b
+        return None
+
+    def find_grade(self, text: str) -> Optional[Grade]:
+        for g in self.grades:
+            if g.matches(text):
+                return g
+        return None
+
+    def find_classes(self, branch_id: Any, grade_id: Any, subject: Optional[str] = None) -> List[SchoolClass]:
+        classes = self.classes_by_key.get((branch_id, grade_id), ())
+        if not subject:
+            return list(classes)
+        subject_lower = subject.lower()
+        # So khớp tương đối cho tên môn học
+        return [c for c in classes if subject_lower in c.subject_lower or c.subject_lower in subject_lower]
+
+    def find_teachers(self, class_ids) -> List[Teacher]:
+        # Giữ thứ tự giáo viên như trong dữ liệu gốc, mỗi giáo viên một lần
+        indexes = set()
+        for class_id in class_ids:
+            indexes.update(self.teachers_by_class.get(class_id, ()))
+        return [self.teachers[i] for i in sorted(indexes)]
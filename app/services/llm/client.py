@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.core.config import settings
+from app.core.tracing import span
+from app.services.llm.governor import llm_governor, AdmissionRejected, LLMGovernor
+from app.services.llm.usage import llm_usage
+
+# Tên lớp exception (google.api_core, httpx, grpc...) được coi là lỗi tạm thời -> thử lại.
+# So khớp theo tên để không phải import SDK của Google ở cấp module.
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+    "GatewayTimeout", "BadGateway", "Aborted", "RetryError",
+    "ConnectError", "ConnectTimeout", "ReadTimeout", "ReadError", "WriteTimeout", "PoolTimeout", "RemoteProtocolError",
+    "TransientLLMError",
+}
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """Không lấy được câu trả lời từ LLM (circuit breaker mở, hết deadline hoặc hết lượt thử lại)."""
+
+
+class CircuitOpen(LLMUnavailable):
+    """Circuit breaker đang mở: không gọi LLM, người gọi chuyển sang phương án dự phòng ngay."""
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    code = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    return isinstance(code, int) and code in TRANSIENT_STATUS_CODES
+
+
+class CallPolicy:
+    """Chính sách cho một loại lời gọi: deadline tổng (giây, gồm cả thử lại), số lần thử lại, hedging."""
+
+    def __init__(self, deadline: float, retries: int = settings.LLM_MAX_RETRIES, hedge: bool = settings.LLM_HEDGE_ENABLED):
+        self.deadline = deadline
+        self.retries = retries
+        self.hedge = hedge
+
+
+# Deadline theo loại lời gọi: bước trích xuất/chọn tool ngắn, bước sinh câu trả lời dài hơn
+POLICIES: Dict[str, CallPolicy] = {
+    "extraction": CallPolicy(settings.LLM_DEADLINE_EXTRACTION),
+    "tool_selection": CallPolicy(settings.LLM_DEADLINE_TOOL_SELECTION),
+    "data_response": CallPolicy(settings.LLM_DEADLINE_RESPONSE),
+    "rag_answer": CallPolicy(settings.LLM_DEADLINE_RESPONSE),
+    # Stream: không hedge (tránh trả hai luồng token), chỉ thử lại trước khi nhận token đầu tiên
+    "stream": CallPolicy(settings.LLM_DEADLINE_RESPONSE, hedge=False),
+}
+
+
+class LatencyTracker:
+    """Độ trễ gần đây (cửa sổ trượt) của một loại lời gọi, dùng để đặt ngưỡng hedge tại p95."""
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class CircuitBreaker:
+    """
+    closed -> open khi có `failure_threshold` lỗi liên tiếp; sau `reset_timeout` giây chuyển half_open
+    và cho một lời gọi thử: thành công -> closed, thất bại -> open lại.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def release_probe(self):
+        # Lời gọi thử kết thúc mà không có kết quả (bị governor từ chối, bị hủy...) -> cho phép thử lại.
+        # Gọi lại sau record_success/record_failure cũng vô hại.
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+                logging.warning(f"Circuit breaker LLM mở sau {self.failures} lỗi liên tiếp")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self.failures, "trips": self.trips}
+
+
+class LLMClient:
+    """
+    Lớp gọi LLM dùng chung: mọi lời gọi đi qua governor (giới hạn đồng thời), có deadline theo loại lời gọi,
+    thử lại với jitter cho lỗi tạm thời, gửi yêu cầu dự phòng (hedge) khi yêu cầu đầu vượt p95,
+    và circuit breaker để thất bại nhanh khi upstream sự cố (người gọi dùng câu trả lời FAQ/cache).
+    Deadline chỉ tính từ lúc có suất của governor: chờ trong hàng đợi cục bộ quá lâu là AdmissionRejected (429),
+    không phải lỗi upstream, nên không tính vào circuit breaker.
+    """
+
+    def __init__(self, policies: Dict[str, CallPolicy] = None, breaker: CircuitBreaker = None,
+                 retry_base_delay: float = settings.LLM_RETRY_BASE_DELAY, hedge_min_samples: int = settings.LLM_HEDGE_MIN_SAMPLES,
+                 governor: LLMGovernor = None):
+        self.policies = policies or POLICIES
+        self.breaker = breaker or CircuitBreaker(settings.LLM_CIRCUIT_FAILURE_THRESHOLD, settings.LLM_CIRCUIT_RESET_SECONDS)
+        self.governor = governor or llm_governor
+        self.retry_base_delay = retry_base_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.latency: Dict[str, LatencyTracker] = {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _stat(self, call_type: str, key: str):
+        counters = self.stats.setdefault(call_type, {"calls": 0, "ok": 0, "failed": 0, "retries": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0, "short_circuited": 0})
+        counters[key] += 1
+
+    def _policy(self, call_type: str) -> CallPolicy:
+        return self.policies.get(call_type) or CallPolicy(settings.LLM_DEADLINE_RESPONSE)
+
+    def _hedge_delay(self, call_type: str) -> Optional[float]:
+        tracker = self.latency.get(call_type)
+        if not tracker or len(tracker.samples) < self.hedge_min_samples:
+            return None
+        # Chỉ hedge khi governor còn suất trống, không chiếm chỗ của lượt chat khác
+        if self.governor.in_flight >= self.governor.max_in_flight:
+            return None
+        return tracker.percentile(95)
+
+    async def _call(self, runnable, payload: Any, call_type: str) -> Any:
+        return await runnable.ainvoke(payload, config={"callbacks": [llm_usage.callback(call_type)]})
+
+    async def _backup_call(self, runnable, payload: Any, call_type: str) -> Any:
+        # Yêu cầu hedge cần suất riêng (yêu cầu đầu đang giữ suất của lượt gọi)
+        async with self.governor.slot():
+            return await self._call(runnable, payload, call_type)
+
+    async def _hedged_call(self, runnable, payload: Any, call_type: str, policy: CallPolicy) -> Any:
+        """Chạy trong suất governor của lời gọi (người gọi đã giữ suất)."""
+        delay = self._hedge_delay(call_type) if policy.hedge else None
+        if delay is None:
+            return await self._call(runnable, payload, call_type)
+
+        primary = asyncio.ensure_future(self._call(runnable, payload, call_type))
+        backup = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            # Yêu cầu đầu chậm hơn p95 -> gửi thêm một yêu cầu, lấy kết quả về trước
+            self._stat(call_type, "hedged")
+            backup = asyncio.ensure_future(self._backup_call(runnable, payload, call_type))
+            pending = {primary, backup}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._stat(call_type, "hedge_wins")
+                        return task.result()
+            # Cả hai đều lỗi -> ném lỗi của yêu cầu đầu
+            return primary.result()
+        finally:
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def ainvoke(self, runnable, payload: Any, call_type: str) -> Any:
+        """Gọi `runnable.ainvoke(payload)` theo chính sách của `call_type`."""
+        with span(f"llm.{call_type}"):
+            return await self._ainvoke(runnable, payload, call_type)
+
+    async def _ainvoke(self, runnable, payload: Any, call_type: str) -> Any:
+        policy = self._policy(call_type)
+        self._stat(call_type, "calls")
+        if not self.breaker.allow():
+            self._stat(call_type, "short_circuited")
+            raise CircuitOpen("LLM tạm thời không khả dụng")
+        # Ở half_open chỉ lời gọi thử được cho qua; nó phải được trả lại dù kết thúc thế nào
+        # (kể cả bị hủy: client ngắt kết nối, hủy qua WebSocket, thua hedge)
+        probe = self.breaker.state == "half_open"
+        try:
+            return await self._attempts(runnable, payload, call_type, policy)
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    async def _attempts(self, runnable, payload: Any, call_type: str, policy: CallPolicy) -> Any:
+        deadline = None
+        attempt = 0
+        while True:
+            try:
+                # AdmissionRejected (hàng đợi cục bộ đầy/quá hạn) ném thẳng ra ngoài, không tính vào circuit breaker
+                async with self.governor.slot():
+                    # Deadline bắt đầu khi lời gọi đầu tiên có suất: thời gian chờ trong hàng đợi không bị tính là upstream chậm
+                    started = time.monotonic()
+                    deadline = deadline or started + policy.deadline
+                    result = await asyncio.wait_for(self._hedged_call(runnable, payload, call_type, policy), timeout=max(0.0, deadline - started))
+            except AdmissionRejected:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self._stat(call_type, "timeouts")
+                if not is_transient(e):
+                    self.breaker.record_success()  # upstream vẫn phản hồi (lỗi do yêu cầu)
+                    self._stat(call_type, "failed")
+                    raise
+                self.breaker.record_failure()
+                remaining = deadline - time.monotonic()
+                if attempt >= policy.retries or remaining <= 0 or self.breaker.state == "open":
+                    self._stat(call_type, "failed")
+                    raise LLMUnavailable(f"Lời gọi LLM '{call_type}' thất bại: {e!r}") from e
+                # Full jitter: tránh các worker cùng thử lại một lúc
+                backoff = random.uniform(0, self.retry_base_delay * (2 ** attempt))
+                attempt += 1
+                self._stat(call_type, "retries")
+                logging.warning(f"Lỗi tạm thời khi gọi LLM '{call_type}' ({e!r}), thử lại lần {attempt} sau {backoff:.2f}s")
+                await asyncio.sleep(min(backoff, remaining))
+                continue
+
+            self.latency.setdefault(call_type, LatencyTracker()).record(time.monotonic() - started)
+            self.breaker.record_success()
+            self._stat(call_type, "ok")
+            return result
+
+    async def astream(self, runnable, payload: Any, call_type: str = "stream") -> AsyncIterator[Any]:
+        """
+        Stream `runnable.astream(payload)` với deadline tổng. Chỉ thử lại khi chưa nhận được chunk nào
+        (đã gửi token cho client thì không thể phát lại).
+        """
+        policy = self._policy(call_type)
+        self._stat(call_type, "calls")
+        if not self.breaker.allow():
+            self._stat(call_type, "short_circuited")
+            raise CircuitOpen("LLM tạm thời không khả dụng")
+        probe = self.breaker.state == "half_open"
+        try:
+            # aclosing: client dừng đọc giữa chừng -> đóng ngay luồng bên trong (trả suất governor)
+            async with aclosing(self._stream_attempts(runnable, payload, call_type, policy)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    async def _stream_attempts(self, runnable, payload: Any, call_type: str, policy: CallPolicy) -> AsyncIterator[Any]:
+        deadline = None
+        attempt = 0
+        while True:
+            received = False
+            try:
+                async with self.governor.slot():
+                    started = time.monotonic()
+                    deadline = deadline or started + policy.deadline
+                    iterator = runnable.astream(payload, config={"callbacks": [llm_usage.callback(call_type)]}).__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), timeout=max(0.0, deadline - time.monotonic()))
+                        except StopAsyncIteration:
+                            break
+                        received = True
+                        yield chunk
+            except AdmissionRejected:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self._stat(call_type, "timeouts")
+                if not is_transient(e):
+                    self.breaker.record_success()
+                    self._stat(call_type, "failed")
+                    raise
+                self.breaker.record_failure()
+                remaining = deadline - time.monotonic()
+                if received or attempt >= policy.retries or remaining <= 0 or self.breaker.state == "open":
+                    self._stat(call_type, "failed")
+                    raise LLMUnavailable(f"Stream LLM '{call_type}' thất bại: {e!r}") from e
+                backoff = random.uniform(0, self.retry_base_delay * (2 ** attempt))
+                attempt += 1
+                self._stat(call_type, "retries")
+                await asyncio.sleep(min(backoff, remaining))
+                continue
+
+            self.latency.setdefault(call_type, LatencyTracker()).record(time.monotonic() - started)
+            self.breaker.record_success()
+            self._stat(call_type, "ok")
+            return
+
+    def snapshot(self) -> Dict[str, Any]:
+        latency = {}
+        for call_type, tracker in self.latency.items():
+            p50, p95 = tracker.percentile(50), tracker.percentile(95)
+            latency[call_type] = {"p50_ms": round(p50 * 1000, 1) if p50 is not None else None, "p95_ms": round(p95 * 1000, 1) if p95 is not None else None}
+        return {"circuit_breaker": self.breaker.snapshot(), "calls": self.stats, "latency": latency}
+
+
+llm_client = LLMClient()
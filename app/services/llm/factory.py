@@ -0,0 +1,32 @@
+from app.core.config import settings
+
+
+def create_chat_model(temperature: float = 0.3):
+    """
+    Tạo client LLM theo LLM_PROVIDER. Import langchain_google_genai ngay tại đây (lần dùng đầu tiên)
+    thay vì ở cấp module để `import app.main` không phải tải SDK của Google.
+    """
+    if settings.LLM_PROVIDER == "fake":
+        return create_fake_chat_model()
+    if settings.LLM_PROVIDER != "gemini":
+        raise ValueError(f"LLM_PROVIDER không hợp lệ: {settings.LLM_PROVIDER}")
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=settings.MODEL_NAME, google_api_key=settings.GOOGLE_API_KEY, temperature=temperature)
+
+
+def create_fake_chat_model():
+    """Model giả có kịch bản (không gọi mạng), độ trễ/lỗi cấu hình qua FAKE_LLM_*."""
+    from app.services.llm.fake import FakeChatModel
+    from app.services.llm.scripted import ScriptedResponder
+    return FakeChatModel(
+        responder=ScriptedResponder(),
+        latency_ms=settings.FAKE_LLM_LATENCY_MS,
+        latency_jitter_ms=settings.FAKE_LLM_JITTER_MS,
+        latency_distribution=settings.FAKE_LLM_LATENCY_DISTRIBUTION,
+        latency_sigma=settings.FAKE_LLM_LATENCY_SIGMA,
+        token_delay_ms=settings.FAKE_LLM_TOKEN_DELAY_MS,
+        slow_rate=settings.FAKE_LLM_SLOW_RATE,
+        slow_latency_ms=settings.FAKE_LLM_SLOW_LATENCY_MS,
+        error_rate=settings.FAKE_LLM_ERROR_RATE,
+    )
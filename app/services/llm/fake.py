@@ -0,0 +1,112 @@
+import asyncio
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Union
+
+from pydantic import Field, PrivateAttr
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class TransientLLMError(Exception):
+    """Lỗi giả lập phía upstream (quá tải/tạm thời), được LLMClient coi là lỗi có thể thử lại."""
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model giả để kiểm thử lớp gọi LLM (deadline, retry, hedging, circuit breaker) mà không cần Gemini.
+    Câu trả lời lấy từ `responder(messages)` hoặc xoay vòng trong `responses`; có thể chèn độ trễ
+    (cơ bản + jitter + đuôi chậm) và lỗi tạm thời theo xác suất.
+    """
+    responses: List[Union[str, AIMessage]] = Field(default_factory=lambda: ["Đây là câu trả lời thử nghiệm."])
+    responder: Optional[Callable[[List[BaseMessage]], Union[str, AIMessage]]] = None
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    # Phân phối độ trễ: "uniform" (latency_ms ± jitter) hoặc "lognormal" (trung vị latency_ms, độ lệch latency_sigma)
+    latency_distribution: str = "uniform"
+    latency_sigma: float = 0.5
+    # Đuôi chậm: với xác suất `slow_rate`, độ trễ là `slow_latency_ms` (để thử hedging/deadline)
+    slow_rate: float = 0.0
+    slow_latency_ms: float = 0.0
+    error_rate: float = 0.0
+    token_delay_ms: float = 0.0
+    seed: Optional[int] = None
+    stats: Dict[str, int] = Field(default_factory=lambda: {"calls": 0, "errors": 0, "slow": 0})
+
+    _rng: random.Random = PrivateAttr()
+    _cursor: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        # Tool call do `responder`/`responses` quyết định (AIMessage có tool_calls)
+        return self
+
+    def _latency_seconds(self) -> float:
+        if self.slow_rate and self._rng.random() < self.slow_rate:
+            self.stats["slow"] += 1
+            return self.slow_latency_ms / 1000
+        if self.latency_distribution == "lognormal":
+            return self.latency_ms * self._rng.lognormvariate(0.0, self.latency_sigma) / 1000
+        jitter = self._rng.uniform(-self.latency_jitter_ms, self.latency_jitter_ms) if self.latency_jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _next_message(self, messages: List[BaseMessage]) -> AIMessage:
+        self.stats["calls"] += 1
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            raise TransientLLMError("Lỗi giả lập: upstream tạm thời không khả dụng")
+        if self.responder:
+            message = self.responder(messages)
+        else:
+            message = self.responses[self._cursor % len(self.responses)]
+            self._cursor += 1
+        message = AIMessage(content=message) if isinstance(message, str) else message.model_copy()
+        # Ước lượng ~4 ký tự/token để thống kê token/chi phí cũng chạy được với model giả
+        input_tokens = sum(len(str(m.content)) for m in messages) // 4
+        output_tokens = len(str(message.content)) // 4
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+        return message
+
+    def _chunks(self, message: AIMessage) -> Iterator[AIMessageChunk]:
+        # Số token của cả lời gọi gắn vào chunk đầu (LangChain cộng dồn usage của các chunk)
+        usage = message.usage_metadata
+        for token in re.split(r"(\s)", message.content or ""):
+            if token:
+                yield AIMessageChunk(content=token, usage_metadata=usage)
+                usage = None
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency_seconds())
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency_seconds())
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._latency_seconds())
+        for chunk in self._chunks(self._next_message(messages)):
+            time.sleep(self.token_delay_ms / 1000)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # Độ trễ trước token đầu tiên (TTFB), sau đó từng token cách nhau `token_delay_ms`
+        await asyncio.sleep(self._latency_seconds())
+        for chunk in self._chunks(self._next_message(messages)):
+            await asyncio.sleep(self.token_delay_ms / 1000)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
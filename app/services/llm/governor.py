@@ -0,0 +1,164 @@
+import asyncio
+import contextvars
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.core.tracing import span
+
+# Người dùng (user_id hoặc session_id) của lượt chat hiện tại, dùng cho giới hạn theo người dùng
+current_user: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_current_user", default=None)
+# Danh tính chung của mọi câu hỏi trong một lượt đánh giá hàng loạt (/api/v1/batch), có giới hạn suất riêng
+BATCH_USER = "__batch__"
+
+
+class AdmissionRejected(Exception):
+    """Không nhận thêm lời gọi LLM (hàng đợi đầy hoặc chờ quá hạn). `retry_after` tính bằng giây."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMGovernor:
+    """
+    Giới hạn số lời gọi LLM (Gemini) đồng thời: toàn cục và theo người dùng.
+    Lời gọi vượt giới hạn chờ trong hàng đợi có giới hạn, quá `queue_timeout` giây thì bị từ chối;
+    hàng đợi đầy thì từ chối ngay (API trả 429 + Retry-After thay vì treo kết nối).
+    """
+
+    def __init__(self, max_in_flight: int, max_per_user: int, max_queue: int, queue_timeout: float, user_limits: Optional[Dict[str, int]] = None):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        # Giới hạn riêng cho một số danh tính (ví dụ BATCH_USER), thay cho max_per_user
+        self.user_limits = user_limits or {}
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._per_user: Dict[str, int] = {}
+        self._waiting_per_user: Dict[str, int] = {}
+        self._cond: Optional[asyncio.Condition] = None
+        self._avg_call_seconds = 2.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0, "max_waiting": 0}
+
+    def _condition(self) -> asyncio.Condition:
+        # Tạo lười trong event loop đang chạy (mỗi worker một event loop riêng)
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _can_run(self, user: Optional[str]) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        return user is None or self._per_user.get(user, 0) < self._limit(user)
+
+    def _limit(self, user: str) -> int:
+        return self.user_limits.get(user, self.max_per_user)
+
+    def retry_after(self) -> int:
+        """Ước lượng thời gian (giây) để hàng đợi hiện tại được giải phóng."""
+        return max(1, math.ceil(self._avg_call_seconds * (self.waiting + 1) / max(1, self.max_in_flight)))
+
+    def check_admission(self, user: Optional[str] = None):
+        """Kiểm tra nhanh trước khi nhận lượt chat mới; ném AdmissionRejected nếu đã quá tải."""
+        if self.waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise AdmissionRejected("Hệ thống đang quá tải, vui lòng thử lại sau.", self.retry_after())
+        if user is not None and self._waiting_per_user.get(user, 0) >= self._limit(user):
+            self.stats["rejected"] += 1
+            raise AdmissionRejected("Bạn đang gửi quá nhiều yêu cầu cùng lúc, vui lòng đợi câu trả lời trước.", self.retry_after())
+
+    async def acquire(self, user: Optional[str] = None):
+        cond = self._condition()
+        async with cond:
+            if self._can_run(user):
+                self._take(user)
+                return
+            if self.waiting >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise AdmissionRejected("Hệ thống đang quá tải, vui lòng thử lại sau.", self.retry_after())
+
+            started = time.perf_counter()
+            self.waiting += 1
+            self.stats["queued"] += 1
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], self.waiting)
+            if user is not None:
+                self._waiting_per_user[user] = self._waiting_per_user.get(user, 0) + 1
+            try:
+                await asyncio.wait_for(cond.wait_for(lambda: self._can_run(user)), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.stats["timed_out"] += 1
+                raise AdmissionRejected("Hệ thống đang quá tải, vui lòng thử lại sau.", self.retry_after())
+            finally:
+                self.waiting -= 1
+                if user is not None:
+                    remaining = self._waiting_per_user.get(user, 1) - 1
+                    if remaining > 0:
+                        self._waiting_per_user[user] = remaining
+                    else:
+                        self._waiting_per_user.pop(user, None)
+                waited_ms = (time.perf_counter() - started) * 1000
+                self.stats["total_wait_ms"] += waited_ms
+                self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], waited_ms)
+            self._take(user)
+
+    def _take(self, user: Optional[str]):
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        if user is not None:
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+
+    async def release(self, user: Optional[str], call_seconds: float):
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            if user is not None:
+                remaining = self._per_user.get(user, 1) - 1
+                if remaining > 0:
+                    self._per_user[user] = remaining
+                else:
+                    self._per_user.pop(user, None)
+            # Trung bình trượt thời gian một lời gọi (để ước lượng Retry-After)
+            self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * call_seconds
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self, user: Optional[str] = None):
+        """Giữ một suất gọi LLM trong suốt khối `async with` (kể cả khi stream)."""
+        user = user if user is not None else current_user.get()
+        with span("llm.queue"):
+            await self.acquire(user)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            # Shield: suất phải được trả lại kể cả khi request bị hủy giữa chừng
+            await asyncio.shield(self.release(user, time.perf_counter() - started))
+
+    def snapshot(self) -> Dict[str, Any]:
+        queued = self.stats["queued"]
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_per_user": self.max_per_user,
+            "max_queue": self.max_queue,
+            "active_users": len(self._per_user),
+            "avg_wait_ms": round(self.stats["total_wait_ms"] / queued, 2) if queued else 0.0,
+            "avg_call_seconds": round(self._avg_call_seconds, 3),
+            "retry_after_seconds": self.retry_after(),
+        }
+
+
+llm_governor = LLMGovernor(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    max_per_user=settings.LLM_MAX_IN_FLIGHT_PER_USER,
+    max_queue=settings.LLM_MAX_QUEUE,
+    queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+    user_limits={BATCH_USER: settings.BATCH_LLM_MAX_IN_FLIGHT},
+)
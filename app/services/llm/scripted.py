@@ -0,0 +1,124 @@
+import ast
+import json
+import re
+from typing import Any, List, Optional, Tuple, Union
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# Từ khóa cho thấy người dùng đang tìm lớp học (luồng search_classes)
+CLASS_KEYWORDS = ("lớp", "khóa", "khoá", "học phí", "lịch học", "đăng ký", "môn")
+GREETING_KEYWORDS = ("xin chào", "chào", "hello")
+# Câu hỏi lại của trợ lý khi thiếu thông tin (xem ChatOrchestrator) -> lượt sau vẫn thuộc luồng tìm lớp
+ASKING_PHRASES = ("chọn chi nhánh", "chọn khối lớp", "môn gì")
+
+
+def _between(text: str, start: str, end: Optional[str] = None) -> str:
+    head = text.split(start, 1)[1] if start in text else ""
+    return head.split(end, 1)[0] if end and end in head else head
+
+
+def _literal(text: str, default: Any) -> Any:
+    try:
+        return ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError):
+        return default
+
+
+def _find(options: List[str], text: str) -> Optional[str]:
+    text = text.lower()
+    for option in options:
+        if option.lower() in text:
+            return option
+    return None
+
+
+class ScriptedResponder:
+    """
+    Trả lời có kịch bản cho FakeChatModel (LLM_PROVIDER=fake), đủ để chạy trọn pipeline chat không cần Gemini:
+    nhận diện prompt đang được gọi (trích xuất thực thể, chọn tool, sinh JSON lớp học, RAG)
+    và trả về kết quả đúng định dạng mà ChatOrchestrator/RAGService mong đợi. Kết quả chỉ phụ thuộc đầu vào.
+    """
+
+    def __call__(self, messages: List[BaseMessage]) -> Union[str, AIMessage]:
+        first = messages[0].content if messages else ""
+        if isinstance(messages[0], SystemMessage) and "CÁC CÔNG CỤ (TOOLS)" in first:
+            return self._select_tool(messages)
+        if "Output format: Branch|Grade|Subject" in first:
+            return self._extract(first)
+        if "Dữ liệu tra cứu được:" in first:
+            return self._data_response(first)
+        if "Câu hỏi:" in first:
+            return self._rag_answer(first)
+        return "Đây là câu trả lời thử nghiệm."
+
+    def _extract(self, prompt: str) -> str:
+        branches = _literal(_between(prompt, "Danh sách Chi nhánh hợp lệ:", "\n"), [])
+        grades = _literal(_between(prompt, "Danh sách Khối hợp lệ:", "\n"), [])
+        subjects = _literal(_between(prompt, "Danh sách Môn hợp lệ:", "\n"), [])
+        text = _between(prompt, 'Câu nói: "', '"\n')
+
+        grade = None
+        for number in re.findall(r"\d{1,2}", text):
+            if number in grades:
+                grade = number
+        branch = _find(branches, text)
+        subject = _find(subjects, text)
+        return f"{branch or 'None'}|{grade or 'None'}|{subject or 'None'}"
+
+    def _slots(self, messages: List[BaseMessage]) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        for message in reversed(messages):
+            if isinstance(message, SystemMessage) and message.content.startswith("SYSTEM_NOTE"):
+                found = re.search(r"Branch=(.*), Grade=(.*), Subject=(.*)$", message.content)
+                if found:
+                    return tuple(None if v == "None" else v for v in found.groups())
+        return None, None, None
+
+    def _select_tool(self, messages: List[BaseMessage]) -> AIMessage:
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        last_answer = next((m.content for m in reversed(messages) if isinstance(m, AIMessage)), "")
+        lower = question.lower()
+        branch, grade, subject = self._slots(messages)
+
+        def call(name: str, **args) -> AIMessage:
+            return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"scripted-{name}"}])
+
+        class_flow = any(kw in lower for kw in CLASS_KEYWORDS) or any(p in last_answer.lower() for p in ASKING_PHRASES)
+        if class_flow:
+            if not branch:
+                return call("ask_for_branch")
+            if not grade:
+                return call("ask_for_grade")
+            args = {"branch": branch, "grade": grade}
+            if subject:
+                args["subject"] = subject
+            return call("search_classes", **args)
+        if lower.startswith(GREETING_KEYWORDS):
+            return AIMessage(content="Chào bạn! Mình là trợ lý tuyển sinh, bạn cần tư vấn khóa học hay thông tin gì ạ?")
+        return call("search_general_info", query=question)
+
+    def _data_response(self, prompt: str) -> str:
+        data = _literal(_between(prompt, "Dữ liệu tra cứu được:", "Câu hỏi:"), {})
+        classes = (data.get("classes_found") or []) if isinstance(data, dict) else []
+        if not classes:
+            return json.dumps({"answer": "Hiện tại chưa có lớp học nào phù hợp.", "courses": []}, ensure_ascii=False)
+
+        query_context = data.get("query_context", {})
+        courses = [{
+            "id": str(c.get("id")),
+            "name": c.get("name"),
+            "schedule": "; ".join(c.get("schedules", [])),
+            "location": query_context.get("address") or query_context.get("branch"),
+            "price": str(c.get("fee")),
+            "status": c.get("status"),
+            "endDate": c.get("endDate"),
+        } for c in classes]
+        answer = f"Mình tìm thấy {len(courses)} lớp phù hợp, bạn tham khảo nhé:"
+        return json.dumps({"answer": answer, "courses": courses}, ensure_ascii=False)
+
+    def _rag_answer(self, prompt: str) -> str:
+        context = _between(prompt, "để trả lời câu hỏi.", "Câu hỏi:")
+        context = _between(context, "\n").strip()
+        lines = [line.strip() for line in context.splitlines() if line.strip()]
+        if not lines:
+            return "Tôi chưa có thông tin này, bạn vui lòng liên hệ hotline của trung tâm để được hỗ trợ nhé."
+        return f"Theo thông tin của trung tâm: {' '.join(lines[:2])}"
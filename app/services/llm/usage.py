@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from app.core.config import settings
+
+# Phiên chat và tool của lượt hiện tại, dùng để gắn nhãn số token (kế thừa bởi các task con)
+current_session: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_current_session", default=None)
+current_tool: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_current_tool", default=None)
+# False cho các lượt không thuộc phiên thật (đánh giá hàng loạt): chỉ cộng thống kê, không ghi llm_usage/theo dõi phiên
+persist_usage: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_persist_usage", default=True)
+
+# Số phiên giữ tổng token trong bộ nhớ (LRU) và số bản ghi chờ ghi DB tối đa khi DB lỗi
+MAX_TRACKED_SESSIONS = 10000
+MAX_PENDING_ROWS = 10000
+
+
+def token_usage(response) -> Tuple[int, int]:
+    """(input, output) token từ LLMResult: usage_metadata của message, hoặc llm_output["token_usage"]."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def estimate_cost(input_tokens: int, output_tokens: int) -> float:
+    return (input_tokens * settings.LLM_PRICE_INPUT_PER_1M + output_tokens * settings.LLM_PRICE_OUTPUT_PER_1M) / 1_000_000
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Ghi token/độ trễ của từng lời gọi model trong một lần LLMClient gọi runnable (kể cả chain lồng nhau)."""
+    run_inline = True
+
+    def __init__(self, tracker: "LLMUsageTracker", call_type: str):
+        self.tracker = tracker
+        self.call_type = call_type
+        self.session_id = current_session.get()
+        self.tool = current_tool.get()
+        self.persist = persist_usage.get()
+        self._runs: Dict[Any, Tuple[float, str]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or params.get("_type") or settings.MODEL_NAME
+        self._runs[run_id] = (time.perf_counter(), str(model))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, model = self._runs.pop(run_id, (None, settings.MODEL_NAME))
+        latency_ms = (time.perf_counter() - started) * 1000 if started else 0.0
+        input_tokens, output_tokens = token_usage(response)
+        self.tracker.record(self.session_id, self.call_type, self.tool, model, input_tokens, output_tokens, latency_ms, persist=self.persist)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+class LLMUsageTracker:
+    """
+    Thống kê token/chi phí LLM: cộng dồn trong bộ nhớ theo (vị trí gọi, tool, model) và theo phiên,
+    ghi từng lời gọi xuống bảng llm_usage theo lô (định kỳ hoặc khi đủ `flush_batch` bản ghi).
+    """
+
+    def __init__(self, flush_batch: int, session_budget: int):
+        self.flush_batch = flush_batch
+        self.session_budget = session_budget
+        self.by_site: Dict[Tuple[str, Optional[str], str], Dict[str, float]] = {}
+        self._session_tokens: "OrderedDict[str, int]" = OrderedDict()
+        self._pending: List[Dict[str, Any]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"calls": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0, "flushed": 0, "flush_errors": 0, "economy_turns": 0}
+
+    def callback(self, call_type: str) -> UsageCallback:
+        return UsageCallback(self, call_type)
+
+    def record(self, session_id: Optional[str], call_type: str, tool: Optional[str], model: str,
+               input_tokens: int, output_tokens: int, latency_ms: float, persist: bool = True):
+        cost = estimate_cost(input_tokens, output_tokens)
+        site = self.by_site.setdefault((call_type, tool, model), {"calls": 0, "input_tokens": 0, "output_tokens": 0, "latency_ms": 0.0, "cost_usd": 0.0})
+        site["calls"] += 1
+        site["input_tokens"] += input_tokens
+        site["output_tokens"] += output_tokens
+        site["latency_ms"] += latency_ms
+        site["cost_usd"] += cost
+        self.stats["calls"] += 1
+        self.stats["input_tokens"] += input_tokens
+        self.stats["output_tokens"] += output_tokens
+        self.stats["cost_usd"] += cost
+        if not persist:
+            return
+
+        if session_id:
+            self._session_tokens[session_id] = self._session_tokens.get(session_id, 0) + input_tokens + output_tokens
+            self._session_tokens.move_to_end(session_id)
+            while len(self._session_tokens) > MAX_TRACKED_SESSIONS:
+                self._session_tokens.popitem(last=False)
+
+        self._pending.append({
+            "session_id": session_id, "call_type": call_type, "tool": tool, "model": model,
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "latency_ms": round(latency_ms, 1), "cost_usd": cost,
+        })
+        if len(self._pending) >= self.flush_batch and (self._flush_task is None or self._flush_task.done()):
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+            except RuntimeError:
+                pass  # Không có event loop (gọi sync): để lần flush định kỳ ghi
+
+    async def flush(self) -> int:
+        """Ghi các bản ghi đang chờ xuống DB trong một lệnh INSERT nhiều dòng."""
+        if not self._pending:
+            return 0
+        from sqlalchemy import insert
+        from app.core.database import AsyncSessionLocal
+        from app.models.usage import LLMUsage
+
+        rows, self._pending = self._pending, []
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(LLMUsage), rows)
+                await db.commit()
+        except Exception as e:
+            logging.error(f"Lỗi ghi thống kê token LLM: {e}")
+            self.stats["flush_errors"] += 1
+            # Giữ lại để lần sau ghi tiếp (bỏ bản ghi cũ nhất nếu DB lỗi quá lâu)
+            self._pending = (rows + self._pending)[-MAX_PENDING_ROWS:]
+            return 0
+        self.stats["flushed"] += len(rows)
+        return len(rows)
+
+    async def run_flusher(self, interval: float):
+        """Vòng lặp nền ghi định kỳ."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def session_tokens(self, session_id: str) -> int:
+        if session_id in self._session_tokens:
+            return self._session_tokens[session_id]
+        # Phiên chưa gọi LLM ở worker này: lấy tổng đã ghi trong DB (phiên cũ, hoặc từ worker khác)
+        from sqlalchemy import select, func
+        from app.core.database import AsyncSessionLocal
+        from app.models.usage import LLMUsage
+        try:
+            async with AsyncSessionLocal() as db:
+                stmt = select(func.coalesce(func.sum(LLMUsage.input_tokens + LLMUsage.output_tokens), 0)).where(LLMUsage.session_id == session_id)
+                total = int((await db.execute(stmt)).scalar() or 0)
+        except Exception as e:
+            logging.error(f"Lỗi đọc thống kê token của phiên: {e}")
+            return 0
+        self._session_tokens[session_id] = total
+        return total
+
+    async def over_budget(self, session_id: Optional[str]) -> bool:
+        """Phiên đã dùng hết ngân sách token (LLM_SESSION_TOKEN_BUDGET) -> chuyển sang đường xử lý rẻ hơn."""
+        if self.session_budget <= 0 or not session_id or not persist_usage.get():
+            return False
+        if await self.session_tokens(session_id) < self.session_budget:
+            return False
+        self.stats["economy_turns"] += 1
+        return True
+
+    async def session_report(self, session_id: str) -> Dict[str, Any]:
+        """Thống kê một phiên từ DB (ghi các bản ghi đang chờ trước)."""
+        from sqlalchemy import select, func
+        from app.core.database import AsyncSessionLocal
+        from app.models.usage import LLMUsage
+
+        await self.flush()
+        async with AsyncSessionLocal() as db:
+            stmt = select(
+                LLMUsage.call_type, LLMUsage.tool, LLMUsage.model, func.count(),
+                func.sum(LLMUsage.input_tokens), func.sum(LLMUsage.output_tokens),
+                func.avg(LLMUsage.latency_ms), func.sum(LLMUsage.cost_usd),
+            ).where(LLMUsage.session_id == session_id).group_by(LLMUsage.call_type, LLMUsage.tool, LLMUsage.model)
+            rows = (await db.execute(stmt)).all()
+
+        sites = [{
+            "call_type": call_type, "tool": tool, "model": model, "calls": calls,
+            "input_tokens": int(inp or 0), "output_tokens": int(out or 0),
+            "avg_latency_ms": round(latency or 0.0, 1), "cost_usd": round(cost or 0.0, 6),
+        } for call_type, tool, model, calls, inp, out, latency, cost in rows]
+        total_tokens = sum(s["input_tokens"] + s["output_tokens"] for s in sites)
+        return {
+            "session_id": session_id,
+            "total_tokens": total_tokens,
+            "cost_usd": round(sum(s["cost_usd"] for s in sites), 6),
+            "budget": self.session_budget or None,
+            "over_budget": bool(self.session_budget) and total_tokens >= self.session_budget,
+            "by_site": sorted(sites, key=lambda s: s["input_tokens"] + s["output_tokens"], reverse=True),
+        }
+
+    def snapshot(self, top_sessions: int = 10) -> Dict[str, Any]:
+        sites = [{
+            "call_type": call_type, "tool": tool, "model": model,
+            "calls": s["calls"], "input_tokens": s["input_tokens"], "output_tokens": s["output_tokens"],
+            "avg_input_tokens": round(s["input_tokens"] / s["calls"], 1),
+            "avg_latency_ms": round(s["latency_ms"] / s["calls"], 1),
+            "cost_usd": round(s["cost_usd"], 6),
+        } for (call_type, tool, model), s in self.by_site.items()]
+        top = sorted(self._session_tokens.items(), key=lambda item: item[1], reverse=True)[:top_sessions]
+        return {
+            **self.stats,
+            "cost_usd": round(self.stats["cost_usd"], 6),
+            "pending": len(self._pending),
+            "session_budget": self.session_budget or None,
+            "by_site": sorted(sites, key=lambda s: s["input_tokens"] + s["output_tokens"], reverse=True),
+            "top_sessions": [{"session_id": sid, "tokens": tokens} for sid, tokens in top],
+        }
+
+
+llm_usage = LLMUsageTracker(
+    flush_batch=settings.LLM_USAGE_FLUSH_BATCH,
+    session_budget=settings.LLM_SESSION_TOKEN_BUDGET,
+)
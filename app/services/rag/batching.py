@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+
+# Các batcher đang hoạt động trong tiến trình (để xuất metrics)
+batchers: Dict[str, "MicroBatcher"] = {}
+
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu suy luận đồng thời (từ nhiều request/luồng) thành một batch.
+    Một luồng riêng flush batch khi đủ `max_batch_size` hoặc hết hạn `max_wait_ms`,
+    gọi `batch_fn(items)` một lần rồi trả kết quả riêng cho từng request qua Future.
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: "queue.Queue[Tuple[Any, Future]]" = None
+        self.stats = {"submitted": 0, "batches": 0, "items": 0, "max_batch_size": 0, "last_batch_size": 0}
+        batchers[name] = self
+
+    def _ensure_worker(self):
+        # Luồng không tồn tại qua fork -> mỗi tiến trình (worker) tự khởi động luồng của mình
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._worker, name=f"batcher-{self.name}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, item: Any) -> Future:
+        self._ensure_worker()
+        future: Future = Future()
+        self.stats["submitted"] += 1
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item: Any) -> Any:
+        """Gửi một yêu cầu và chờ kết quả (blocking)."""
+        return self.submit(item).result()
+
+    def _collect(self) -> List[Tuple[Any, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            self.stats["batches"] += 1
+            self.stats["items"] += len(items)
+            self.stats["last_batch_size"] = len(items)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(items))
+            try:
+                results = list(self.batch_fn(items))
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn trả về {len(results)} kết quả cho {len(batch)} yêu cầu")
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"Lỗi batch suy luận '{self.name}': {e}")
+                # Mọi Future chưa có kết quả đều phải được giải phóng, nếu không `run()` sẽ chờ mãi
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def snapshot(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "avg_batch_size": round(self.stats["items"] / batches, 2) if batches else 0.0,
+        }
+
+
+class BatchedEmbeddings(Embeddings):
+    """Bọc mô hình embeddings: các `embed_query` đồng thời được gom thành một lần `embed_documents`."""
+
+    def __init__(self, embeddings: Embeddings, max_batch_size: int = settings.INFERENCE_MAX_BATCH, max_wait_ms: float = settings.INFERENCE_MAX_WAIT_MS):
+        self.embeddings = embeddings
+        self.batcher = MicroBatcher("embed_query", embeddings.embed_documents, max_batch_size, max_wait_ms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Lúc dựng chỉ mục: đã là batch lớn, gọi thẳng mô hình
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.run(text)
+
+
+def _supports_pairwise(ranker) -> bool:
+    """
+    Ranker pairwise (ONNX) của FlashRank: có `tokenizer` (tokenizers.Tokenizer) và `session` (onnxruntime).
+    Đây là thuộc tính nội bộ của FlashRank (requirements ghim phiên bản); thiếu thì dùng API công khai `rerank`.
+    """
+    if getattr(ranker, "llm_model", None) is not None:
+        return False
+    return hasattr(getattr(ranker, "tokenizer", None), "encode_batch") and hasattr(getattr(ranker, "session", None), "run")
+
+
+def _rerank_each(ranker, items: List[Tuple[str, List[str]]]) -> List[List[float]]:
+    """Chấm từng request qua API công khai `ranker.rerank` (không gom cặp giữa các request)."""
+    from flashrank import RerankRequest
+    results = []
+    for query, texts in items:
+        ranked = ranker.rerank(RerankRequest(query=query, passages=[{"id": str(i), "text": t} for i, t in enumerate(texts)]))
+        scores = [0.0] * len(texts)
+        for position, res in enumerate(ranked):
+            scores[int(res["id"])] = float(res.get("score", len(texts) - position))
+        results.append(scores)
+    return results
+
+
+def _score_pairs(ranker, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+    """Chấm điểm các cặp (query, passage) trong một lần chạy ONNX (giống nhánh pairwise của FlashRank)."""
+    encoded = ranker.tokenizer.encode_batch([list(pair) for pair in pairs])
+    input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+    token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+    attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+
+    onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if not np.all(token_type_ids == 0):
+        onnx_input["token_type_ids"] = token_type_ids
+
+    logits = ranker.session.run(None, onnx_input)[0]
+    if logits.shape[1] == 1:
+        scores = 1 / (1 + np.exp(-logits.flatten()))
+    else:
+        exp_logits = np.exp(logits)
+        scores = exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+    return scores.tolist()
+
+
+def make_rerank_batcher(ranker, max_batch_size: int = settings.INFERENCE_MAX_BATCH, max_wait_ms: float = settings.INFERENCE_MAX_WAIT_MS) -> MicroBatcher:
+    """
+    Batcher cho Cross-Encoder: mỗi item là (query, [passage_text...]), kết quả là danh sách điểm tương ứng.
+    Các cặp từ nhiều request khác nhau được chấm trong cùng một lần chạy mô hình.
+    Mô hình listwise (LLM) hoặc phiên bản FlashRank không có các thuộc tính nội bộ cần thiết: chấm từng request
+    qua `ranker.rerank`.
+    """
+    pairwise = {"enabled": _supports_pairwise(ranker)}
+
+    def batch_fn(items: List[Tuple[str, List[str]]]) -> List[List[float]]:
+        if not pairwise["enabled"]:
+            return _rerank_each(ranker, items)
+
+        pairs = [(query, text) for query, texts in items for text in texts]
+        try:
+            flat_scores = _score_pairs(ranker, pairs) if pairs else []
+        except Exception as e:
+            # Nội bộ FlashRank thay đổi: chuyển hẳn sang API công khai
+            logging.warning(f"Không chấm điểm theo cặp được ({e!r}), chuyển sang ranker.rerank từng request")
+            pairwise["enabled"] = False
+            return _rerank_each(ranker, items)
+        results, offset = [], 0
+        for _, texts in items:
+            results.append(flat_scores[offset:offset + len(texts)])
+            offset += len(texts)
+        return results
+
+    return MicroBatcher("rerank", batch_fn, max_batch_size, max_wait_ms)
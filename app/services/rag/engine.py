@@ -1,91 +1,417 @@
 import logging
-from langchain_community.document_loaders import TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
 from app.core.config import settings
+from app.core.tracing import span, traced
+from app.services.llm.factory import create_chat_model
+from app.services.llm.client import llm_client, LLMUnavailable
+from app.services.rag.faq import load_faq_documents, diff_faq, FAQMatcher
+from app.services.rag.vector_index import build_vector_store, export_embeddings, index_directory, prune_index_directories, CachedEmbeddings, NumpyVectorStore
+from app.services.rag.sparse import build_sparse_retriever
+from app.services.rag.batching import BatchedEmbeddings, make_rerank_batcher
+
+# Số câu trả lời LLM gần nhất được giữ lại để dự phòng khi LLM sự cố
+ANSWER_CACHE_SIZE = 512
+# Sau khi hoán đổi chỉ mục: chờ tối đa bấy nhiêu giây cho request còn dùng phiên bản cũ trước khi giải phóng nó
+RETIRE_TIMEOUT = 300
+RETIRE_POLL_INTERVAL = 0.5
+# Các collection có thư mục chỉ mục trong INDEX_DIR
+INDEX_COLLECTIONS = ("knowledge_base", "faq_questions")
+
+class RAGIndex:
+    """
+    Một phiên bản chỉ mục RAG hoàn chỉnh (vector store, FAQ, retriever, chuỗi QA).
+    Không sửa đổi sau khi tạo: reload dựng bản mới rồi hoán đổi tham chiếu.
+    """
+    def __init__(self, version: int, documents: list, vector_store, faq_matcher, retriever, qa_chain, build_seconds: float,
+                 directories: tuple = ()):
+        self.version = version
+        self.documents = documents
+        self.vector_store = vector_store
+        self.faq_matcher = faq_matcher
+        self.retriever = retriever
+        self.qa_chain = qa_chain
+        self.build_seconds = build_seconds
+        self.built_at = time.time()
+        # Thư mục chỉ mục trên đĩa của phiên bản này và số request đang dùng nó (xem `use`)
+        self.directories = directories
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def use(self):
+        """Đánh dấu phiên bản đang được một request dùng: tài nguyên của nó chỉ được giải phóng khi không còn ai dùng."""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.in_flight -= 1
 
 class RAGService:
     def __init__(self):
-        self.qa_chain = None
-        self.vector_store = None
-        self.ready = False
+        self.index: Optional[RAGIndex] = None
+        self.embeddings = None
+        self.llm = None
+        self.reranker = None
+        self.rerank_batcher = None
+        self.stats = {"faq_direct": 0, "generated": 0, "fallback": 0, "economy": 0}
+        # Câu trả lời đã sinh gần đây, theo (phiên bản chỉ mục, câu hỏi): dùng khi LLM không khả dụng
+        self._answer_cache: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+        self.last_reload = None
+        self._kb_signature = None
+        self._reload_lock = None
+        self._retiring = set()
+        # True trong worker được fork từ master đã preload (gunicorn): chỉ mục dùng chung copy-on-write
+        self.preloaded = False
+
+    # Truy cập nhanh vào phiên bản chỉ mục hiện tại
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    @property
+    def qa_chain(self):
+        return self.index.qa_chain if self.index else None
+
+    @property
+    def vector_store(self):
+        return self.index.vector_store if self.index else None
+
+    @property
+    def retriever(self):
+        return self.index.retriever if self.index else None
+
+    @property
+    def faq_matcher(self):
+        return self.index.faq_matcher if self.index else None
+
+    def _load_models(self):
+        """Tải các mô hình dùng chung giữa các phiên bản chỉ mục (embeddings, LLM, reranker)."""
+        # Khởi tạo Embeddings (import nặng: sentence_transformers/torch, chỉ tải khi warm-up)
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+        if settings.INFERENCE_BATCHING:
+            # Gom embed câu hỏi của các request đồng thời thành một batch
+            embeddings = BatchedEmbeddings(embeddings)
+        # Cache theo nội dung: khi reload chỉ embed các cặp Q/A đã thay đổi
+        self.embeddings = CachedEmbeddings(embeddings)
+
+        # Khởi tạo LLM
+        self.llm = create_chat_model(temperature=0.3)
+
+        # Khởi tạo Reranker (tải mô hình một lần)
+        from app.services.rag.retrievers import create_reranker
+        self.reranker = create_reranker()
+        self.rerank_batcher = make_rerank_batcher(self.reranker) if settings.INFERENCE_BATCHING else None
 
     async def initialize(self):
         """Khởi tạo pipeline RAG."""
+        if self.ready:
+            # Đã được nạp sẵn ở tiến trình master (preload) trước khi fork
+            return
         try:
             logging.info("Đang khởi tạo hệ thống RAG...")
-            
-            # 1. Tải Dữ liệu từ Knowledge Base
-            loader = TextLoader(settings.KNOWLEDGE_BASE_PATH, encoding="utf-8")
-            documents = loader.load()
-
-            # 2. Chia nhỏ văn bản (Text Splitting)
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            chunks = text_splitter.split_documents(documents)
-
-            # 3. Khởi tạo Embeddings
-            embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
-
-            # 4. Tạo Vector Store
-            self.vector_store = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
-                collection_name="knowledge_base"
-            )
-
-            # 5. Khởi tạo LLM
-            llm = ChatGoogleGenerativeAI(model=settings.MODEL_NAME, google_api_key=settings.GOOGLE_API_KEY, temperature=0.3)
-
-            # 6. Tạo Hybrid Retriever (Giai đoạn 2: Nâng cấp tìm kiếm)
-            from app.services.rag.retrievers import HybridRetriever
-            logging.info("Đang khởi tạo Hybrid Retriever (BM25 + Vector + Rerank)...")
-            retriever = HybridRetriever.from_documents(
-                documents=chunks, 
-                vector_store=self.vector_store, 
-                k=5 # Lấy 5 ứng viên mỗi bên -> Rerank lấy top 3
-            )
-
-            # 7. Tạo chuỗi QA với Prompt tùy chỉnh
-            from langchain_core.prompts import PromptTemplate
-
-            template = """Bạn là trợ lý ảo AI thân thiện của Trung tâm Thăng Long.
-            Đối tượng hỏi là học sinh (học viên).
-            Hãy xưng hô là 'Tôi' và gọi người dùng là 'Bạn'.
-            Nếu câu hỏi nằm ngoài tài liệu, hãy trả lời khéo léo và hướng dẫn các em liên hệ hotline.
-
-            Sử dụng các thông tin sau đây để trả lời câu hỏi. Nếu không biết câu trả lời, hãy nói là bạn không biết, đừng cố bịa ra câu trả lời.
-
-            {context}
-
-            Câu hỏi: {question}
-            Trả lời:"""
-            
-            QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
-
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=False,
-                chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-            )
-            self.ready = True
+            # Tải mô hình và dựng chỉ mục trong luồng riêng để event loop vẫn phục vụ request (vd. /healthz)
+            await asyncio.to_thread(self._load_models)
+            self._kb_signature = self._kb_file_signature()
+            self.index = await asyncio.to_thread(self._build_index, 1)
+            # Chỉ mục của Knowledge Base cũ (đổi khi ứng dụng đang tắt) không còn dùng tới
+            await asyncio.to_thread(prune_index_directories, INDEX_COLLECTIONS, self.index.directories)
             logging.info("Hệ thống RAG đã sẵn sàng hoạt động (Advanced Hybrid Mode).")
         except Exception as e:
             logging.error(f"Lỗi khởi động RAG: {e}")
-            self.ready = False
             # Không raise exception để app vẫn khởi động được dù RAG lỗi
             # raise e
 
+    def _load_documents(self) -> list:
+        # Mỗi cặp Q/A là một chunk (không cắt ngang câu trả lời)
+        chunks = load_faq_documents(settings.KNOWLEDGE_BASE_PATH)
+        if not chunks:
+            # Fallback: tài liệu không theo định dạng Q/A -> chia nhỏ văn bản thông thường
+            from langchain_community.document_loaders import TextLoader
+            from langchain_text_splitters import RecursiveCharacterTextSplitter
+            loader = TextLoader(settings.KNOWLEDGE_BASE_PATH, encoding="utf-8")
+            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+            chunks = text_splitter.split_documents(loader.load())
+        return chunks
+
+    def _build_index(self, version: int) -> RAGIndex:
+        """Dựng một phiên bản chỉ mục đầy đủ (chạy trong luồng riêng, không chặn event loop)."""
+        started = time.perf_counter()
+
+        # 1-2. Tải Knowledge Base
+        chunks = self._load_documents()
+
+        # 4. Tạo Vector Store (backend theo cấu hình VECTOR_BACKEND: numpy | chroma)
+        vector_store = build_vector_store(chunks, self.embeddings, collection_name="knowledge_base", generation=version)
+
+        # Chỉ mục riêng cho câu hỏi FAQ (trả lời trực tiếp khi khớp cao)
+        faq_matcher = FAQMatcher.from_documents(chunks, self.embeddings, threshold=settings.FAQ_DIRECT_ANSWER_THRESHOLD, generation=version)
+
+        # 6. Tạo Hybrid Retriever
+        from app.services.rag.retrievers import HybridRetriever
+        logging.info("Đang khởi tạo Hybrid Retriever (Sparse + Vector + Rerank)...")
+        # Chỉ mục ngược (sparse) được lưu cạnh chỉ mục vector, không dựng lại mỗi lần khởi động
+        directory = index_directory("knowledge_base", chunks)
+        sparse_retriever = build_sparse_retriever(chunks, directory, k=settings.RETRIEVER_K)
+        retriever = HybridRetriever.from_documents(
+            documents=chunks,
+            vector_store=vector_store,
+            k=settings.RETRIEVER_K, # Lấy k ứng viên mỗi bên -> Fusion + Rerank lấy top_n
+            sparse_retriever=sparse_retriever,
+            reranker=self.reranker,
+            rerank_batcher=self.rerank_batcher
+        )
+
+        # 7. Tạo chuỗi QA với Prompt tùy chỉnh
+        qa_chain = self._build_qa_chain(retriever)
+        directories = (directory, getattr(faq_matcher.question_store, "directory", None))
+        return RAGIndex(version, chunks, vector_store, faq_matcher, retriever, qa_chain, time.perf_counter() - started, directories)
+
+    def _build_qa_chain(self, retriever):
+        from langchain_core.prompts import PromptTemplate
+        from langchain.chains import RetrievalQA
+
+        template = """Bạn là trợ lý ảo AI thân thiện của Trung tâm Thăng Long.
+        Đối tượng hỏi là học sinh (học viên).
+        Hãy xưng hô là 'Tôi' và gọi người dùng là 'Bạn'.
+        Nếu câu hỏi nằm ngoài tài liệu, hãy trả lời khéo léo và hướng dẫn các em liên hệ hotline.
+
+        Sử dụng các thông tin sau đây để trả lời câu hỏi. Nếu không biết câu trả lời, hãy nói là bạn không biết, đừng cố bịa ra câu trả lời.
+
+        {context}
+
+        Câu hỏi: {question}
+        Trả lời:"""
+
+        QA_CHAIN_PROMPT = PromptTemplate.from_template(template)
+
+        return RetrievalQA.from_chain_type(
+            llm=self.llm,
+            chain_type="stuff",
+            retriever=retriever,
+            return_source_documents=False,
+            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
+        )
+
+    def after_fork(self):
+        """
+        Gọi trong worker ngay sau khi fork (chế độ preload). Mô hình và chỉ mục (chỉ đọc) dùng chung
+        copy-on-write với master; client LLM (kết nối mạng) và khóa asyncio phải tạo riêng cho từng worker.
+        """
+        if not self.index:
+            return
+        self.preloaded = True
+        self.llm = create_chat_model(temperature=0.3)
+        # Chưa phục vụ request nào nên gắn lại chuỗi QA cho phiên bản chỉ mục hiện tại là an toàn
+        self.index.qa_chain = self._build_qa_chain(self.index.retriever)
+        self._reload_lock = None
+
+    def _kb_file_signature(self):
+        try:
+            stat = os.stat(settings.KNOWLEDGE_BASE_PATH)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    async def reload(self, force: bool = False) -> dict:
+        """
+        Dựng lại chỉ mục từ Knowledge Base ở nền rồi hoán đổi nguyên tử.
+        Request đang xử lý vẫn dùng phiên bản cũ cho tới khi kết thúc.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+
+        async with self._reload_lock:
+            signature = self._kb_file_signature()
+            if not force and signature == self._kb_signature:
+                return {"reloaded": False, **self.status()}
+            if not self.embeddings:
+                await self.initialize()
+                return {"reloaded": self.ready, **self.status()}
+
+            old = self.index
+            # Nạp sẵn embeddings của phiên bản hiện tại (numpy hoặc Chroma) -> chỉ embed các cặp Q/A mới/đã đổi
+            if old:
+                for store in (old.vector_store, old.faq_matcher.question_store):
+                    exported = export_embeddings(store)
+                    if exported is None:
+                        logging.warning(f"Không lấy được embeddings từ {type(store).__name__}: nạp lại sẽ embed toàn bộ tài liệu")
+                        continue
+                    self.embeddings.seed(*exported)
+
+            embedded_before = self.embeddings.stats["embedded"]
+            try:
+                new_index = await asyncio.to_thread(self._build_index, (old.version + 1) if old else 1)
+            finally:
+                self.embeddings.clear()
+
+            # Hoán đổi tham chiếu (nguyên tử với event loop)
+            self.index = new_index
+            if old:
+                task = asyncio.create_task(self._retire(old, new_index))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+            self._kb_signature = signature
+            self.last_reload = {
+                "version": new_index.version,
+                "duration_seconds": round(new_index.build_seconds, 3),
+                "embedded_chunks": self.embeddings.stats["embedded"] - embedded_before,
+                "diff": diff_faq(old.documents, new_index.documents) if old else None,
+                "finished_at": new_index.built_at,
+            }
+            logging.info(f"Đã nạp lại Knowledge Base: {self.last_reload}")
+            return {"reloaded": True, **self.status()}
+
+    async def _retire(self, old: RAGIndex, new: RAGIndex):
+        """
+        Giải phóng phiên bản chỉ mục cũ sau khi các request đang dùng nó kết thúc:
+        xóa collection Chroma của nó và các thư mục chỉ mục trong INDEX_DIR không thuộc phiên bản mới.
+        """
+        deadline = time.monotonic() + RETIRE_TIMEOUT
+        while old.in_flight and time.monotonic() < deadline:
+            await asyncio.sleep(RETIRE_POLL_INTERVAL)
+        if old.in_flight:
+            logging.warning(f"Chỉ mục v{old.version} vẫn còn {old.in_flight} request sau {RETIRE_TIMEOUT}s, giải phóng luôn")
+
+        def release():
+            for store in (old.vector_store, old.faq_matcher.question_store if old.faq_matcher else None):
+                # NumpyVectorStore chỉ nằm trong bộ nhớ của phiên bản cũ: GC tự thu hồi
+                if store is None or isinstance(store, NumpyVectorStore) or not hasattr(store, "delete_collection"):
+                    continue
+                try:
+                    store.delete_collection()
+                except Exception as e:
+                    logging.warning(f"Không xóa được collection của chỉ mục v{old.version}: {e}")
+            return prune_index_directories(INDEX_COLLECTIONS, new.directories)
+
+        removed = await asyncio.to_thread(release)
+        logging.info(f"Đã giải phóng chỉ mục v{old.version} (xóa {len(removed)} thư mục chỉ mục cũ)")
+
+    async def watch_knowledge_base(self, interval: float):
+        """Theo dõi thay đổi file Knowledge Base và tự động nạp lại."""
+        while True:
+            await asyncio.sleep(interval)
+            if self._kb_file_signature() == self._kb_signature:
+                continue
+            try:
+                await self.reload()
+            except Exception as e:
+                logging.error(f"Lỗi nạp lại Knowledge Base: {e}")
+
+    def status(self) -> dict:
+        index = self.index
+        return {
+            "ready": index is not None,
+            "index_version": index.version if index else None,
+            "documents": len(index.documents) if index else 0,
+            "build_seconds": round(index.build_seconds, 3) if index else None,
+            "built_at": index.built_at if index else None,
+            "reloading": bool(self._reload_lock and self._reload_lock.locked()),
+            "last_reload": self.last_reload,
+        }
+
+    def match_faq(self, question: str, index: RAGIndex = None):
+        """Khớp với câu hỏi FAQ có sẵn. Trả về câu trả lời hoặc None."""
+        index = index or self.index
+        if not index or not index.faq_matcher:
+            return None
+        try:
+            with index.use():
+                match = index.faq_matcher.match(question)
+        except Exception as e:
+            logging.error(f"Lỗi khớp FAQ: {e}")
+            return None
+        if match:
+            self.stats["faq_direct"] += 1
+            return match[0]
+        return None
+
     def get_answer(self, question: str) -> str:
         """Trả lời câu hỏi."""
-        if not self.ready or not self.qa_chain:
+        index = self.index
+        if not index:
+            return "Hệ thống tra cứu tài liệu chưa sẵn sàng. Vui lòng liên hệ hotline để được hỗ trợ."
+
+        with index.use():
+            direct_answer = self.match_faq(question, index)
+            if direct_answer:
+                return direct_answer
+
+            self.stats["generated"] += 1
+            response = index.qa_chain.invoke({"query": question})
+            return response["result"]
+
+    @traced("rag.retrieval")
+    async def aretrieve(self, query: str) -> list:
+        """Chỉ chạy bước truy xuất (Hybrid + Rerank), không gọi LLM."""
+        index = self.index
+        if not index:
+            return []
+        # Sparse và dense chạy song song trên luồng riêng, không chặn event loop
+        with index.use():
+            return await index.retriever.ainvoke(query)
+
+    async def aget_answer(self, question: str, docs: list = None, economy: bool = False) -> str:
+        """
+        Phiên bản async của get_answer. Có thể truyền sẵn tài liệu đã truy xuất (ví dụ từ speculative execution).
+        `economy=True` (phiên vượt ngân sách token): không gọi LLM, trả câu trả lời FAQ/đã cache của tài liệu liên quan nhất.
+        """
+        # Giữ tham chiếu tới phiên bản chỉ mục hiện tại trong suốt request (an toàn khi reload)
+        index = self.index
+        if not index:
             return "Hệ thống tra cứu tài liệu chưa sẵn sàng. Vui lòng liên hệ hotline để được hỗ trợ."
-        
-        response = self.qa_chain.invoke({"query": question})
-        return response["result"]
+        # Không có await giữa lúc lấy tham chiếu và lúc đánh dấu: phiên bản cũ không bị giải phóng giữa chừng
+        with index.use():
+            return await self._answer(index, question, docs, economy)
+
+    async def _answer(self, index: RAGIndex, question: str, docs: list, economy: bool) -> str:
+        with span("rag.faq"):
+            direct_answer = await asyncio.to_thread(self.match_faq, question, index)
+        if direct_answer:
+            return direct_answer
+
+        if docs is None:
+            with span("rag.retrieval"):
+                docs = await index.retriever.ainvoke(question)
+        cache_key = (index.version, " ".join(question.lower().split()))
+        if economy:
+            self.stats["economy"] += 1
+            return self._cheap_answer(cache_key, docs)
+        self.stats["generated"] += 1
+        try:
+            response = await llm_client.ainvoke(index.qa_chain.combine_documents_chain, {"input_documents": docs, "question": question}, call_type="rag_answer")
+        except LLMUnavailable as e:
+            logging.warning(f"LLM không khả dụng, dùng câu trả lời dự phòng: {e}")
+            return self._fallback_answer(cache_key, docs)
+
+        answer = response["output_text"]
+        self._answer_cache[cache_key] = answer
+        self._answer_cache.move_to_end(cache_key)
+        while len(self._answer_cache) > ANSWER_CACHE_SIZE:
+            self._answer_cache.popitem(last=False)
+        return answer
+
+    def _fallback_answer(self, cache_key, docs: list) -> str:
+        """Thất bại nhanh khi LLM không khả dụng."""
+        self.stats["fallback"] += 1
+        return self._cheap_answer(cache_key, docs)
+
+    def _cheap_answer(self, cache_key, docs: list) -> str:
+        """Câu trả lời không cần LLM: câu trả lời đã cache, hoặc câu trả lời FAQ của tài liệu liên quan nhất."""
+        cached = self._answer_cache.get(cache_key)
+        if cached:
+            return cached
+        for doc in docs or []:
+            if doc.metadata.get("answer"):
+                return doc.metadata["answer"]
+        return "Hệ thống đang bận, bạn vui lòng thử lại sau hoặc liên hệ hotline để được hỗ trợ."
 
 rag_service = RAGService()
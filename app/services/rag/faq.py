@@ -0,0 +1,97 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+
+def parse_faq(text: str) -> List[Tuple[str, str]]:
+    """Tách nội dung Knowledge Base dạng `Q:`/`A:` thành danh sách cặp (câu hỏi, câu trả lời)."""
+    pairs = []
+    question, answer_lines, field = None, [], None
+
+    def flush():
+        if question and answer_lines:
+            pairs.append((question, "\n".join(answer_lines).strip()))
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if line.startswith("Q:"):
+            flush()
+            question, answer_lines, field = line[2:].strip(), [], "Q"
+        elif line.startswith("A:") and question:
+            answer_lines, field = [line[2:].strip()], "A"
+        elif not line or line == "---":
+            continue
+        elif field == "A":
+            # Dòng tiếp theo của câu trả lời (danh sách, liệt kê...)
+            answer_lines.append(line)
+        elif field == "Q":
+            question = f"{question} {line}"
+    flush()
+    return pairs
+
+
+def diff_faq(old_documents: List[Document], new_documents: List[Document]) -> Dict[str, int]:
+    """So sánh hai phiên bản Knowledge Base theo từng câu hỏi."""
+    old = {d.metadata.get("question") or d.page_content: d.page_content for d in old_documents}
+    new = {d.metadata.get("question") or d.page_content: d.page_content for d in new_documents}
+    return {
+        "added": len(new.keys() - old.keys()),
+        "removed": len(old.keys() - new.keys()),
+        "changed": sum(1 for q in new.keys() & old.keys() if new[q] != old[q]),
+        "unchanged": sum(1 for q in new.keys() & old.keys() if new[q] == old[q]),
+    }
+
+
+def load_faq_documents(path: str) -> List[Document]:
+    """Mỗi cặp Q/A thành một Document; câu hỏi được lưu trong metadata."""
+    with open(path, encoding="utf-8") as f:
+        pairs = parse_faq(f.read())
+
+    return [
+        Document(
+            page_content=f"Q: {question}\nA: {answer}",
+            metadata={"source": path, "chunk_id": f"faq-{i}", "question": question, "answer": answer},
+        )
+        for i, (question, answer) in enumerate(pairs)
+    ]
+
+
+class FAQMatcher:
+    """
+    Khớp câu hỏi của người dùng với các câu hỏi có sẵn (chỉ mục riêng chỉ chứa câu hỏi).
+    Nếu độ tương đồng vượt ngưỡng, trả thẳng câu trả lời có sẵn mà không cần gọi LLM.
+    """
+
+    def __init__(self, question_store: VectorStore, threshold: float):
+        self.question_store = question_store
+        self.threshold = threshold
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], embeddings, threshold: float, generation: int = 1):
+        from app.services.rag.vector_index import build_vector_store
+
+        question_docs = [
+            Document(page_content=doc.metadata["question"], metadata={"chunk_id": doc.metadata["chunk_id"], "answer": doc.metadata["answer"]})
+            for doc in documents if doc.metadata.get("question")
+        ]
+        question_store = build_vector_store(
+            question_docs,
+            embeddings,
+            collection_name="faq_questions",
+            chroma_kwargs={"collection_metadata": {"hnsw:space": "cosine"}},
+            generation=generation,
+        )
+        return cls(question_store, threshold)
+
+    def match(self, query: str) -> Optional[Tuple[str, float]]:
+        """Trả về (câu trả lời, điểm tương đồng) nếu khớp trên ngưỡng, ngược lại None."""
+        results = self.question_store.similarity_search_with_relevance_scores(query, k=1)
+        if not results:
+            return None
+        doc, score = results[0]
+        if score < self.threshold:
+            return None
+        logging.info(f"FAQ direct answer: '{doc.page_content}' (score={score:.3f})")
+        return doc.metadata["answer"], score
@@ -1,76 +1,186 @@
-from typing import List
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
 from langchain_core.documents import Document
-from langchain.retrievers import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
 from langchain_core.vectorstores import VectorStore
-from flashrank import Ranker, RerankRequest
+from app.core.config import settings
+from app.core.tracing import traced
+from app.services.rag.sparse import InvertedIndexRetriever
+from app.services.rag.batching import MicroBatcher, make_rerank_batcher
+
+# Pool dùng chung để chạy tìm kiếm dense song song với sparse
+_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def create_reranker():
+    # FlashRank (onnxruntime) chỉ được import khi thực sự tạo reranker
+    from flashrank import Ranker
+    return Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="./.cache/flashrank")
+
+
+def doc_key(doc: Document) -> str:
+    """Định danh chunk: ưu tiên chunk_id trong metadata, fallback nội dung."""
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], weights: List[float], k: int = 60) -> List[Tuple[Document, float]]:
+    """Weighted Reciprocal Rank Fusion: score(d) = Σ w_i / (k + rank_i(d))."""
+    scores: Dict[str, float] = {}
+    docs: Dict[str, Document] = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+            docs.setdefault(key, doc)
+    return sorted(((docs[key], score) for key, score in scores.items()), key=lambda item: item[1], reverse=True)
+
+
+class RerankCache:
+    """LRU cache (thread-safe) cho điểm rerank theo (query, chunk_id)."""
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self._data: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[float]:
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Tuple[str, str], value: float):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
 
 class HybridRetriever(BaseRetriever):
     """
-    Hybrid Retriever kết hợp BM25 (Keyword) và Vector Search (Semantic),
-    sau đó Rerank kết quả bằng FlashRank.
+    Hybrid Retriever kết hợp Sparse/BM25 (Keyword, chỉ mục ngược) và Vector Search (Semantic),
+    chạy song song rồi hợp nhất bằng Weighted Reciprocal Rank Fusion, sau đó Rerank bằng FlashRank.
+    Bỏ qua rerank khi kết quả đứng đầu sau fusion đã vượt trội rõ ràng.
     """
     vector_retriever: BaseRetriever
-    bm25_retriever: BaseRetriever
-    ensemble_retriever: EnsembleRetriever
-    reranker: Ranker
+    sparse_retriever: BaseRetriever
+    reranker: Any  # flashrank.Ranker
+    rerank_batcher: Optional[MicroBatcher] = None
+    weights: List[float] = [0.5, 0.5]
+    rrf_k: int = 60
+    top_n: int = 3
+    rerank_skip_margin: float = 0.3
+    rerank_cache: RerankCache = Field(default_factory=RerankCache)
+    stats: Dict[str, int] = Field(default_factory=lambda: {"reranked": 0, "rerank_skipped": 0, "rerank_cache_hits": 0})
 
     class Config:
         arbitrary_types_allowed = True
 
     @classmethod
-    def from_documents(cls, documents: List[Document], vector_store: VectorStore, k: int = 4):
-        # 1. Khởi tạo BM25 (Tìm kiếm theo từ khóa)
-        bm25_retriever = BM25Retriever.from_documents(documents)
-        bm25_retriever.k = k
+    def from_documents(
+        cls,
+        documents: List[Document],
+        vector_store: VectorStore,
+        k: int = 4,
+        sparse_retriever: InvertedIndexRetriever = None,
+        top_n: int = settings.RETRIEVER_TOP_N,
+        rrf_k: int = settings.RRF_K,
+        rerank_skip_margin: float = settings.RERANK_SKIP_MARGIN,
+        reranker: Any = None,
+        rerank_batcher: Optional[MicroBatcher] = None,
+    ):
+        # 1. Khởi tạo Sparse Retriever (Tìm kiếm theo từ khóa, chỉ mục ngược + tách từ tiếng Việt)
+        if sparse_retriever is None:
+            sparse_retriever = InvertedIndexRetriever.from_documents(documents, k=k)
 
         # 2. Khởi tạo Vector Retriever (Tìm kiếm ngữ nghĩa)
         vector_retriever = vector_store.as_retriever(search_kwargs={"k": k})
 
-        # 3. Khởi tạo Ensemble (Trọng số 0.5 - 0.5)
-        ensemble_retriever = EnsembleRetriever(
-            retrievers=[bm25_retriever, vector_retriever],
-            weights=[0.5, 0.5]
-        )
-
-        # 4. Khởi tạo Reranker (Sử dụng mô hình cross-encoder nhẹ)
-        reranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir="./.cache/flashrank")
+        # 3. Khởi tạo Reranker (Sử dụng mô hình cross-encoder nhẹ), có thể dùng chung giữa các phiên bản chỉ mục
+        if reranker is None:
+            reranker = create_reranker()
+            # Gom các lần rerank đồng thời thành một batch (luồng suy luận riêng)
+            rerank_batcher = make_rerank_batcher(reranker) if settings.INFERENCE_BATCHING else None
 
         return cls(
             vector_retriever=vector_retriever,
-            bm25_retriever=bm25_retriever,
-            ensemble_retriever=ensemble_retriever,
-            reranker=reranker
+            sparse_retriever=sparse_retriever,
+            reranker=reranker,
+            rerank_batcher=rerank_batcher,
+            top_n=top_n,
+            rrf_k=rrf_k,
+            rerank_skip_margin=rerank_skip_margin,
+            rerank_cache=RerankCache(settings.RERANK_CACHE_SIZE),
         )
 
-    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
-        # Bước 1: Tìm kiếm lai (BM25 + Vector) -> Lấy khoảng 2*k ứng viên
-        initial_docs = self.ensemble_retriever.invoke(query)
-        
-        if not initial_docs:
+    def _should_skip_rerank(self, fused: List[Tuple[Document, float]]) -> bool:
+        """Kết quả đứng đầu cách biệt rõ (tương đối) so với vị trí thứ hai -> không cần rerank."""
+        if len(fused) < 2:
+            return True
+        best, second = fused[0][1], fused[1][1]
+        return best > 0 and (best - second) / best >= self.rerank_skip_margin
+
+    @traced("rag.rerank")
+    def _rerank(self, query: str, candidates: List[Document]) -> List[Document]:
+        """Rerank bằng Cross-Encoder, chỉ chấm điểm các chunk chưa có trong cache."""
+        scores: Dict[str, float] = {}
+        passages = []
+        for i, doc in enumerate(candidates):
+            cached = self.rerank_cache.get((query, doc_key(doc)))
+            if cached is not None:
+                scores[doc_key(doc)] = cached
+                self.stats["rerank_cache_hits"] += 1
+            else:
+                passages.append({"id": str(i), "text": doc.page_content, "meta": doc.metadata})
+
+        if passages and self.rerank_batcher:
+            batch_scores = self.rerank_batcher.run((query, [p["text"] for p in passages]))
+            for passage, score in zip(passages, batch_scores):
+                key = doc_key(candidates[int(passage["id"])])
+                scores[key] = float(score)
+                self.rerank_cache.set((query, key), scores[key])
+        elif passages:
+            from flashrank import RerankRequest
+            for res in self.reranker.rerank(RerankRequest(query=query, passages=passages)):
+                key = doc_key(candidates[int(res["id"])])
+                scores[key] = float(res["score"])
+                self.rerank_cache.set((query, key), scores[key])
+
+        ranked = sorted(candidates, key=lambda doc: scores[doc_key(doc)], reverse=True)
+        return ranked[:self.top_n]
+
+    def _finalize(self, query: str, sparse_docs: List[Document], dense_docs: List[Document]) -> List[Document]:
+        # Bước 2: Hợp nhất (Weighted RRF)
+        fused = reciprocal_rank_fusion([sparse_docs, dense_docs], self.weights, self.rrf_k)
+        if not fused:
             return []
 
-        # Bước 2: Sắp xếp lại (Rerank) sử dụng Cross-Encoder
-        passages = [
-            {"id": str(i), "text": doc.page_content, "meta": doc.metadata} 
-            for i, doc in enumerate(initial_docs)
-        ]
-        
-        rerank_request = RerankRequest(query=query, passages=passages)
-        results = self.reranker.rerank(rerank_request)
-
-        # Bước 3: Định dạng kết quả đầu ra
-        # Sắp xếp theo điểm số và lấy top k (mặc định 3 hoặc 4)
-        # Giả định lấy top 3 tài liệu tốt nhất
-        final_docs = []
-        for res in results[:3]:
-            # Tái tạo đối tượng Document
-            original_doc = initial_docs[int(res["id"])]
-            final_docs.append(Document(
-                page_content=res["text"],
-                metadata=original_doc.metadata
-            ))
-            
-        return final_docs
+        # Bước 3: Rerank thích ứng (bỏ qua khi top-1 đã rõ ràng)
+        if self._should_skip_rerank(fused):
+            self.stats["rerank_skipped"] += 1
+            return [doc for doc, _ in fused[:self.top_n]]
+
+        self.stats["reranked"] += 1
+        return self._rerank(query, [doc for doc, _ in fused])
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        # Bước 1: Tìm kiếm dense (luồng riêng) song song với sparse (luồng hiện tại)
+        dense_future = _search_pool.submit(self.vector_retriever.invoke, query)
+        sparse_docs = self.sparse_retriever.invoke(query)
+        dense_docs = dense_future.result()
+        return self._finalize(query, sparse_docs, dense_docs)
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        sparse_docs, dense_docs = await asyncio.gather(
+            asyncio.to_thread(self.sparse_retriever.invoke, query),
+            asyncio.to_thread(self.vector_retriever.invoke, query),
+        )
+        return await asyncio.to_thread(self._finalize, query, sparse_docs, dense_docs)
@@ -0,0 +1,126 @@
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Học phí Đà Lạt" -> "hoc phi da lat"."""
+    text = text.lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+def vi_tokenize(text: str) -> List[str]:
+    """
+    Tách token cho tiếng Việt: âm tiết đã bỏ dấu + bigram âm tiết liền kề.
+    Bigram giữ lại từ ghép nhiều âm tiết ("hoc_phi", "chi_nhanh") thay vì coi là các token rời rạc.
+    """
+    syllables = _WORD_RE.findall(fold_accents(text))
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+class InvertedIndexRetriever(BaseRetriever):
+    """
+    Sparse retriever (BM25) trên chỉ mục ngược tính sẵn: postings, IDF và độ dài tài liệu.
+    Khi truy vấn chỉ duyệt postings của các term trong câu hỏi thay vì chấm điểm mọi tài liệu.
+    """
+    documents: List[Document]
+    postings: Dict[str, List[Tuple[int, int]]]
+    idf: Dict[str, float]
+    doc_len: List[int]
+    avgdl: float
+    k: int = 4
+    k1: float = 1.5
+    b: float = 0.75
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], k: int = 4, k1: float = 1.5, b: float = 0.75):
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_len = []
+        for doc_id, doc in enumerate(documents):
+            counts = Counter(vi_tokenize(doc.page_content))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        n_docs = len(documents)
+        idf = {term: math.log(1 + (n_docs - len(plist) + 0.5) / (len(plist) + 0.5)) for term, plist in postings.items()}
+        avgdl = sum(doc_len) / n_docs if n_docs else 0.0
+        return cls(documents=documents, postings=postings, idf=idf, doc_len=doc_len, avgdl=avgdl, k=k, k1=k1, b=b)
+
+    def search(self, query: str, k: int = None) -> List[Tuple[int, float]]:
+        """Trả về [(chỉ số tài liệu, điểm BM25)] theo thứ tự giảm dần."""
+        k = k or self.k
+        scores: Dict[int, float] = {}
+        avgdl = self.avgdl or 1.0
+        for term in set(vi_tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in plist:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [self.documents[doc_id] for doc_id, _ in self.search(query)]
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        payload = {
+            "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents],
+            "postings": self.postings,
+            "idf": self.idf,
+            "doc_len": self.doc_len,
+            "avgdl": self.avgdl,
+            "k1": self.k1,
+            "b": self.b,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, k: int = 4):
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+        return cls(
+            documents=[Document(**d) for d in payload["documents"]],
+            postings={term: [tuple(p) for p in plist] for term, plist in payload["postings"].items()},
+            idf=payload["idf"],
+            doc_len=payload["doc_len"],
+            avgdl=payload["avgdl"],
+            k=k,
+            k1=payload["k1"],
+            b=payload["b"],
+        )
+
+
+def build_sparse_retriever(documents: List[Document], directory: str, k: int = 4) -> InvertedIndexRetriever:
+    """Tải chỉ mục ngược đã lưu cạnh chỉ mục vector, hoặc tạo mới và lưu lại."""
+    path = os.path.join(directory, "sparse.json")
+    if os.path.exists(path):
+        try:
+            retriever = InvertedIndexRetriever.load(path, k=k)
+            logging.info(f"Đã tải chỉ mục sparse từ {path}")
+            return retriever
+        except Exception as e:
+            logging.warning(f"Không tải được chỉ mục sparse '{path}', tạo lại: {e}")
+
+    retriever = InvertedIndexRetriever.from_documents(documents, k=k)
+    try:
+        retriever.save(path)
+    except OSError as e:
+        logging.warning(f"Không lưu được chỉ mục sparse vào {path}: {e}")
+    return retriever
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from app.core.config import settings
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store trong tiến trình: embeddings (float32, chuẩn hóa L2) nằm trong một ma trận NumPy liên tục.
+    Top-k = một phép nhân ma trận-vector + argpartition. Phù hợp Knowledge Base nhỏ (vài trăm chunk).
+    Lưu/tải dưới dạng `.npy` (memory-map được) + `documents.json`.
+    """
+
+    def __init__(self, embedding: Embeddings, vectors: Optional[np.ndarray] = None, documents: Optional[List[Document]] = None):
+        self._embedding = embedding
+        self._vectors = vectors if vectors is not None else np.empty((0, 0), dtype=np.float32)
+        self._documents = documents or []
+        # Thư mục đã lưu/tải chỉ mục (để dọn các thư mục không còn dùng sau khi reload)
+        self.directory: Optional[str] = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.clip(norms, 1e-12, None)
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = self._normalize(self._embedding.embed_documents(texts))
+        start = len(self._documents)
+        # vstack tạo ma trận mới liên tục (C-contiguous)
+        self._vectors = vectors if start == 0 else np.ascontiguousarray(np.vstack([self._vectors, vectors]))
+        self._documents.extend(Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas))
+        return [str(i) for i in range(start, start + len(texts))]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4) -> List[Tuple[Document, float]]:
+        n = len(self._documents)
+        if n == 0:
+            return []
+        k = min(k, n)
+        scores = self._vectors @ self._normalize(embedding)
+        if k < n:
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        return [(self._documents[i], float(scores[i])) for i in top]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def export(self) -> Tuple[List[str], np.ndarray]:
+        """Trả về (nội dung các chunk, ma trận embeddings) để tái sử dụng khi dựng lại chỉ mục."""
+        return [d.page_content for d in self._documents], self._vectors
+
+    def _select_relevance_score_fn(self):
+        # Điểm đã là cosine similarity; kẹp về [0, 1] theo quy ước relevance score của LangChain
+        return lambda score: min(1.0, max(0.0, score))
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "embeddings.npy"), np.ascontiguousarray(self._vectors, dtype=np.float32))
+        with open(os.path.join(directory, "documents.json"), "w", encoding="utf-8") as f:
+            json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in self._documents], f, ensure_ascii=False)
+        self.directory = directory
+
+    @classmethod
+    def load(cls, directory: str, embedding: Embeddings, mmap: bool = True) -> "NumpyVectorStore":
+        vectors = np.load(os.path.join(directory, "embeddings.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(directory, "documents.json"), encoding="utf-8") as f:
+            documents = [Document(**d) for d in json.load(f)]
+        store = cls(embedding, vectors=vectors, documents=documents)
+        store.directory = directory
+        return store
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Cache embeddings theo nội dung văn bản. Khi dựng lại chỉ mục (hot reload),
+    chỉ các chunk mới hoặc đã thay đổi mới phải chạy qua mô hình.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self._cache: Dict[str, List[float]] = {}
+        self.stats = {"embedded": 0, "reused": 0}
+
+    def seed(self, texts: List[str], vectors: np.ndarray):
+        for text, vector in zip(texts, vectors):
+            self._cache[text] = np.asarray(vector, dtype=np.float32).tolist()
+
+    def clear(self):
+        self._cache.clear()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = [t for t in dict.fromkeys(texts) if t not in self._cache]
+        if missing:
+            for text, vector in zip(missing, self.embeddings.embed_documents(missing)):
+                self._cache[text] = vector
+        self.stats["embedded"] += len(missing)
+        self.stats["reused"] += len(texts) - len(missing)
+        return [self._cache[t] for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def export_embeddings(store: VectorStore) -> Optional[Tuple[List[str], np.ndarray]]:
+    """
+    (nội dung, embeddings) đã lưu trong vector store, để nạp sẵn CachedEmbeddings khi dựng lại chỉ mục.
+    Hỗ trợ NumpyVectorStore và Chroma; backend khác trả về None (phải embed lại toàn bộ).
+    """
+    if isinstance(store, NumpyVectorStore):
+        return store.export()
+    if not hasattr(store, "get"):
+        return None
+    try:
+        data = store.get(include=["documents", "embeddings"])
+    except Exception as e:
+        logging.warning(f"Không đọc được embeddings từ vector store: {e}")
+        return None
+    documents, vectors = data.get("documents"), data.get("embeddings")
+    if documents is None or vectors is None or len(documents) != len(vectors):
+        return None
+    return list(documents), np.asarray(vectors, dtype=np.float32)
+
+
+def index_fingerprint(documents: List[Document], model_name: str = settings.EMBEDDING_MODEL) -> str:
+    """Dấu vân tay của chỉ mục: đổi khi nội dung tài liệu hoặc mô hình embeddings thay đổi."""
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for doc in documents:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def index_directory(collection_name: str, documents: List[Document]) -> str:
+    """Thư mục lưu chỉ mục (vector + sparse) cho một tập tài liệu."""
+    return os.path.join(settings.INDEX_DIR, f"{collection_name}-{index_fingerprint(documents)}")
+
+
+def prune_index_directories(collection_names: Iterable[str], keep: Iterable[str]) -> List[str]:
+    """Xóa các thư mục chỉ mục `{collection}-<fingerprint>` trong INDEX_DIR không thuộc `keep`; trả về các thư mục đã xóa."""
+    collection_names = set(collection_names)
+    keep = {os.path.abspath(path) for path in keep if path}
+    try:
+        entries = os.listdir(settings.INDEX_DIR)
+    except OSError:
+        return []
+    removed = []
+    for entry in entries:
+        path = os.path.join(settings.INDEX_DIR, entry)
+        name, _, fingerprint = entry.rpartition("-")
+        if name not in collection_names or len(fingerprint) != 16 or os.path.abspath(path) in keep or not os.path.isdir(path):
+            continue
+        try:
+            shutil.rmtree(path)
+            removed.append(path)
+        except OSError as e:
+            logging.warning(f"Không xóa được chỉ mục cũ {path}: {e}")
+    return removed
+
+
+def build_vector_store(
+    documents: List[Document],
+    embeddings: Embeddings,
+    collection_name: str,
+    backend: str = None,
+    chroma_kwargs: Optional[dict] = None,
+    generation: int = 1,
+) -> VectorStore:
+    """
+    Tạo vector store theo backend cấu hình (`numpy` hoặc `chroma`).
+    `generation` > 1 khi dựng lại chỉ mục: Chroma dùng collection mới để không lẫn với bản đang phục vụ.
+    """
+    backend = backend or settings.VECTOR_BACKEND
+
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        name = collection_name if generation <= 1 else f"{collection_name}_v{generation}"
+        return Chroma.from_documents(documents=documents, embedding=embeddings, collection_name=name, **(chroma_kwargs or {}))
+
+    if backend != "numpy":
+        raise ValueError(f"VECTOR_BACKEND không hợp lệ: {backend}")
+
+    # Tái sử dụng chỉ mục đã lưu nếu nội dung không đổi (bỏ qua bước embed toàn bộ)
+    directory = index_directory(collection_name, documents)
+    if os.path.exists(os.path.join(directory, "embeddings.npy")):
+        try:
+            store = NumpyVectorStore.load(directory, embeddings)
+            logging.info(f"Đã tải chỉ mục vector '{collection_name}' từ {directory}")
+            return store
+        except Exception as e:
+            logging.warning(f"Không tải được chỉ mục '{directory}', tạo lại: {e}")
+
+    store = NumpyVectorStore.from_texts(
+        texts=[doc.page_content for doc in documents],
+        embedding=embeddings,
+        metadatas=[doc.metadata for doc in documents],
+    )
+    try:
+        store.save(directory)
+    except OSError as e:
+        logging.warning(f"Không lưu được chỉ mục vector vào {directory}: {e}")
+    return store
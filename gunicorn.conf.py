@@ -0,0 +1,35 @@
+# Cấu hình Gunicorn cho triển khai nhiều worker (Uvicorn worker).
+#   gunicorn app.main:app
+# Với PRELOAD_APP=true (mặc định): mô hình, chỉ mục RAG và snapshot dữ liệu tuyển sinh được nạp một lần
+# trong master trước khi fork, các worker dùng chung copy-on-write. Xem scripts/report_worker_memory.py.
+# Khi preload, worker không theo dõi Knowledge Base (KB_WATCH_INTERVAL bị bỏ qua) và
+# POST /api/v1/admin/knowledge-base/reload chỉ nạp lại chỉ mục của worker nhận request (và làm mất chia sẻ
+# copy-on-write của worker đó): để áp dụng Knowledge Base mới cho mọi worker, khởi động lại dịch vụ
+# (HUP không đủ vì master giữ chỉ mục đã preload).
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("PRELOAD_APP", "true").lower() == "true"
+
+
+def on_starting(server):
+    # Chạy trong master, sau khi import app (preload_app) và trước khi fork worker
+    if preload_app:
+        from app.core.preload import preload_shared_state
+        preload_shared_state()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from app.core.preload import after_fork
+        after_fork()
+
+
+def child_exit(server, worker):
+    # Chế độ Prometheus multiprocess (PROMETHEUS_MULTIPROC_DIR): bỏ số liệu gauge của worker đã thoát
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
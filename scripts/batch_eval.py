@@ -0,0 +1,67 @@
+"""
+Chạy hàng loạt câu hỏi mẫu qua chatbot (/api/v1/batch) và ghi kết quả NDJSON (mỗi dòng một câu, kèm latency_ms).
+
+Mỗi dòng đầu vào: {"id": "...", "question": "...", "context": {"branch": ..., "grade": ..., "subject": ...},
+"history": [{"role": "user", "content": "..."}], "expected_contains": ["cụm từ", ...]}; chỉ "question" là bắt buộc.
+Các phiên chỉ nằm trong bộ nhớ server (không ghi DB); cache của server dùng chung cho cả lượt chạy.
+
+Endpoint yêu cầu token quản trị: server và script cùng đọc biến ADMIN_TOKEN (hoặc truyền --admin-token).
+Mỗi lần tối đa BATCH_MAX_ITEMS câu (mặc định 200), chia file lớn thành nhiều lần chạy.
+
+Chạy từ thư mục gốc của dự án (server đang chạy):
+    python scripts/batch_eval.py --input data/batch_questions.jsonl
+    python scripts/batch_eval.py --input questions.jsonl --concurrency 8 --output results.ndjson --url http://localhost:7860
+"""
+import argparse
+import json
+import os
+import sys
+
+import httpx
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá hàng loạt câu hỏi qua /api/v1/batch")
+    parser.add_argument("--input", required=True, help="File JSONL câu hỏi")
+    parser.add_argument("--output", default=None, help="File NDJSON kết quả (mặc định in ra stdout)")
+    parser.add_argument("--url", default="http://localhost:8000", help="Địa chỉ server chatbot")
+    parser.add_argument("--concurrency", type=int, default=None, help="Số câu chạy đồng thời (mặc định theo BATCH_CONCURRENCY của server)")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN"), help="Token quản trị của server (mặc định biến ADMIN_TOKEN)")
+    parser.add_argument("--timeout", type=float, default=600, help="Thời gian chờ tối đa giữa hai dòng kết quả (giây)")
+    args = parser.parse_args()
+
+    with open(args.input, "rb") as f:
+        body = f.read()
+    params = {"concurrency": args.concurrency} if args.concurrency else {}
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+
+    summary = None
+    done = 0
+    try:
+        with httpx.stream("POST", f"{args.url.rstrip('/')}/api/v1/batch", content=body, params=params,
+                          headers={"Content-Type": "application/x-ndjson", "X-Admin-Token": args.admin_token or ""}, timeout=args.timeout) as response:
+            if response.status_code != 200:
+                response.read()
+                sys.exit(f"Lỗi {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                if "summary" in result:
+                    summary = result["summary"]
+                    continue
+                out.write(line + "\n")
+                done += 1
+                if args.output:
+                    status = "LỖI" if "error" in result else ("SAI" if result.get("passed") is False else "OK")
+                    print(f"[{done}] {status} {result.get('latency_ms')}ms {result.get('question')}", file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+
+    if summary:
+        print(json.dumps(summary, ensure_ascii=False, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
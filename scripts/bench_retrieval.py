@@ -0,0 +1,289 @@
+"""
+Benchmark chất lượng và độ trễ truy xuất (HybridRetriever) theo từng retriever và cấu hình chia chunk.
+
+Bộ câu hỏi có nhãn được sinh tự động từ các dòng `Q:` của knowledge_base.txt (nhãn = chính cặp Q/A đó),
+cộng thêm các câu diễn đạt lại do nhóm cung cấp (JSONL: {"query": "...", "question": "<câu Q: trong KB>"}).
+Một chunk được tính là đúng nếu nó chứa (hoặc chồng lên) cặp Q/A nhãn.
+
+Retriever được so sánh (trên cùng ứng viên k mỗi bên):
+    bm25            chỉ mục ngược (sparse)
+    vector          tìm kiếm vector (gồm thời gian embed câu hỏi)
+    hybrid          Weighted RRF 0.5/0.5 của bm25 + vector (hai nhánh chạy song song: max + fusion)
+    hybrid_rerank   hybrid + FlashRank rerank mọi truy vấn
+    hybrid_adaptive như production: bỏ qua rerank khi top-1 sau fusion vượt trội (RERANK_SKIP_MARGIN)
+Thứ hạng được giữ đầy đủ (không cắt top_n) để recall@k cho thấy ảnh hưởng của RETRIEVER_TOP_N.
+
+Chạy từ thư mục gốc của dự án:
+    python scripts/bench_retrieval.py --output retrieval-report.json
+    python scripts/bench_retrieval.py --chunking faq,split:500:100,split:1000:200 -k 8 --ks 1,3,5,8
+    python scripts/bench_retrieval.py --fake-embeddings --no-rerank   # kiểm tra nhanh, không tải mô hình
+"""
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_vector_backends import current_rss_mb, percentile
+
+
+def faq_spans(text: str, questions: list) -> list:
+    """(câu hỏi, vị trí bắt đầu, vị trí kết thúc) của từng cặp Q/A trong file, theo thứ tự xuất hiện."""
+    starts = []
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if line.strip().startswith("Q:"):
+            starts.append(offset)
+        offset += len(line)
+    ends = starts[1:] + [len(text)]
+    return list(zip(questions, starts, ends))
+
+
+def chunk_documents(chunking: str, path: str, text: str, spans: list) -> list:
+    """`faq`: mỗi cặp Q/A một chunk (production); `split:<size>:<overlap>`: RecursiveCharacterTextSplitter."""
+    from app.services.rag.faq import load_faq_documents
+
+    if chunking == "faq":
+        documents = load_faq_documents(path)
+        for doc in documents:
+            doc.metadata["faq_questions"] = [doc.metadata["question"]]
+        return documents
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    _, size, overlap = chunking.split(":")
+    splitter = RecursiveCharacterTextSplitter(chunk_size=int(size), chunk_overlap=int(overlap), add_start_index=True)
+    documents = splitter.create_documents([text], metadatas=[{"source": path}])
+    for i, doc in enumerate(documents):
+        start = doc.metadata["start_index"]
+        end = start + len(doc.page_content)
+        doc.metadata["chunk_id"] = f"{chunking}-{i}"
+        doc.metadata["faq_questions"] = [q for q, s, e in spans if s < end and start < e]
+    return documents
+
+
+def load_queries(questions: list, paraphrases_path: str) -> list:
+    queries = [{"query": q, "question": q, "source": "faq"} for q in dict.fromkeys(questions)]
+    if paraphrases_path and os.path.exists(paraphrases_path):
+        known = set(questions)
+        with open(paraphrases_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                if item["question"] not in known:
+                    print(f"Bỏ qua câu diễn đạt lại (không có trong KB): {item['question']}", file=sys.stderr)
+                    continue
+                queries.append({"query": item["query"], "question": item["question"], "source": "paraphrase"})
+    return queries
+
+
+def first_relevant_rank(docs: list, question: str):
+    for rank, doc in enumerate(docs, start=1):
+        if question in doc.metadata.get("faq_questions", ()):
+            return rank
+    return None
+
+
+def quality(ranks: list, ks: list) -> dict:
+    n = len(ranks) or 1
+    metrics = {f"recall@{k}": round(sum(1 for r in ranks if r is not None and r <= k) / n, 4) for k in ks}
+    metrics["mrr"] = round(sum(1 / r for r in ranks if r is not None) / n, 4)
+    return metrics
+
+
+def latency_summary(values: list) -> dict:
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "mean": round(statistics.mean(values), 3),
+    }
+
+
+def run_config(chunking: str, args, text: str, spans: list, queries: list, embeddings, reranker) -> list:
+    from app.core.config import settings
+    from app.services.rag.retrievers import HybridRetriever, RerankCache, reciprocal_rank_fusion
+    from app.services.rag.sparse import InvertedIndexRetriever
+    from app.services.rag.vector_index import build_vector_store
+
+    documents = chunk_documents(chunking, args.kb, text, spans)
+    rss_before = current_rss_mb()
+    t0 = time.perf_counter()
+    sparse = InvertedIndexRetriever.from_documents(documents, k=args.k)
+    sparse_build_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    slug = chunking.replace(":", "_")
+    store = build_vector_store(documents, embeddings, collection_name=f"bench_retrieval_{slug}", backend=args.backend)
+    vector_build_ms = (time.perf_counter() - t0) * 1000
+    rss_index_mb = current_rss_mb() - rss_before
+
+    vector = store.as_retriever(search_kwargs={"k": args.k})
+    # Giữ toàn bộ thứ hạng sau rerank (top_n lớn) và tắt cache rerank để đo đúng chi phí mỗi truy vấn
+    hybrid = HybridRetriever(
+        vector_retriever=vector, sparse_retriever=sparse, reranker=reranker,
+        top_n=2 * args.k, rrf_k=settings.RRF_K, rerank_skip_margin=settings.RERANK_SKIP_MARGIN,
+        rerank_cache=RerankCache(0),
+    )
+
+    # Làm nóng (tải lazy, cache CPU) trước khi đo
+    warm = queries[0]["query"]
+    sparse.invoke(warm)
+    vector.invoke(warm)
+    if reranker is not None:
+        hybrid._rerank(warm, vector.invoke(warm))
+
+    names = ["bm25", "vector", "hybrid"] + (["hybrid_rerank", "hybrid_adaptive"] if reranker is not None else [])
+    ranks = {name: [] for name in names}
+    latencies = {name: [] for name in names}
+    stages = {"sparse": [], "dense": [], "fusion": [], "rerank": []}
+    skipped = 0
+    for item in queries:
+        query, question = item["query"], item["question"]
+        t0 = time.perf_counter()
+        sparse_docs = sparse.invoke(query)
+        t1 = time.perf_counter()
+        dense_docs = vector.invoke(query)
+        t2 = time.perf_counter()
+        fused = reciprocal_rank_fusion([sparse_docs, dense_docs], hybrid.weights, hybrid.rrf_k)
+        t3 = time.perf_counter()
+        sparse_ms, dense_ms, fusion_ms = (t1 - t0) * 1000, (t2 - t1) * 1000, (t3 - t2) * 1000
+        hybrid_ms = max(sparse_ms, dense_ms) + fusion_ms
+        stages["sparse"].append(sparse_ms)
+        stages["dense"].append(dense_ms)
+        stages["fusion"].append(fusion_ms)
+
+        fused_docs = [doc for doc, _ in fused]
+        results = {"bm25": (sparse_docs, sparse_ms), "vector": (dense_docs, dense_ms), "hybrid": (fused_docs, hybrid_ms)}
+        if reranker is not None:
+            t0 = time.perf_counter()
+            reranked = hybrid._rerank(query, fused_docs) if fused_docs else []
+            rerank_ms = (time.perf_counter() - t0) * 1000
+            stages["rerank"].append(rerank_ms)
+            results["hybrid_rerank"] = (reranked, hybrid_ms + rerank_ms)
+            if hybrid._should_skip_rerank(fused):
+                skipped += 1
+                results["hybrid_adaptive"] = (fused_docs, hybrid_ms)
+            else:
+                results["hybrid_adaptive"] = (reranked, hybrid_ms + rerank_ms)
+
+        for name, (docs, ms) in results.items():
+            ranks[name].append((item["source"], first_relevant_rank(docs, question)))
+            latencies[name].append(ms)
+
+    ks = args.ks
+    config = {
+        "chunking": chunking,
+        "chunks": len(documents),
+        "avg_chunk_chars": round(statistics.mean(len(d.page_content) for d in documents), 1),
+        "k": args.k,
+        "index_build_ms": {"sparse": round(sparse_build_ms, 1), "vector": round(vector_build_ms, 1)},
+        "rss_index_mb": round(rss_index_mb, 2),
+        "stages_ms": {stage: latency_summary(values) for stage, values in stages.items() if values},
+    }
+    if reranker is not None:
+        config["rerank_skip_rate"] = round(skipped / len(queries), 4)
+
+    rows = []
+    for name in names:
+        all_ranks = [r for _, r in ranks[name]]
+        by_source = {}
+        for source in sorted({s for s, _ in ranks[name]}):
+            by_source[source] = quality([r for s, r in ranks[name] if s == source], ks)
+        rows.append({**config, "retriever": name, **quality(all_ranks, ks), "by_source": by_source, "latency_ms": latency_summary(latencies[name])})
+    return rows
+
+
+def main():
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Benchmark chất lượng/độ trễ truy xuất theo retriever và cách chia chunk.")
+    parser.add_argument("--kb", default=settings.KNOWLEDGE_BASE_PATH, help="File knowledge base dạng Q:/A:")
+    parser.add_argument("--paraphrases", default="data/retrieval_paraphrases.jsonl", help="JSONL câu diễn đạt lại có nhãn")
+    parser.add_argument("--chunking", default="faq,split:500:100,split:1000:200,split:2000:400",
+                        help="Danh sách cấu hình chunk: faq hoặc split:<chunk_size>:<chunk_overlap>")
+    parser.add_argument("-k", type=int, default=settings.RETRIEVER_K, help="Số ứng viên lấy từ mỗi nhánh (sparse/vector)")
+    parser.add_argument("--ks", default="1,3,5", help="Các mức k để tính recall@k")
+    parser.add_argument("--backend", default=settings.VECTOR_BACKEND, help="Backend vector store (numpy | chroma)")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Dùng embeddings giả (không cần tải mô hình).")
+    parser.add_argument("--no-rerank", action="store_true", help="Bỏ qua FlashRank rerank.")
+    parser.add_argument("--output", default=None, help="Ghi báo cáo JSON ra file (mặc định in ra stdout)")
+    args = parser.parse_args()
+    args.ks = [int(k) for k in args.ks.split(",")]
+
+    from app.services.rag.faq import parse_faq
+    with open(args.kb, encoding="utf-8") as f:
+        text = f.read()
+    questions = [q for q, _ in parse_faq(text)]
+    spans = faq_spans(text, questions)
+    queries = load_queries(questions, args.paraphrases)
+
+    # Chỉ mục benchmark ghi vào thư mục tạm, không đụng chỉ mục đang phục vụ
+    settings.INDEX_DIR = tempfile.mkdtemp(prefix="bench-retrieval-")
+    rss_start = current_rss_mb()
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        embeddings = DeterministicFakeEmbedding(size=384)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+    reranker = None
+    rerank_error = None
+    if not args.no_rerank:
+        try:
+            from app.services.rag.retrievers import create_reranker
+            reranker = create_reranker()
+        except Exception as e:
+            rerank_error = str(e)
+            print(f"Không tải được reranker, bỏ qua hybrid_rerank: {e}", file=sys.stderr)
+
+    results = []
+    for chunking in args.chunking.split(","):
+        print(f"Đang đo cấu hình chunk '{chunking}'...", file=sys.stderr)
+        results.extend(run_config(chunking, args, text, spans, queries, embeddings, reranker))
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "knowledge_base": {
+            "path": args.kb,
+            "sha1": hashlib.sha1(text.encode("utf-8")).hexdigest(),
+            "faq_pairs": len(questions),
+        },
+        "queries": {
+            "total": len(queries),
+            "faq": sum(1 for q in queries if q["source"] == "faq"),
+            "paraphrase": sum(1 for q in queries if q["source"] == "paraphrase"),
+        },
+        "models": {
+            "embedding": "fake" if args.fake_embeddings else settings.EMBEDDING_MODEL,
+            "reranker": None if reranker is None else "ms-marco-MiniLM-L-12-v2",
+            "reranker_error": rerank_error,
+            "rss_models_mb": round(current_rss_mb() - rss_start, 2),
+        },
+        "settings": {
+            "vector_backend": args.backend,
+            "retriever_k": settings.RETRIEVER_K,
+            "retriever_top_n": settings.RETRIEVER_TOP_N,
+            "rrf_k": settings.RRF_K,
+            "rerank_skip_margin": settings.RERANK_SKIP_MARGIN,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        for row in results:
+            print(f"{row['chunking']:<16} {row['retriever']:<16} " + " ".join(f"{k}={row[k]}" for k in row if k.startswith("recall@") or k == "mrr")
+                  + f" p50={row['latency_ms']['p50']}ms", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+So sánh cách lưu dữ liệu tuyển sinh (common-data) trong bộ nhớ: JSON gốc (dict lồng nhau, cách làm cũ)
+và SchoolSnapshot (dataclass __slots__, chuỗi intern, chỉ mục theo (chi nhánh, khối)).
+Báo cáo bộ nhớ (giữ lại + RSS) của snapshot và độ trễ get_filtered_data; kiểm tra hai cách cho kết quả giống nhau.
+
+Mỗi cách chạy trong một tiến trình con riêng để số đo RSS không ảnh hưởng lẫn nhau.
+Chạy từ thư mục gốc của dự án:
+    python scripts/bench_school_snapshot.py                          # dữ liệu tổng hợp
+    python scripts/bench_school_snapshot.py --input common-data.json # dữ liệu thật đã tải về
+    python scripts/bench_school_snapshot.py --classes 20000 --repeat 5000
+"""
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_vector_backends import current_rss_mb, percentile
+
+
+def generate_payload(branches: int, classes: int, teachers: int, seed: int = 42) -> dict:
+    """Sinh dữ liệu common-data tổng hợp, đủ các trường thừa như API thật (user, room, slot...)."""
+    rng = random.Random(seed)
+    subjects = [{"subjectId": i, "name": name, "code": name[:3].upper(), "description": f"Môn {name}"}
+                for i, name in enumerate(["Toán", "Ngữ văn", "Tiếng Anh", "Vật lý", "Hóa học", "Sinh học", "Lịch sử", "Địa lý"])]
+    grades = [{"gradeId": i, "code": code, "name": f"Lớp {code}", "description": f"Khối {code}"} for i, code in enumerate([10, 11, 12])]
+    branch_list = [{"branchId": i, "name": f"Cơ sở {i + 1}", "address": f"Số {i + 1} Đại Cồ Việt, Hà Nội", "phone": "0240000000",
+                    "email": f"cs{i + 1}@example.edu.vn", "createdAt": "2024-01-01T00:00:00"} for i in range(branches)]
+    slots = [{"lessonSlotId": i, "name": f"Ca {i + 1}", "startTime": f"{7 + 2 * i:02d}:00", "endTime": f"{8 + 2 * i:02d}:30"} for i in range(6)]
+    rooms = [{"roomId": i, "name": f"P{100 + i}", "capacity": 30, "branchId": i % branches, "status": "ACTIVE"} for i in range(40)]
+
+    class_list = []
+    for i in range(classes):
+        class_list.append({
+            "classId": i,
+            "name": f"Lớp luyện thi {i}",
+            "branchId": rng.randrange(branches),
+            "gradeId": rng.randrange(len(grades)),
+            "subject": rng.choice(subjects),
+            "fee": rng.choice([1500000, 2000000, 2500000]),
+            "startDate": "2025-09-01",
+            "endDate": "2026-05-31",
+            "status": rng.choice(["RUNNING", "PLANNED", "FINISHED", "CANCELLED"]),
+            "maxStudents": 30,
+            "description": "Lớp học ôn luyện theo chương trình mới. " * 3,
+            "classSchedules": [{"classScheduleId": i * 3 + d, "dayOfWeek": rng.randrange(1, 8), "lessonSlot": rng.choice(slots), "room": rng.choice(rooms)} for d in range(rng.randint(1, 3))],
+        })
+
+    teacher_list = []
+    for i in range(teachers):
+        teacher_list.append({
+            "teacherId": i,
+            "qualification": rng.choice(["Thạc sĩ", "Tiến sĩ", "Cử nhân"]),
+            "experienceYears": rng.randint(1, 20),
+            "user": {"userId": i, "fullName": f"Giáo viên {i}", "email": f"gv{i}@example.edu.vn", "phone": "0900000000",
+                     "avatarUrl": f"https://cdn.example.edu.vn/avatars/{i}.png", "role": "TEACHER", "createdAt": "2024-01-01T00:00:00"},
+            "teacherSubjects": [{"subject": rng.choice(subjects)} for _ in range(rng.randint(1, 2))],
+            "teachingAssignments": [{"classId": rng.randrange(classes), "assignedAt": "2025-08-01"} for _ in range(rng.randint(1, 5))],
+        })
+
+    return {
+        "branches": branch_list,
+        "grades": grades,
+        "classes": class_list,
+        "teachers": teacher_list,
+        "holidays": [{"name": "Tết Nguyên Đán", "description": "Nghỉ 2 tuần"}, {"name": "Quốc khánh", "description": "Nghỉ 1 ngày"}],
+        "semesters": [{"name": "Học kỳ 1"}, {"name": "Học kỳ 2"}],
+    }
+
+
+def raw_filtered_data(data: dict, branch: str, grade: str, subject: str = None) -> dict:
+    """Cách làm tham chiếu (trước SchoolSnapshot): duyệt toàn bộ JSON gốc cho mỗi lần tra cứu."""
+    from app.services.external.snapshot import format_day
+
+    branch_info = None
+    for b in data.get("branches", []):
+        if (branch.lower() in b["name"].lower()) or (b["name"].lower() in branch.lower()) or \
+           (branch.lower() in b["address"].lower()) or (b["address"].lower() in branch.lower()):
+            branch_info = b
+            break
+    grade_info = None
+    for g in data.get("grades", []):
+        val_code = str(g["code"])
+        if val_code in grade or grade in val_code or grade in g["name"]:
+            grade_info = g
+            break
+    if branch_info is None:
+        return {"message": f"Không tìm thấy chi nhánh nào khớp với '{branch}'."}
+    if grade_info is None:
+        return {"message": f"Không tìm thấy khối nào khớp với '{grade}'."}
+
+    filtered_classes, relevant_class_ids = [], set()
+    for c in data.get("classes", []):
+        if c.get("branchId") == branch_info["branchId"] and c.get("gradeId") == grade_info["gradeId"]:
+            if c.get("status") not in ["RUNNING", "PLANNED"]:
+                continue
+            if subject:
+                c_subject = (c.get("subject") or {}).get("name", "")
+                if subject.lower() not in c_subject.lower() and c_subject.lower() not in subject.lower():
+                    continue
+            schedules = []
+            for s in c.get("classSchedules", []):
+                slot = s.get("lessonSlot") or {}
+                room = s.get("room") or {}
+                schedules.append(f"{format_day(s.get('dayOfWeek'))} - {slot.get('name')} ({slot.get('startTime')}-{slot.get('endTime')}) tại {room.get('name')}")
+            filtered_classes.append({
+                "id": c["classId"], "name": c["name"], "subject": (c.get("subject") or {}).get("name"), "fee": c["fee"],
+                "schedules": schedules, "startDate": c["startDate"], "endDate": c["endDate"], "status": c["status"],
+            })
+            relevant_class_ids.add(c["classId"])
+
+    relevant_teachers = []
+    for t in data.get("teachers", []):
+        if any(assign.get("classId") in relevant_class_ids for assign in t.get("teachingAssignments", [])):
+            relevant_teachers.append({
+                "name": t.get("user", {}).get("fullName"),
+                "qualification": t.get("qualification"),
+                "experience": t.get("experienceYears"),
+                "subjects": [(ts.get("subject") or {}).get("name") for ts in t.get("teacherSubjects", [])],
+            })
+
+    result = {
+        "query_context": {"branch": branch_info["name"], "address": branch_info["address"], "grade": grade_info["name"]},
+        "classes_found": filtered_classes,
+        "teachers": relevant_teachers,
+        "holidays": [h["name"] + f" ({h['description']})" for h in data.get("holidays", [])],
+        "semesters": [s["name"] for s in data.get("semesters", [])],
+    }
+    if not filtered_classes:
+        result["message"] = "Hiện tại chưa có lớp học nào mở cho Khối và Chi nhánh này."
+    return result
+
+
+def make_queries(data: dict, repeat: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    subjects = [None, "Toán", "Tiếng Anh", "Hóa"]
+    return [(rng.choice(data["branches"])["name"], str(rng.choice(data["grades"])["code"]), rng.choice(subjects)) for _ in range(repeat)]
+
+
+def load_state(mode: str, path: str):
+    """Tải dữ liệu theo cách `mode`; trả về (đối tượng được giữ lại trong bộ nhớ, hàm tra cứu)."""
+    from app.services.external.school_api import ExternalAPIService
+    from app.services.external.snapshot import SchoolSnapshot
+
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if mode == "raw":
+        return data, lambda b, g, s: raw_filtered_data(data, b, g, s)
+
+    service = ExternalAPIService()
+    service.snapshot = SchoolSnapshot.from_payload(data)
+    return service.snapshot, lambda b, g, s: _run_sync(service.get_filtered_data(b, g, s))
+
+
+def run_mode(mode: str, path: str, repeat: int) -> dict:
+    # Import trước để không tính bộ nhớ của module vào snapshot
+    import app.services.external.school_api  # noqa: F401
+
+    with open(path, encoding="utf-8") as f:
+        queries = make_queries(json.load(f), repeat)
+
+    # Bộ nhớ thực sự bị giữ lại (tracemalloc): RSS không giảm ngay khi JSON gốc được giải phóng
+    # vì allocator của Python giữ lại arena, nên đo riêng để so sánh công bằng
+    tracemalloc.start()
+    state, _ = load_state(mode, path)
+    gc.collect()
+    retained_mb = tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+    tracemalloc.stop()
+    del state
+    gc.collect()
+
+    rss_before = current_rss_mb()
+    t0 = time.perf_counter()
+    state, lookup = load_state(mode, path)
+    load_ms = (time.perf_counter() - t0) * 1000
+    gc.collect()
+    rss_after = current_rss_mb()
+
+    latencies, digest = [], hashlib.sha1()
+    for branch, grade, subject in queries:
+        t0 = time.perf_counter()
+        result = lookup(branch, grade, subject)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        digest.update(json.dumps(result, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+    return {
+        "mode": mode,
+        "load_ms": round(load_ms, 1),
+        "retained_mb": round(retained_mb, 2),
+        "rss_growth_mb": round(rss_after - rss_before, 2),
+        "lookup_p50_ms": round(percentile(latencies, 50), 4),
+        "lookup_p95_ms": round(percentile(latencies, 95), 4),
+        "lookup_mean_ms": round(statistics.mean(latencies), 4),
+        "result_digest": digest.hexdigest(),
+    }
+
+
+def _run_sync(coro):
+    # get_filtered_data không thực sự chờ I/O khi đã có snapshot -> chạy coroutine tới hết mà không cần event loop
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("get_filtered_data không được chờ I/O trong benchmark")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark snapshot dữ liệu tuyển sinh (RSS + tra cứu).")
+    parser.add_argument("--input", help="File JSON common-data (mặc định: dữ liệu tổng hợp).")
+    parser.add_argument("--branches", type=int, default=5)
+    parser.add_argument("--classes", type=int, default=5000)
+    parser.add_argument("--teachers", type=int, default=800)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(run_mode(args.run_mode, args.input, args.repeat)))
+        return
+
+    path = args.input
+    if not path:
+        fd, path = tempfile.mkstemp(prefix="common-data-", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(generate_payload(args.branches, args.classes, args.teachers), f, ensure_ascii=False)
+
+    results = []
+    for mode in ("raw", "compact"):
+        cmd = [sys.executable, __file__, "--run-mode", mode, "--input", path, "--repeat", str(args.repeat)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            results.append({"mode": mode, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if all("result_digest" in r for r in results):
+        # Cùng truy vấn -> cùng kết quả (so sánh qua digest)
+        same = len({r.pop("result_digest") for r in results}) == 1
+        results.append({"identical_results": same, "input_bytes": os.path.getsize(path)})
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
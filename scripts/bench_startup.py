@@ -0,0 +1,117 @@
+"""
+Đo chi phí khởi động của `app.main`: thời gian import (`python -X importtime`) và RSS,
+so với ngân sách trong scripts/startup_budget.json. Thoát với mã 1 nếu vượt ngân sách
+hoặc nếu một thư viện nặng bị import ở cấp module (cần được import lười khi dùng lần đầu).
+
+Mỗi lần đo chạy trong một tiến trình Python mới. Chạy từ thư mục gốc của dự án:
+    python scripts/bench_startup.py
+    python scripts/bench_startup.py --repeat 5 --top 20 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+
+# Mã chạy trong tiến trình con: import module rồi in thời gian, RSS và các module nặng đã bị tải
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - t0) * 1000
+rss = None
+try:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+except OSError:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+heavy = {heavy!r}
+print(json.dumps({{"import_ms": elapsed, "rss_mb": rss, "loaded_heavy": [m for m in heavy if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Phân tích output của -X importtime -> {module: (self_us, cumulative_us)}."""
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            timings[name.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return timings
+
+
+def measure(module: str, heavy: list) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(module=module, heavy=heavy)],
+        capture_output=True, text=True, cwd=ROOT,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import thất bại")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["importtime"] = parse_importtime(proc.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thời gian import và RSS lúc khởi động.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15, help="Số module chậm nhất (theo thời gian tự thân) được liệt kê.")
+    parser.add_argument("--budget", default=DEFAULT_BUDGET)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file.")
+    args = parser.parse_args()
+
+    with open(args.budget, encoding="utf-8") as f:
+        budget = json.load(f)
+    heavy = budget.get("forbidden_modules", [])
+
+    runs = [measure(args.module, heavy) for _ in range(args.repeat)]
+
+    # Lần chạy có thời gian import trung vị làm đại diện cho bảng importtime
+    runs.sort(key=lambda r: r["import_ms"])
+    median_run = runs[len(runs) // 2]
+    slowest = sorted(median_run["importtime"].items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+
+    report = {
+        "module": args.module,
+        "runs": len(runs),
+        "import_ms_median": round(statistics.median(r["import_ms"] for r in runs), 1),
+        "import_ms_min": round(runs[0]["import_ms"], 1),
+        "rss_mb_median": round(statistics.median(r["rss_mb"] for r in runs), 1),
+        "modules_imported": len(median_run["importtime"]),
+        "loaded_heavy": median_run["loaded_heavy"],
+        "slowest_modules_self_ms": [{"module": name, "self_ms": round(s / 1000, 2), "cumulative_ms": round(c / 1000, 2)} for name, (s, c) in slowest],
+        "budget": budget,
+    }
+
+    violations = []
+    if report["import_ms_median"] > budget["max_import_ms"]:
+        violations.append(f"import {report['import_ms_median']}ms > {budget['max_import_ms']}ms")
+    if report["rss_mb_median"] > budget["max_rss_mb"]:
+        violations.append(f"RSS {report['rss_mb_median']}MB > {budget['max_rss_mb']}MB")
+    if report["loaded_heavy"]:
+        violations.append(f"thư viện nặng bị import lúc khởi động: {', '.join(report['loaded_heavy'])}")
+    report["violations"] = violations
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+So sánh backend vector store (numpy vs chroma): thời gian khởi tạo, RSS và độ trễ truy vấn.
+
+Mỗi backend chạy trong một tiến trình con riêng để số đo RSS không ảnh hưởng lẫn nhau.
+Chạy từ thư mục gốc của dự án:
+    python scripts/bench_vector_backends.py
+    python scripts/bench_vector_backends.py --fake-embeddings --repeat 2000
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Fallback (macOS trả về bytes, Linux trả về KB)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run_backend(backend: str, fake_embeddings: bool, repeat: int, k: int) -> dict:
+    from app.core.config import settings
+    from app.services.rag.faq import load_faq_documents
+
+    if fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        embeddings = DeterministicFakeEmbedding(size=384)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+
+    documents = load_faq_documents(settings.KNOWLEDGE_BASE_PATH)
+    queries = [doc.metadata["question"] for doc in documents]
+    query_vectors = embeddings.embed_documents(queries)
+    rss_before = current_rss_mb()
+
+    from app.services.rag.vector_index import build_vector_store
+    settings.INDEX_DIR = tempfile.mkdtemp(prefix="bench-index-")
+
+    t0 = time.perf_counter()
+    store = build_vector_store(documents, embeddings, collection_name=f"bench_{backend}", backend=backend)
+    cold_start_ms = (time.perf_counter() - t0) * 1000
+
+    warm_start_ms = None
+    if backend == "numpy":
+        # Lần khởi động sau: tải lại từ .npy (memory-map), không embed lại
+        t0 = time.perf_counter()
+        build_vector_store(documents, embeddings, collection_name=f"bench_{backend}", backend=backend)
+        warm_start_ms = (time.perf_counter() - t0) * 1000
+
+    rss_after = current_rss_mb()
+
+    # Độ trễ tìm kiếm (không tính thời gian embed câu hỏi)
+    latencies = []
+    for i in range(repeat):
+        vector = query_vectors[i % len(query_vectors)]
+        t0 = time.perf_counter()
+        store.similarity_search_by_vector(vector, k=k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    return {
+        "backend": backend,
+        "documents": len(documents),
+        "cold_start_ms": round(cold_start_ms, 2),
+        "warm_start_ms": round(warm_start_ms, 2) if warm_start_ms is not None else None,
+        "rss_index_mb": round(rss_after - rss_before, 2),
+        "rss_total_mb": round(rss_after, 2),
+        "query_p50_ms": round(percentile(latencies, 50), 4),
+        "query_p95_ms": round(percentile(latencies, 95), 4),
+        "query_mean_ms": round(statistics.mean(latencies), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backend vector store.")
+    parser.add_argument("--backends", default="numpy,chroma")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Dùng embeddings giả (không cần tải mô hình).")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--run-backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_backend:
+        print(json.dumps(run_backend(args.run_backend, args.fake_embeddings, args.repeat, args.k)))
+        return
+
+    results = []
+    for backend in args.backends.split(","):
+        cmd = [sys.executable, __file__, "--run-backend", backend, "--repeat", str(args.repeat), "-k", str(args.k)]
+        if args.fake_embeddings:
+            cmd.append("--fake-embeddings")
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            results.append({"backend": backend, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Kiểm thử lớp gọi LLM (deadline, retry có jitter, hedging, circuit breaker) bằng FakeChatModel:
+chèn độ trễ, đuôi chậm và lỗi tạm thời, không cần Gemini.
+
+Chạy từ thư mục gốc của dự án:
+    python scripts/chaos_llm.py                                   # đuôi chậm 5%, lỗi 5%
+    python scripts/chaos_llm.py --hedge --slow-rate 0.1           # so sánh p99 khi bật hedging
+    python scripts/chaos_llm.py --error-rate 1 --requests 50      # upstream sập: circuit breaker thất bại nhanh
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_vector_backends import percentile
+
+
+async def run(args) -> dict:
+    from app.services.llm.client import LLMClient, CallPolicy, CircuitBreaker, LLMUnavailable
+    from app.services.llm.fake import FakeChatModel
+    from app.services.llm.governor import llm_governor
+
+    model = FakeChatModel(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.jitter_ms,
+        slow_rate=args.slow_rate,
+        slow_latency_ms=args.slow_latency_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    client = LLMClient(
+        policies={"chaos": CallPolicy(args.deadline, retries=args.retries, hedge=args.hedge)},
+        breaker=CircuitBreaker(args.failure_threshold, args.reset_seconds),
+        retry_base_delay=args.retry_base_delay,
+        hedge_min_samples=args.hedge_min_samples,
+    )
+    llm_governor.max_in_flight = max(llm_governor.max_in_flight, args.concurrency * 2)
+
+    outcomes = {"ok": 0, "unavailable": 0, "error": 0}
+    latencies = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await client.ainvoke(model, f"câu hỏi {i}", call_type="chaos")
+                outcomes["ok"] += 1
+            except LLMUnavailable:
+                outcomes["unavailable"] += 1
+            except Exception:
+                outcomes["error"] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": args.requests,
+        "outcomes": outcomes,
+        "elapsed_seconds": round(elapsed, 2),
+        "latency_ms": {q: round(percentile(latencies, q), 1) for q in (50, 95, 99)},
+        "model": dict(model.stats),
+        "client": client.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chaos test cho LLMClient với FakeChatModel.")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-latency-ms", type=float, default=1500)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--deadline", type=float, default=3.0)
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--retry-base-delay", type=float, default=0.05)
+    parser.add_argument("--hedge", action="store_true")
+    parser.add_argument("--hedge-min-samples", type=int, default=20)
+    parser.add_argument("--failure-threshold", type=int, default=5)
+    parser.add_argument("--reset-seconds", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Đánh giá bộ định tuyến ý định cục bộ (IntentRouter).
+
+Chạy từ thư mục gốc của dự án:
+    python scripts/eval_router.py --dataset data/router_eval.jsonl
+    python scripts/eval_router.py --rules-only
+
+Báo cáo: độ bao phủ (tỉ lệ lượt được định tuyến cục bộ), độ chính xác trên các lượt
+được định tuyến, và số lần gọi LLM (chọn tool) tiết kiệm trung bình mỗi lượt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.config import settings
+from app.services.chat.router import IntentRouter
+
+
+def load_dataset(path: str) -> list:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                items.append(json.loads(line))
+    return items
+
+
+def is_correct(decision: dict, item: dict) -> bool:
+    if decision["name"] != item["expected"]:
+        return False
+    expected_args = item.get("args")
+    if expected_args is None:
+        return True
+    return {k: v for k, v in decision["args"].items() if v} == expected_args
+
+
+async def evaluate(router: IntentRouter, items: list) -> dict:
+    routed = correct = 0
+    by_source = Counter()
+    errors = []
+    for item in items:
+        context = {"branch": None, "grade": None, "subject": None, **item.get("context", {})}
+        decision = await router.route(item["question"], context)
+        if decision is None:
+            continue
+        routed += 1
+        by_source[decision["source"]] += 1
+        if is_correct(decision, item):
+            correct += 1
+        else:
+            errors.append({"question": item["question"], "expected": item["expected"], "got": decision["name"], "args": decision["args"]})
+
+    total = len(items)
+    return {
+        "total": total,
+        "routed": routed,
+        "by_source": dict(by_source),
+        "coverage": routed / total if total else 0.0,
+        "routed_accuracy": correct / routed if routed else 0.0,
+        "llm_calls_saved_per_turn": routed / total if total else 0.0,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá bộ định tuyến ý định cục bộ.")
+    parser.add_argument("--dataset", default="data/router_eval.jsonl")
+    parser.add_argument("--threshold", type=float, default=settings.ROUTER_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--min-margin", type=float, default=settings.ROUTER_MIN_MARGIN)
+    parser.add_argument("--rules-only", action="store_true", help="Không tải mô hình embeddings, chỉ dùng luật từ khóa.")
+    args = parser.parse_args()
+
+    embeddings = None
+    if not args.rules_only:
+        from langchain_huggingface import HuggingFaceEmbeddings
+        embeddings = HuggingFaceEmbeddings(model_name=settings.EMBEDDING_MODEL)
+
+    router = IntentRouter(embeddings_provider=lambda: embeddings, threshold=args.threshold, min_margin=args.min_margin)
+    report = asyncio.run(evaluate(router, load_dataset(args.dataset)))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
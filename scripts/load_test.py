@@ -0,0 +1,174 @@
+"""
+Load test end-to-end cho /api/v1/stream: phát lại các kịch bản hội thoại (JSONL) với số người dùng ảo đồng thời,
+báo cáo TTFB, thời gian trọn lượt p50/p95/p99, throughput và số lần gọi DB/LLM mỗi lượt (lấy từ /api/v1/admin/metrics).
+
+Mỗi dòng kịch bản: {"name": "...", "turns": ["câu 1", "$option", ...]}; "$option" chọn ngẫu nhiên
+một lựa chọn (chi nhánh/khối/môn) mà bot vừa gửi, "$option:0" chọn lựa chọn đầu tiên.
+
+Chạy offline (model giả, API tuyển sinh giả, SQLite), một worker để số liệu DB/LLM mỗi lượt chính xác:
+    pip install -r requirements-dev.txt   # cần aiosqlite cho sqlite+aiosqlite
+    python scripts/stub_school_api.py &
+    export ADMIN_TOKEN=dev-token   # để đọc /api/v1/admin/metrics
+    LLM_PROVIDER=fake DATABASE_URL=sqlite+aiosqlite:///./loadtest.db DATABASE_ECHO=false \\
+        uvicorn app.main:app --port 7860 &
+    python scripts/load_test.py --concurrency 20 --conversations 200
+    python scripts/load_test.py --duration 60 --concurrency 50 --output load-report.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_vector_backends import percentile
+
+
+def load_scripts(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def resolve_turn(turn: str, options: list, rng: random.Random):
+    """Thay "$option"/"$option:i" bằng lựa chọn bot vừa gửi; trả về None nếu không có lựa chọn nào."""
+    if not turn.startswith("$option"):
+        return turn
+    if not options:
+        return None
+    _, _, index = turn.partition(":")
+    return options[int(index) % len(options)] if index else rng.choice(options)
+
+
+async def fetch_metrics(client, base_url: str, admin_token: str = None) -> dict:
+    try:
+        response = await client.get(f"{base_url}/api/v1/admin/metrics", headers={"X-Admin-Token": admin_token or ""})
+        return response.json() if response.status_code == 200 else {}
+    except Exception:
+        return {}
+
+
+def counters(metrics: dict) -> dict:
+    calls = metrics.get("llm_client", {}).get("calls", {})
+    return {
+        "db_statements": metrics.get("database", {}).get("statements", 0),
+        # Lời gọi logic (mỗi bước pipeline) và request thực tới model (gồm retry/hedge)
+        "llm_calls": sum(c.get("calls", 0) for c in calls.values()),
+        "llm_requests": metrics.get("llm_governor", {}).get("admitted", 0),
+    }
+
+
+async def run_turn(client, base_url: str, payload: dict, timeout: float) -> dict:
+    """Gửi một lượt chat, đọc hết SSE; trả về ttfb/thời gian trọn lượt và dữ liệu bot gửi về."""
+    result = {"status": None, "ttfb_ms": None, "total_ms": None, "session_id": None, "options": [], "error": None}
+    started = time.perf_counter()
+    buffer = ""
+    try:
+        async with client.stream("POST", f"{base_url}/api/v1/stream", json=payload, timeout=timeout) as response:
+            result["status"] = response.status_code
+            async for text in response.aiter_text():
+                if result["ttfb_ms"] is None and text:
+                    result["ttfb_ms"] = (time.perf_counter() - started) * 1000
+                buffer += text
+                while "\n\n" in buffer:
+                    event, buffer = buffer.split("\n\n", 1)
+                    if not event.startswith("data: "):
+                        continue
+                    data = json.loads(event[len("data: "):])
+                    result["session_id"] = data.get("session_id") or result["session_id"]
+                    result["options"] = data.get("options") or result["options"]
+                    result["error"] = data.get("error") or result["error"]
+    except Exception as e:
+        result["error"] = repr(e)
+    result["total_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def run(args) -> dict:
+    import httpx
+
+    scripts = load_scripts(args.scripts)
+    rng = random.Random(args.seed)
+    base_url = args.base_url.rstrip("/")
+    turns, outcomes = [], {"ok": 0, "rejected": 0, "error": 0, "skipped": 0}
+    remaining = {"conversations": args.conversations}
+    stop_at = time.monotonic() + args.duration if args.duration else None
+
+    def next_script():
+        if stop_at is not None:
+            return rng.choice(scripts) if time.monotonic() < stop_at else None
+        if remaining["conversations"] <= 0:
+            return None
+        remaining["conversations"] -= 1
+        return rng.choice(scripts)
+
+    async def virtual_user(user_index: int, client):
+        while (script := next_script()) is not None:
+            session_id, options = None, []
+            for turn in script["turns"]:
+                question = resolve_turn(turn, options, rng)
+                if question is None:
+                    outcomes["skipped"] += 1
+                    continue
+                payload = {"question": question, "user_id": f"load-{user_index}"}
+                if session_id:
+                    payload["session_id"] = session_id
+                result = await run_turn(client, base_url, payload, args.timeout)
+                if result["status"] == 429:
+                    outcomes["rejected"] += 1
+                    continue
+                if result["status"] != 200 or result["error"]:
+                    outcomes["error"] += 1
+                    continue
+                outcomes["ok"] += 1
+                turns.append(result)
+                session_id = result["session_id"] or session_id
+                options = result["options"]
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        before = counters(await fetch_metrics(client, base_url, args.admin_token))
+        started = time.perf_counter()
+        await asyncio.gather(*(virtual_user(i, client) for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        after = counters(await fetch_metrics(client, base_url, args.admin_token))
+
+    completed = len(turns)
+    ttfb = [t["ttfb_ms"] for t in turns if t["ttfb_ms"] is not None]
+    total = [t["total_ms"] for t in turns]
+    return {
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 2),
+        "turns": outcomes,
+        "throughput_turns_per_second": round(completed / elapsed, 2) if elapsed else 0.0,
+        "ttfb_ms": {f"p{q}": round(percentile(ttfb, q), 1) for q in (50, 95, 99)} if ttfb else {},
+        "turn_ms": {f"p{q}": round(percentile(total, q), 1) for q in (50, 95, 99)} if total else {},
+        "per_turn": {key: round((after[key] - before[key]) / completed, 2) if completed else 0.0 for key in before},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /api/v1/stream bằng kịch bản hội thoại.")
+    parser.add_argument("--base-url", default="http://localhost:7860")
+    parser.add_argument("--scripts", default="data/load_conversations.jsonl")
+    parser.add_argument("--concurrency", type=int, default=10, help="Số người dùng ảo chạy song song")
+    parser.add_argument("--conversations", type=int, default=100, help="Tổng số hội thoại (bỏ qua nếu có --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="Chạy trong N giây thay vì theo số hội thoại")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Ghi báo cáo JSON ra file")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN"), help="Token đọc /api/v1/admin/metrics (mặc định biến ADMIN_TOKEN)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
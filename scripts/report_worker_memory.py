@@ -0,0 +1,115 @@
+"""
+Báo cáo bộ nhớ của master và các worker (gunicorn/uvicorn): RSS, PSS, phần dùng chung và phần riêng,
+đọc từ /proc/<pid>/smaps_rollup (Linux >= 4.14).
+
+Tổng RSS đếm trùng các trang dùng chung; tổng PSS là bộ nhớ thực tế của cả nhóm tiến trình.
+Chạy trên máy đang chạy server:
+    python scripts/report_worker_memory.py                # tự tìm master gunicorn
+    python scripts/report_worker_memory.py --pid 12345    # chỉ định PID master
+"""
+import argparse
+import json
+import os
+import sys
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty", "Swap")
+
+
+def read_smaps_rollup(pid: int) -> dict:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            key = parts[0].rstrip(":")
+            if key in FIELDS:
+                values[key] = int(parts[1])  # kB
+    return values
+
+
+def read_cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def read_ppid(pid: int) -> int:
+    with open(f"/proc/{pid}/stat") as f:
+        # Tên tiến trình nằm trong ngoặc và có thể chứa dấu cách
+        return int(f.read().rsplit(")", 1)[1].split()[1])
+
+
+def list_children(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            if read_ppid(int(entry)) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return sorted(children)
+
+
+def find_master(pattern: str) -> int:
+    """Tiến trình khớp `pattern` mà tiến trình cha không khớp."""
+    candidates = [int(p) for p in os.listdir("/proc") if p.isdigit() and pattern in read_cmdline(int(p)) and int(p) != os.getpid()]
+    for pid in candidates:
+        try:
+            if read_ppid(pid) not in candidates:
+                return pid
+        except OSError:
+            continue
+    raise SystemExit(f"Không tìm thấy tiến trình khớp '{pattern}'")
+
+
+def describe(pid: int, role: str) -> dict:
+    m = read_smaps_rollup(pid)
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        "pid": pid,
+        "role": role,
+        "rss_mb": mb(m.get("Rss", 0)),
+        "pss_mb": mb(m.get("Pss", 0)),
+        "shared_mb": mb(m.get("Shared_Clean", 0) + m.get("Shared_Dirty", 0)),
+        "private_mb": mb(m.get("Private_Clean", 0) + m.get("Private_Dirty", 0)),
+        "swap_mb": mb(m.get("Swap", 0)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Báo cáo RSS/PSS/bộ nhớ dùng chung theo từng worker.")
+    parser.add_argument("--pid", type=int, help="PID tiến trình master.")
+    parser.add_argument("--pattern", default="gunicorn", help="Chuỗi trong cmdline để tự tìm master.")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file.")
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        sys.exit("Cần Linux có /proc/<pid>/smaps_rollup")
+
+    master = args.pid or find_master(args.pattern)
+    processes = [describe(master, "master")] + [describe(pid, "worker") for pid in list_children(master)]
+    workers = [p for p in processes if p["role"] == "worker"]
+
+    report = {
+        "master_pid": master,
+        "workers": len(workers),
+        "processes": processes,
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        # Bộ nhớ thực tế của cả nhóm (mỗi trang dùng chung chỉ tính một lần, chia đều)
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+        "worker_avg_private_mb": round(sum(p["private_mb"] for p in workers) / len(workers), 1) if workers else None,
+        "worker_avg_shared_mb": round(sum(p["shared_mb"] for p in workers) / len(workers), 1) if workers else None,
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+API tuyển sinh giả (common-data) phục vụ dữ liệu tổng hợp hoặc file JSON đã tải về,
+để chạy app/load test offline không cần backend thật.
+
+Chạy từ thư mục gốc của dự án:
+    python scripts/stub_school_api.py                                # http://localhost:8080/api/common-data
+    python scripts/stub_school_api.py --port 9090 --branches 3 --classes 500
+    python scripts/stub_school_api.py --input common-data.json --latency-ms 200
+
+Trỏ app tới API giả: SCHOOL_API_URL=http://localhost:8080/api/common-data
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from bench_school_snapshot import generate_payload
+
+
+def make_handler(body: bytes, latency_ms: float):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/api/common-data":
+                self.send_error(404)
+                return
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.info(f"{self.address_string()} - {format % args}")
+
+    return StubHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API tuyển sinh giả (common-data) cho phát triển và load test.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--input", help="File JSON common-data thật (mặc định: sinh dữ liệu tổng hợp)")
+    parser.add_argument("--branches", type=int, default=3)
+    parser.add_argument("--classes", type=int, default=300)
+    parser.add_argument("--teachers", type=int, default=60)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Độ trễ giả lập mỗi request")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            payload = json.load(f)
+    else:
+        payload = generate_payload(args.branches, args.classes, args.teachers, seed=args.seed)
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(body, args.latency_ms))
+    logging.info(f"API tuyển sinh giả: http://{args.host}:{args.port}/api/common-data ({len(body) / 1024:.0f} KB)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.v1.admin import router
+from app.core.config import settings
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("method, path", [
+    ("get", "/api/v1/admin/metrics"),
+    ("get", "/api/v1/admin/llm-usage"),
+    ("get", "/api/v1/admin/knowledge-base"),
+    ("post", "/api/v1/admin/knowledge-base/reload"),
+])
+def test_admin_requires_token(client, monkeypatch, method, path):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", None)
+    assert getattr(client, method)(path).status_code == 403
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    assert getattr(client, method)(path).status_code == 401
+    assert getattr(client, method)(path, headers={"X-Admin-Token": "sai"}).status_code == 401
+
+
+def test_admin_accepts_token(client, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    assert client.get("/api/v1/admin/knowledge-base", headers={"X-Admin-Token": "secret"}).status_code == 200
+    assert client.get("/api/v1/admin/knowledge-base", headers={"Authorization": "Bearer secret"}).status_code == 200
@@ -0,0 +1,58 @@
+import asyncio
+
+from app.services.chat import batch
+from app.services.chat.orchestrator import chat_orchestrator
+from app.services.llm.governor import BATCH_USER, current_user
+from app.services.llm.usage import persist_usage
+
+
+def test_run_batch_survives_malformed_items(monkeypatch):
+    seen = []
+
+    async def fake_process_message(question, session_id=None, user_id=None, memory=None):
+        seen.append((user_id, current_user.get(), persist_usage.get()))
+        return f"trả lời: {question}", session_id, [], []
+
+    monkeypatch.setattr(chat_orchestrator, "process_message", fake_process_message)
+    items = [
+        {"id": 1, "question": "Học phí lớp 10?", "expected_contains": "học phí"},
+        {"id": 2, "question": 123},
+        {"id": 3, "question": "Lịch học?", "context": "x"},
+        {"id": 4, "question": "Cơ sở nào gần nhất?"},
+    ]
+
+    async def collect():
+        return [result async for result in batch.run_batch(items, concurrency=2)]
+
+    results = asyncio.run(asyncio.wait_for(collect(), timeout=5))
+
+    assert sorted(result["index"] for result in results) == [0, 1, 2, 3]
+    errors = {result["id"] for result in results if "error" in result}
+    assert errors == {2, 3}
+    assert next(result for result in results if result["id"] == 1)["passed"] is True
+    assert seen and all(entry == (BATCH_USER, BATCH_USER, False) for entry in seen)
+
+
+def test_batch_endpoint_requires_admin_token(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.v1.batch import router
+    from app.core.config import settings
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    client = TestClient(app)
+    body = '{"question": "Học phí?"}\n{"question": 123}\n'
+
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", None)
+    assert client.post("/api/v1/batch", content=body).status_code == 403
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    assert client.post("/api/v1/batch", content=body).status_code == 401
+
+    response = client.post("/api/v1/batch", content=body, headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 400
+    assert "Dòng 2" in response.json()["detail"]
+
+    monkeypatch.setattr(settings, "BATCH_MAX_ITEMS", 1)
+    response = client.post("/api/v1/batch", content='{"question": "a"}\n{"question": "b"}\n', headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 413
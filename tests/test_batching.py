@@ -0,0 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.rag.batching import MicroBatcher, make_rerank_batcher
+
+
+def test_micro_batcher_returns_results_per_item():
+    batcher = MicroBatcher("test-ok", lambda items: [item * 2 for item in items], max_batch_size=8, max_wait_ms=20)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(batcher.run, range(8)))
+    assert results == [i * 2 for i in range(8)]
+    assert batcher.stats["items"] == 8
+
+
+def test_micro_batcher_fails_every_future_on_short_result():
+    batcher = MicroBatcher("test-short", lambda items: items[:-1], max_batch_size=8, max_wait_ms=20)
+    futures = [batcher.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=2)
+
+
+class BrokenPairwiseRanker:
+    """Ranker có thuộc tính nội bộ giống FlashRank nhưng chạy lỗi: batcher phải dùng `rerank` công khai."""
+    llm_model = None
+
+    class tokenizer:
+        @staticmethod
+        def encode_batch(pairs):
+            raise AttributeError("internal API changed")
+
+    class session:
+        @staticmethod
+        def run(*args):
+            raise AssertionError("không được gọi")
+
+    def __init__(self):
+        self.rerank_calls = 0
+
+    def rerank(self, request):
+        self.rerank_calls += 1
+        return [{"id": p["id"], "score": float(len(p["text"]))} for p in sorted(request.passages, key=lambda p: -len(p["text"]))]
+
+
+def test_rerank_batcher_falls_back_to_public_api():
+    ranker = BrokenPairwiseRanker()
+    batcher = make_rerank_batcher(ranker, max_batch_size=4, max_wait_ms=5)
+    assert batcher.run(("q", ["a", "abc"])) == [1.0, 3.0]
+    assert batcher.run(("q", ["ab"])) == [2.0]
+    assert ranker.rerank_calls == 2
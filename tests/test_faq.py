@@ -0,0 +1,31 @@
+from app.services.rag.faq import parse_faq
+
+
+def test_parse_faq_skips_blank_lines_and_separators():
+    text = "\n".join([
+        "Q: Học phí lớp 10?",
+        "",
+        "A: 2.000.000đ/tháng.",
+        "---",
+        "",
+        "Q: Trung tâm có mấy cơ sở?",
+        "A: Có hai cơ sở:",
+        "- Quận 1",
+        "",
+        "- Quận 3",
+    ])
+
+    assert parse_faq(text) == [
+        ("Học phí lớp 10?", "2.000.000đ/tháng."),
+        ("Trung tâm có mấy cơ sở?", "Có hai cơ sở:\n- Quận 1\n- Quận 3"),
+    ]
+
+
+def test_parse_faq_drops_questions_without_answer():
+    text = "Q: Câu hỏi bỏ dở\nQ: Lịch học?\nA: Thứ 2-4-6.\nQ: Câu hỏi cuối không có trả lời"
+    assert parse_faq(text) == [("Lịch học?", "Thứ 2-4-6.")]
+
+
+def test_parse_faq_joins_multiline_question_and_ignores_orphan_answer():
+    text = "A: Trả lời không có câu hỏi\nQ: Đăng ký học thử\nnhư thế nào?\nA: Gọi hotline."
+    assert parse_faq(text) == [("Đăng ký học thử như thế nào?", "Gọi hotline.")]
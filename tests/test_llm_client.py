@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.llm.client import CallPolicy, CircuitBreaker, CircuitOpen, LLMClient, LLMUnavailable
+from app.services.llm.fake import FakeChatModel, TransientLLMError
+from app.services.llm.governor import AdmissionRejected, LLMGovernor
+
+
+class ScriptedLatencyModel(FakeChatModel):
+    """FakeChatModel với độ trễ lần lượt theo `delays` (giây), hết danh sách thì trả ngay."""
+    delays: list = []
+
+    def _latency_seconds(self) -> float:
+        return self.delays.pop(0) if self.delays else 0.0
+
+
+def make_client(deadline=1.0, retries=0, hedge=False, breaker=None, governor=None, **kwargs):
+    return LLMClient(
+        policies={"test": CallPolicy(deadline, retries=retries, hedge=hedge)},
+        breaker=breaker or CircuitBreaker(failure_threshold=3, reset_timeout=60),
+        retry_base_delay=0.01,
+        governor=governor or LLMGovernor(max_in_flight=8, max_per_user=8, max_queue=16, queue_timeout=5),
+        **kwargs,
+    )
+
+
+def test_retries_transient_error():
+    calls = []
+
+    def responder(messages):
+        calls.append(1)
+        if len(calls) == 1:
+            raise TransientLLMError("503")
+        return "ok"
+
+    client = make_client(retries=1)
+    result = asyncio.run(client.ainvoke(FakeChatModel(responder=responder), "hỏi", call_type="test"))
+
+    assert result.content == "ok"
+    assert len(calls) == 2
+    assert client.stats["test"]["retries"] == 1
+    assert client.breaker.state == "closed"
+
+
+def test_non_transient_error_is_not_retried():
+    def responder(messages):
+        raise ValueError("bad request")
+
+    client = make_client(retries=2)
+    with pytest.raises(ValueError):
+        asyncio.run(client.ainvoke(FakeChatModel(responder=responder), "hỏi", call_type="test"))
+    assert client.stats["test"]["retries"] == 0
+    assert client.breaker.failures == 0
+
+
+def test_hedge_fires_after_p95():
+    client = make_client(deadline=5, hedge=True, hedge_min_samples=3)
+    model = ScriptedLatencyModel(delays=[0.01, 0.01, 0.01, 2.0, 0.01])
+
+    async def scenario():
+        for _ in range(3):
+            await client.ainvoke(model, "hỏi", call_type="test")
+        started = time.monotonic()
+        await client.ainvoke(model, "hỏi", call_type="test")
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+
+    assert elapsed < 1.0
+    assert client.stats["test"]["hedged"] == 1
+    assert client.stats["test"]["hedge_wins"] == 1
+    assert client.governor.in_flight == 0
+
+
+def test_deadline_exceeded_raises_unavailable():
+    client = make_client(deadline=0.1)
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(client.ainvoke(FakeChatModel(latency_ms=500), "hỏi", call_type="test"))
+    assert client.stats["test"]["timeouts"] == 1
+    assert client.breaker.failures == 1
+
+
+def test_breaker_opens_half_opens_and_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+    client = make_client(breaker=breaker)
+    model = FakeChatModel(error_rate=1.0)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(LLMUnavailable):
+                await client.ainvoke(model, "hỏi", call_type="test")
+        assert breaker.state == "open"
+        with pytest.raises(CircuitOpen):
+            await client.ainvoke(model, "hỏi", call_type="test")
+
+        await asyncio.sleep(0.15)
+        # Lời gọi thử thất bại -> mở lại
+        with pytest.raises(LLMUnavailable):
+            await client.ainvoke(model, "hỏi", call_type="test")
+        assert breaker.state == "open"
+
+        await asyncio.sleep(0.15)
+        model.error_rate = 0.0
+        await client.ainvoke(model, "hỏi", call_type="test")
+
+    asyncio.run(scenario())
+    assert breaker.state == "closed"
+    assert breaker.trips == 2
+
+
+def test_cancelled_probe_is_released():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = make_client(breaker=breaker)
+
+    async def scenario():
+        with pytest.raises(LLMUnavailable):
+            await client.ainvoke(FakeChatModel(error_rate=1.0), "hỏi", call_type="test")
+        await asyncio.sleep(0.1)
+
+        probe = asyncio.create_task(client.ainvoke(FakeChatModel(latency_ms=1000), "hỏi", call_type="test"))
+        await asyncio.sleep(0.05)
+        assert breaker.state == "half_open"
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        # Lời gọi thử bị hủy không được giữ breaker ở half_open mãi mãi
+        await client.ainvoke(FakeChatModel(), "hỏi", call_type="test")
+
+    asyncio.run(scenario())
+    assert breaker.state == "closed"
+    assert client.governor.in_flight == 0
+
+
+def test_cancelled_stream_probe_is_released():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    client = make_client(breaker=breaker)
+
+    async def scenario():
+        with pytest.raises(LLMUnavailable):
+            await client.ainvoke(FakeChatModel(error_rate=1.0), "hỏi", call_type="test")
+        await asyncio.sleep(0.1)
+
+        stream = client.astream(FakeChatModel(responses=["một hai ba"], token_delay_ms=50), "hỏi", call_type="test")
+        await anext(stream)
+        await stream.aclose()
+        assert client.governor.in_flight == 0
+
+        await client.ainvoke(FakeChatModel(), "hỏi", call_type="test")
+
+    asyncio.run(scenario())
+    assert breaker.state == "closed"
+
+
+def test_queue_wait_does_not_count_against_deadline():
+    governor = LLMGovernor(max_in_flight=1, max_per_user=8, max_queue=16, queue_timeout=5)
+    client = make_client(deadline=0.3, governor=governor)
+    model = FakeChatModel(latency_ms=150)
+
+    async def scenario():
+        return await asyncio.gather(*(client.ainvoke(model, "hỏi", call_type="test") for _ in range(4)))
+
+    results = asyncio.run(scenario())
+
+    assert len(results) == 4
+    assert client.stats["test"]["timeouts"] == 0
+    assert client.breaker.state == "closed"
+
+
+def test_queue_timeout_is_admission_rejected_not_breaker_failure():
+    governor = LLMGovernor(max_in_flight=1, max_per_user=8, max_queue=16, queue_timeout=0.05)
+    client = make_client(deadline=5, governor=governor, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    model = FakeChatModel(latency_ms=300)
+
+    async def scenario():
+        return await asyncio.gather(*(client.ainvoke(model, "hỏi", call_type="test") for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert sum(isinstance(r, AdmissionRejected) for r in results) == 2
+    assert client.breaker.state == "closed"
+    assert client.breaker.failures == 0
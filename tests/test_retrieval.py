@@ -0,0 +1,69 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from app.services.rag.retrievers import HybridRetriever, reciprocal_rank_fusion
+from app.services.rag.sparse import InvertedIndexRetriever, fold_accents, vi_tokenize
+
+DOCS = [
+    Document(page_content="Học phí lớp 10 là 2 triệu mỗi tháng.", metadata={"chunk_id": "hoc-phi"}),
+    Document(page_content="Lịch học các lớp tại chi nhánh Đà Lạt.", metadata={"chunk_id": "lich-hoc"}),
+    Document(page_content="Trung tâm có giáo viên giỏi và phí hợp lý.", metadata={"chunk_id": "gioi-thieu"}),
+]
+
+
+def doc(chunk_id):
+    return Document(page_content=chunk_id, metadata={"chunk_id": chunk_id})
+
+
+def test_vi_tokenize_folds_accents_and_adds_bigrams():
+    assert fold_accents("Học phí Đà Lạt") == "hoc phi da lat"
+    assert vi_tokenize("Học phí") == ["hoc", "phi", "hoc_phi"]
+
+
+def test_bm25_matches_unaccented_query():
+    retriever = InvertedIndexRetriever.from_documents(DOCS, k=2)
+    ranked = retriever.search("hoc phi lop 10")
+    assert ranked[0][0] == 0
+    # Bigram "hoc_phi" giúp tài liệu học phí vượt tài liệu chỉ chứa "học" hoặc "phí" rời
+    assert all(score < ranked[0][1] for _, score in ranked[1:])
+    assert [d.metadata["chunk_id"] for d in retriever.invoke("chi nhánh da lat")][0] == "lich-hoc"
+    assert retriever.search("không liên quan xyz") == []
+
+
+def test_sparse_index_save_load_round_trip(tmp_path):
+    retriever = InvertedIndexRetriever.from_documents(DOCS, k=3)
+    path = str(tmp_path / "sparse" / "index.json")
+    retriever.save(path)
+    loaded = InvertedIndexRetriever.load(path, k=3)
+
+    for query in ["học phí", "lich hoc da lat", "giáo viên"]:
+        assert loaded.search(query) == retriever.search(query)
+    assert loaded.documents == retriever.documents
+
+
+def test_rrf_weighting_and_overlap():
+    # Tài liệu có mặt trong cả hai danh sách đứng đầu
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("c"), doc("a")]], [0.5, 0.5], k=60)
+    assert [d.metadata["chunk_id"] for d, _ in fused][0] == "a"
+    assert fused[0][1] == 0.5 / 61 + 0.5 / 62
+
+    # Cùng thứ hạng: danh sách có trọng số cao hơn thắng
+    fused = reciprocal_rank_fusion([[doc("sparse")], [doc("dense")]], [0.3, 0.7], k=60)
+    assert [d.metadata["chunk_id"] for d, _ in fused] == ["dense", "sparse"]
+
+
+def test_rerank_skip_uses_relative_margin():
+    store = InMemoryVectorStore.from_documents(DOCS, DeterministicFakeEmbedding(size=16))
+    retriever = HybridRetriever.from_documents(DOCS, store, reranker=object(), rerank_skip_margin=0.3)
+
+    assert retriever._should_skip_rerank([(doc("a"), 1.0)])
+    assert retriever._should_skip_rerank([(doc("a"), 0.02), (doc("b"), 0.01)])
+    assert not retriever._should_skip_rerank([(doc("a"), 0.02), (doc("b"), 0.015)])
+    # Biên độ tương đối: cùng tỉ lệ thì cùng quyết định, bất kể thang điểm RRF
+    assert retriever._should_skip_rerank([(doc("a"), 20.0), (doc("b"), 10.0)])
+    assert not retriever._should_skip_rerank([(doc("a"), 0.0), (doc("b"), 0.0)])
+
+    # RRF với k=60: hạng 1 và hạng 2 chênh nhau rất ít -> vẫn rerank
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b"), doc("a")]], retriever.weights, retriever.rrf_k)
+    assert not retriever._should_skip_rerank(fused)
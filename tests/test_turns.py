@@ -0,0 +1,247 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.services.cache import redis_cache
+from app.services.chat import turns
+from app.services.chat.turns import TurnExpired, TurnRegistry
+
+
+class FakeRedis:
+    """Redis tối giản trong bộ nhớ (chuỗi + hash), đủ cho _claim/_mirror/_pull_remote."""
+
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = str(value)
+        return True
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def hset(self, name, mapping):
+        self.hashes.setdefault(name, {}).update({k: str(v) for k, v in mapping.items()})
+
+    def hdel(self, name, *fields):
+        for field in fields:
+            self.hashes.get(name, {}).pop(field, None)
+
+    def hmget(self, name, fields):
+        values = self.hashes.get(name, {})
+        return [values.get(field) for field in fields]
+
+    def expire(self, name, ttl):
+        return True
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        for name, args, kwargs in self.calls:
+            getattr(self.redis, name)(*args, **kwargs)
+
+
+@pytest.fixture
+def no_redis(monkeypatch):
+    monkeypatch.setattr(redis_cache, "_connected", True)
+    monkeypatch.setattr(redis_cache, "enabled", False)
+
+
+def events(count, delay=0.0, started=None):
+    async def producer():
+        if started is not None:
+            started.append(1)
+        for i in range(count):
+            await asyncio.sleep(delay)
+            yield f"data: {i}\n\n"
+    return producer
+
+
+async def collect(registry, turn, start=0):
+    return [chunk async for chunk in registry.sse(turn, start)]
+
+
+def test_duplicate_submission_returns_same_turn(no_redis):
+    registry = TurnRegistry(window=5, retention=60, max_events=100)
+    key = registry.turn_key("Học phí?", session_id="s1")
+    started = []
+
+    async def scenario():
+        first, coalesced_first = await registry.submit(key, events(3, 0.01, started))
+        second, coalesced_second = await registry.submit(key, events(3, 0.01, started))
+        streams = await asyncio.gather(collect(registry, first), collect(registry, second))
+        replay, replayed = await registry.submit(key, events(3, 0.01, started))
+        return first, second, replay, coalesced_first, coalesced_second, replayed, streams
+
+    first, second, replay, coalesced_first, coalesced_second, replayed, streams = asyncio.run(scenario())
+
+    assert first is second is replay
+    assert (coalesced_first, coalesced_second, replayed) == (False, True, True)
+    assert len(started) == 1
+    assert streams[0] == streams[1]
+    assert registry.stats["coalesced"] == 1 and registry.stats["replayed"] == 1
+
+
+def test_turn_keys_are_scoped():
+    assert TurnRegistry.turn_key("q", session_id="s1", idempotency_key="k") != TurnRegistry.turn_key("q", session_id="s2", idempotency_key="k")
+    assert TurnRegistry.turn_key("q", session_id="s1", idempotency_key="k") == TurnRegistry.turn_key("khác", session_id="s1", idempotency_key="k")
+    assert TurnRegistry.turn_key("Học  phí?", session_id="s1") == TurnRegistry.turn_key("học phí?", session_id="s1")
+    assert TurnRegistry.turn_key("q") is None
+    assert TurnRegistry.fingerprint("q", session_id="s1") != TurnRegistry.fingerprint("q", user_id="u2")
+
+
+def test_resume_from_event_id(no_redis):
+    registry = TurnRegistry(window=5, retention=60, max_events=100)
+
+    async def scenario():
+        turn, _ = await registry.submit(None, events(5))
+        await collect(registry, turn)
+        turn_id, index = registry.parse_event_id(registry.event_id(turn.turn_id, 2))
+        resumed = await registry.resume(turn_id)
+        return turn, resumed, await collect(registry, resumed, index + 1)
+
+    turn, resumed, replay = asyncio.run(scenario())
+
+    assert resumed is turn
+    assert replay == [f"id: {turn.turn_id}:3\ndata: 3\n\n", f"id: {turn.turn_id}:4\ndata: 4\n\n"]
+    assert registry.parse_event_id("không-hợp-lệ") is None
+    assert registry.parse_event_id(None) is None
+
+
+def test_resume_unknown_turn(no_redis):
+    registry = TurnRegistry(window=5, retention=60, max_events=100)
+    assert asyncio.run(registry.resume("khong-co")) is None
+
+
+def test_bounded_buffer_evicts_old_events(no_redis):
+    registry = TurnRegistry(window=5, retention=60, max_events=3)
+
+    async def scenario():
+        turn, _ = await registry.submit(None, events(5))
+        while not turn.done:
+            await asyncio.sleep(0.01)
+        return turn, await collect(registry, turn, 0), await collect(registry, turn, 2)
+
+    turn, expired, tail = asyncio.run(scenario())
+
+    assert turn.base == 2 and turn.count == 5
+    with pytest.raises(TurnExpired):
+        turn.since(1)
+    assert len(expired) == 1 and '"resume_expired": true' in expired[0]
+    assert [chunk.split("\n")[1] for chunk in tail] == ["data: 2", "data: 3", "data: 4"]
+    assert registry.stats["expired"] == 1
+
+
+def test_duplicate_across_workers_follows_redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_cache, "_connected", True)
+    monkeypatch.setattr(redis_cache, "enabled", True)
+    monkeypatch.setattr(redis_cache, "client", fake)
+    monkeypatch.setattr(turns, "REDIS_MIRROR_INTERVAL", 0.01)
+    monkeypatch.setattr(turns, "REDIS_POLL_INTERVAL", 0.01)
+    owner = TurnRegistry(window=5, retention=60, max_events=100)
+    other = TurnRegistry(window=5, retention=60, max_events=100)
+    key = owner.turn_key("Học phí?", session_id="s1")
+    started = []
+
+    async def scenario():
+        first, _ = await owner.submit(key, events(4, 0.01, started), scope="s1", fingerprint="fp")
+        second, coalesced = await other.submit(key, events(4, 0.01, started))
+        local, remote = await asyncio.gather(collect(owner, first), collect(other, second))
+        # Worker khác nối lại theo turn_id: đọc scope/fingerprint từ Redis
+        third = TurnRegistry(window=5, retention=60, max_events=100)
+        resumed = await third.resume(first.turn_id)
+        return first, second, coalesced, local, remote, resumed, await collect(third, resumed, 2)
+
+    first, second, coalesced, local, remote, resumed, tail = asyncio.run(scenario())
+
+    assert coalesced and second.turn_id == first.turn_id
+    assert len(started) == 1
+    assert local == remote
+    assert (resumed.scope, resumed.fingerprint) == ("s1", "fp")
+    assert tail == local[2:]
+
+
+@pytest.fixture
+def chat_client(monkeypatch, no_redis):
+    from app.api.v1.chat import router
+    from app.services.chat.orchestrator import chat_orchestrator
+
+    async def fake_stream(question, session_id=None, user_id=None, memory=None):
+        for word in f"Trả lời: {question}".split():
+            yield f'data: {{"text_chunk": "{word} "}}\n\n'
+
+    monkeypatch.setattr(chat_orchestrator, "process_message_stream", fake_stream)
+    monkeypatch.setattr(turns, "turn_registry", TurnRegistry(window=5, retention=60, max_events=100))
+    app = FastAPI()
+    app.include_router(router, prefix="/api/v1")
+    with TestClient(app) as client:
+        yield client
+
+
+def test_resume_rejected_across_sessions(chat_client):
+    body = {"question": "Học phí lớp 10?", "session_id": "s1"}
+    first = chat_client.post("/api/v1/stream", json=body)
+    turn_id = first.headers["X-Turn-Id"]
+    last_event = {"Last-Event-ID": f"{turn_id}:0"}
+
+    assert chat_client.get(f"/api/v1/stream/{turn_id}").status_code == 404
+    assert chat_client.get(f"/api/v1/stream/{turn_id}", params={"session_id": "s2"}).status_code == 404
+    own = chat_client.get(f"/api/v1/stream/{turn_id}", params={"session_id": "s1"})
+    assert own.status_code == 200 and own.text == first.text
+
+    # Cùng Last-Event-ID nhưng phiên khác hoặc câu hỏi khác: xử lý như câu hỏi mới
+    other_session = chat_client.post("/api/v1/stream", json={**body, "session_id": "s2"}, headers=last_event)
+    assert other_session.headers["X-Turn-Id"] != turn_id
+    assert "X-Turn-Resumed" not in other_session.headers
+    other_question = chat_client.post("/api/v1/stream", json={**body, "question": "Lịch học?"}, headers=last_event)
+    assert other_question.headers["X-Turn-Id"] != turn_id
+    assert "X-Turn-Resumed" not in other_question.headers
+
+    resumed = chat_client.post("/api/v1/stream", json=body, headers=last_event)
+    assert resumed.headers["X-Turn-Id"] == turn_id
+    assert resumed.headers["X-Turn-Resumed"] == "true"
+    assert resumed.text == first.text.split("\n\n", 1)[1]
+
+
+
+def test_stream_response_returned_before_first_event(chat_client, monkeypatch):
+    import time
+    from app.api.v1.chat import chat_stream
+    from app.schemas.chat import ChatInput
+    from app.services.chat.orchestrator import chat_orchestrator
+
+    async def slow_stream(question, session_id=None, user_id=None, memory=None):
+        await asyncio.sleep(0.5)
+        yield 'data: {"text_chunk": "xong"}\n\n'
+
+    monkeypatch.setattr(chat_orchestrator, "process_message_stream", slow_stream)
+
+    async def scenario():
+        started = time.monotonic()
+        response = await chat_stream(ChatInput(question="Chậm?", session_id="s9", include_timing=True), last_event_id=None)
+        returned_after = time.monotonic() - started
+        body = "".join([chunk async for chunk in response.body_iterator])
+        return response, returned_after, body
+
+    response, returned_after, body = asyncio.run(scenario())
+
+    # Header (kèm X-Turn-Id) gửi ngay, không chờ pipeline tới sự kiện đầu tiên
+    assert returned_after < 0.3
+    assert response.headers["X-Turn-Id"]
+    assert '"timing"' in body and '"ttfb_ms"' in body
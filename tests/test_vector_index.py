@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.core.config import settings
+from app.services.rag.vector_index import build_vector_store, export_embeddings, prune_index_directories
+
+DOCUMENTS = [Document(page_content=f"Câu hỏi {i}", metadata={"chunk_id": i}) for i in range(5)]
+
+
+@pytest.mark.parametrize("backend", ["numpy", "chroma"])
+def test_export_embeddings_round_trip(backend, tmp_path, monkeypatch):
+    if backend == "chroma":
+        pytest.importorskip("chromadb")
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    embeddings = DeterministicFakeEmbedding(size=16)
+    store = build_vector_store(DOCUMENTS, embeddings, collection_name=f"test_{backend}", backend=backend)
+
+    texts, vectors = export_embeddings(store)
+
+    assert sorted(texts) == sorted(doc.page_content for doc in DOCUMENTS)
+    assert vectors.shape == (len(DOCUMENTS), 16)
+    expected = np.asarray(embeddings.embed_documents([texts[0]])[0], dtype=np.float32)
+    cosine = float(vectors[0] @ expected / (np.linalg.norm(vectors[0]) * np.linalg.norm(expected)))
+    assert cosine == pytest.approx(1.0, abs=1e-5)
+    if backend == "chroma":
+        store.delete_collection()
+
+
+def test_prune_index_directories(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INDEX_DIR", str(tmp_path))
+    for name in ("knowledge_base-0123456789abcdef", "knowledge_base-fedcba9876543210", "faq_questions-0123456789abcdef", "other-0123456789abcdef", "knowledge_base-x"):
+        os.makedirs(tmp_path / name)
+    keep = [str(tmp_path / "knowledge_base-fedcba9876543210")]
+
+    removed = prune_index_directories(["knowledge_base", "faq_questions"], keep)
+
+    assert sorted(os.path.basename(path) for path in removed) == ["faq_questions-0123456789abcdef", "knowledge_base-0123456789abcdef"]
+    assert sorted(os.listdir(tmp_path)) == ["knowledge_base-fedcba9876543210", "knowledge_base-x", "other-0123456789abcdef"]